@@ -0,0 +1,184 @@
+import asyncio
+import collections
+import re
+import threading
+import time
+from typing import Deque, Dict, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Write endpoints that are subject to admission control, with the flow ID as the first group
+ADMISSION_CONTROLLED_PATHS = [
+    re.compile(r"^/flows/([^/]+)/segments$"),
+    re.compile(r"^/flows/([^/]+)/storage$"),
+]
+WRITE_METHODS = {"POST", "PUT", "DELETE"}
+
+# Window used to report the rejection rate
+REJECTION_RATE_WINDOW_SECONDS = 60.0
+
+
+class AdmissionRejected(Exception):
+    pass
+
+
+class _Waiter:
+    def __init__(self, flow_id: str):
+        self.flow_id = flow_id
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+
+
+class AdmissionController:
+    """Limits concurrent write requests globally and per flow.
+
+    Requests over the limits wait in a bounded FIFO queue and are rejected if the queue is full
+    or they have waited longer than `queue_timeout` seconds. Waiters are woken with futures on
+    their own event loop, so the controller is not tied to a single loop.
+    """
+    def __init__(self, global_limit: int, flow_limit: int, queue_size: int, queue_timeout: float):
+        self.global_limit = global_limit
+        self.flow_limit = flow_limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._flow_in_flight: Dict[str, int] = collections.defaultdict(int)
+        self._queue: Deque[_Waiter] = collections.deque()
+
+        self._admitted = 0
+        self._rejected = 0
+        self._rejections: Deque[float] = collections.deque()
+
+    async def acquire(self, flow_id: str) -> None:
+        with self._lock:
+            # Queued waiters are re-checked on every release, so any waiting request is blocked by
+            # its own flow limit and admitting this request does not jump ahead of it
+            if self._can_admit(flow_id):
+                self._admit(flow_id)
+                return
+            if len(self._queue) >= self.queue_size:
+                self._reject()
+                raise AdmissionRejected()
+            waiter = _Waiter(flow_id)
+            self._queue.append(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), self.queue_timeout)
+        except asyncio.TimeoutError:
+            with self._lock:
+                if waiter in self._queue:
+                    self._queue.remove(waiter)
+                    self._reject()
+                    raise AdmissionRejected()
+            # Admitted concurrently with the timeout
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter in self._queue:
+                    self._queue.remove(waiter)
+                    raise
+            self.release(flow_id)
+            raise
+
+    def release(self, flow_id: str) -> None:
+        with self._lock:
+            self._in_flight -= 1
+            self._flow_in_flight[flow_id] -= 1
+            if self._flow_in_flight[flow_id] == 0:
+                del self._flow_in_flight[flow_id]
+            self._wake_waiters()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            self._expire_rejections(now)
+            return {
+                "global_limit": self.global_limit,
+                "flow_limit": self.flow_limit,
+                "queue_size": self.queue_size,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "rejection_rate_per_second": len(self._rejections) / REJECTION_RATE_WINDOW_SECONDS,
+            }
+
+    def _can_admit(self, flow_id: str) -> bool:
+        return self._in_flight < self.global_limit and self._flow_in_flight.get(flow_id, 0) < self.flow_limit
+
+    def _admit(self, flow_id: str) -> None:
+        self._in_flight += 1
+        self._flow_in_flight[flow_id] += 1
+        self._admitted += 1
+
+    def _reject(self) -> None:
+        now = time.monotonic()
+        self._rejected += 1
+        self._rejections.append(now)
+        self._expire_rejections(now)
+
+    def _expire_rejections(self, now: float) -> None:
+        while self._rejections and now - self._rejections[0] > REJECTION_RATE_WINDOW_SECONDS:
+            self._rejections.popleft()
+
+    def _wake_waiters(self) -> None:
+        # Admit queued requests in order, skipping those whose flow is still at its limit
+        for waiter in list(self._queue):
+            if self._in_flight >= self.global_limit:
+                break
+            if self._can_admit(waiter.flow_id):
+                self._queue.remove(waiter)
+                self._admit(waiter.flow_id)
+                waiter.loop.call_soon_threadsafe(_set_admitted, waiter.future)
+
+
+def _set_admitted(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware applying an AdmissionController to segment ingest write endpoints.
+
+    Admission is decided before the request reaches the threadpool, so queued writes don't hold
+    threads and read endpoints, which are never queued, keep priority. Saturated requests get a
+    `429` response with a `Retry-After` header.
+    """
+    def __init__(self, app: ASGIApp, controller: AdmissionController, retry_after: int):
+        self.app = app
+        self.controller = controller
+        self.retry_after = retry_after
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        flow_id = self._controlled_flow_id(scope)
+        if flow_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            await self.controller.acquire(flow_id)
+        except AdmissionRejected:
+            response = JSONResponse(
+                {"detail": "Too many concurrent write requests"},
+                status_code=429,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(flow_id)
+
+    @staticmethod
+    def _controlled_flow_id(scope: Scope) -> Optional[str]:
+        if scope["type"] != "http" or scope["method"] not in WRITE_METHODS:
+            return None
+        for pattern in ADMISSION_CONTROLLED_PATHS:
+            match = pattern.match(scope["path"])
+            if match:
+                return match.group(1)
+        return None
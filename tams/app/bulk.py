@@ -0,0 +1,247 @@
+"""Bulk NDJSON export and import of TAMS sources, flows and segments.
+
+Each line of the NDJSON stream is a record of the form
+`{"collection": "segments", "id": "<document id>", "data": {...}}`. Records are written with
+their original document IDs, so replaying an import is idempotent.
+
+This module can also be run directly against Firestore:
+
+    python -m app.bulk export --output tams.ndjson.gz
+    python -m app.bulk import --input tams.ndjson.gz --checkpoint tams-import.json
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import zlib
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional, Set
+
+from app.flow_stats import rebuild_flow_stats
+
+logger = logging.getLogger(__name__)
+
+# Collections included in the export, in export order
+BULK_COLLECTIONS = ["sources", "flows", "segments"]
+
+# Firestore limits a batched write to 500 operations
+MAX_BATCH_SIZE = 500
+
+# Amount of uncompressed NDJSON buffered before it is handed to the compressor
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def export_records(db, page_size: int = 1000) -> Iterator[dict]:
+    """Yield all records page by page, so memory use is bounded by `page_size`"""
+    for collection in BULK_COLLECTIONS:
+        query = db.collection(collection).limit(page_size)
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = list(page_query.stream())
+            for doc in docs:
+                yield {"collection": collection, "id": doc.id, "data": doc.to_dict()}
+            if len(docs) < page_size:
+                break
+            last_doc = docs[-1]
+
+
+def export_ndjson_gz(db, page_size: int = 1000) -> Iterator[bytes]:
+    """Yield the export as chunks of a gzip compressed NDJSON stream"""
+    compressor = zlib.compressobj(wbits=31)
+    pending: List[bytes] = []
+    pending_size = 0
+    for record in export_records(db, page_size):
+        line = json.dumps(record, separators=(",", ":")).encode() + b"\n"
+        pending.append(line)
+        pending_size += len(line)
+        if pending_size >= EXPORT_CHUNK_SIZE:
+            chunk = compressor.compress(b"".join(pending))
+            pending = []
+            pending_size = 0
+            if chunk:
+                yield chunk
+
+    yield compressor.compress(b"".join(pending)) + compressor.flush()
+
+
+def open_ndjson(fileobj: BinaryIO) -> BinaryIO:
+    """Wrap `fileobj` in a gzip reader if it contains gzip compressed data"""
+    if fileobj.read(2) == GZIP_MAGIC:
+        fileobj.seek(0)
+        return gzip.GzipFile(fileobj=fileobj, mode="rb")  # type: ignore[return-value]
+    fileobj.seek(0)
+    return fileobj
+
+
+class _CollectionProgress:
+    """Tracks the contiguous prefix of committed records for a collection.
+
+    Batches may complete out of order when loaders run in parallel, so the checkpoint only
+    advances over batches whose predecessors have all been committed.
+    """
+    def __init__(self, committed: int):
+        self.committed = committed
+        self.next_start = committed
+        self.completed: Dict[int, int] = {}
+
+    def complete(self, start: int, count: int) -> None:
+        self.completed[start] = count
+        while self.committed in self.completed:
+            self.committed += self.completed.pop(self.committed)
+
+
+def import_ndjson(
+    db,
+    lines: Iterable[bytes],
+    checkpoint: Optional[Dict[str, int]] = None,
+    on_checkpoint: Optional[Callable[[Dict[str, int]], None]] = None,
+    batch_size: int = MAX_BATCH_SIZE,
+    workers: int = 8
+) -> Dict[str, int]:
+    """Import NDJSON records using batched writes from a pool of parallel loaders.
+
+    `checkpoint` maps each collection to the number of its records already committed by a
+    previous run; those records are skipped. `on_checkpoint` is called with the updated
+    checkpoint after each batch commit. Records are written as-is: segment overlap validation
+    is not applied, as the input is expected to come from an export. The statistics of the flows
+    that segments were imported into are then rebuilt from their segments.
+
+    Returns the number of records imported per collection by this run.
+    """
+    batch_size = min(batch_size, MAX_BATCH_SIZE)
+    progress = {
+        collection: _CollectionProgress((checkpoint or {}).get(collection, 0))
+        for collection in BULK_COLLECTIONS
+    }
+    skip = {collection: p.committed for collection, p in progress.items()}
+    seen = {collection: 0 for collection in BULK_COLLECTIONS}
+    imported = {collection: 0 for collection in BULK_COLLECTIONS}
+    pending: Dict[str, list] = {collection: [] for collection in BULK_COLLECTIONS}
+    lock = threading.Lock()
+    # Bound the number of parsed batches held in memory while loaders are busy
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    errors: List[BaseException] = []
+    # Includes flows of skipped records, in case a previous run was interrupted before rebuilding
+    segment_flow_ids: Set[str] = set()
+
+    def write_batch(collection: str, start: int, records: list) -> None:
+        try:
+            batch = db.batch()
+            col_ref = db.collection(collection)
+            for record in records:
+                batch.set(col_ref.document(record["id"]), record["data"])
+            batch.commit()
+
+            with lock:
+                progress[collection].complete(start, len(records))
+                imported[collection] += len(records)
+                if on_checkpoint is not None:
+                    on_checkpoint({c: p.committed for c, p in progress.items()})
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            in_flight.release()
+
+    def submit(executor: ThreadPoolExecutor, collection: str) -> None:
+        records = pending[collection]
+        pending[collection] = []
+        start = progress[collection].next_start
+        progress[collection].next_start += len(records)
+        in_flight.acquire()
+        executor.submit(write_batch, collection, start, records)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for line_number, line in enumerate(lines, start=1):
+            if errors:
+                break
+            if not line.strip():
+                continue
+
+            record = json.loads(line)
+            collection = record.get("collection")
+            if collection not in progress:
+                raise ValueError(f"Unsupported collection {collection!r} on line {line_number}")
+            if not isinstance(record.get("id"), str) or not isinstance(record.get("data"), dict):
+                raise ValueError(f"Invalid record on line {line_number}")
+
+            if collection == "segments" and isinstance(record["data"].get("flow_id"), str):
+                segment_flow_ids.add(record["data"]["flow_id"])
+
+            seen[collection] += 1
+            if seen[collection] <= skip[collection]:
+                continue
+
+            pending[collection].append(record)
+            if len(pending[collection]) >= batch_size:
+                submit(executor, collection)
+
+        if not errors:
+            for collection in BULK_COLLECTIONS:
+                if pending[collection]:
+                    submit(executor, collection)
+
+    if errors:
+        raise errors[0]
+
+    for flow_id in segment_flow_ids:
+        rebuild_flow_stats(db, flow_id)
+
+    return imported
+
+
+def main():
+    parser = ArgumentParser(prog="app.bulk", description="Bulk NDJSON export and import of a TAMS store")
+    parser.add_argument("--database", default=None, help="Firestore database. Defaults to FIRESTORE_DB_NAME")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export sources, flows and segments")
+    export_parser.add_argument("--output", required=True, help="Output gzip compressed NDJSON file")
+    export_parser.add_argument("--page-size", type=int, default=1000)
+
+    import_parser = subparsers.add_parser("import", help="Import sources, flows and segments")
+    import_parser.add_argument("--input", required=True, help="Input NDJSON file, optionally gzip compressed")
+    import_parser.add_argument("--checkpoint", help="Checkpoint file used to resume an interrupted import")
+    import_parser.add_argument("--batch-size", type=int, default=MAX_BATCH_SIZE)
+    import_parser.add_argument("--workers", type=int, default=8)
+
+    args = parser.parse_args()
+
+    from google.cloud import firestore
+    db = firestore.Client(database=args.database or os.environ.get("FIRESTORE_DB_NAME", "(default)"))
+
+    if args.command == "export":
+        with open(args.output, "wb") as f:
+            for chunk in export_ndjson_gz(db, args.page_size):
+                f.write(chunk)
+        return
+
+    checkpoint = None
+    on_checkpoint = None
+    if args.checkpoint:
+        if os.path.exists(args.checkpoint):
+            with open(args.checkpoint) as f:
+                checkpoint = json.load(f)
+            logger.info(f"Resuming import from checkpoint {checkpoint}")
+
+        def write_checkpoint(state):
+            tmp_filename = f"{args.checkpoint}.tmp"
+            with open(tmp_filename, "w") as f:
+                json.dump(state, f)
+            os.replace(tmp_filename, args.checkpoint)
+
+        on_checkpoint = write_checkpoint
+
+    with open(args.input, "rb") as f:
+        imported = import_ndjson(
+            db, open_ndjson(f), checkpoint, on_checkpoint, batch_size=args.batch_size, workers=args.workers)
+    logger.info(f"Imported {imported}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
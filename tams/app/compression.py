@@ -0,0 +1,104 @@
+import gzip
+from typing import List, Optional
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Bodies larger than this are compressed in the threadpool to avoid blocking the event loop
+THREADPOOL_COMPRESSION_SIZE = 64 * 1024
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick brotli or gzip from an Accept-Encoding header, preferring brotli when it is installed"""
+    accepted = {}
+    for item in accept_encoding.split(","):
+        parts = item.strip().split(";")
+        coding = parts[0].strip().lower()
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+
+    candidates: List[str] = ["br", "gzip"] if brotli is not None else ["gzip"]
+    wildcard = accepted.get("*", 0.0)
+    best = None
+    best_quality = 0.0
+    for coding in candidates:
+        quality = accepted.get(coding, wildcard)
+        if quality > best_quality:
+            best = coding
+            best_quality = quality
+    return best
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        # Quality 4 keeps compression time well below the serialisation cost of large listings
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+
+class CompressionMiddleware:
+    """Compresses complete response bodies of at least `minimum_size` bytes with brotli or gzip.
+
+    Streamed responses and responses that already have a Content-Encoding are passed through.
+    """
+    def __init__(self, app: ASGIApp, minimum_size: int):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+        passthrough = False
+
+        async def compressing_send(message: Message) -> None:
+            nonlocal start_message, passthrough
+            if passthrough:
+                await send(message)
+                return
+
+            if message["type"] == "http.response.start":
+                start_message = message
+                return
+
+            assert start_message is not None
+            body = message.get("body", b"")
+            headers = MutableHeaders(raw=start_message["headers"])
+            if (message.get("more_body", False) or len(body) < self.minimum_size
+                    or "content-encoding" in headers):
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            if len(body) > THREADPOOL_COMPRESSION_SIZE:
+                body = await run_in_threadpool(compress, body, encoding)
+            else:
+                body = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(body))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, compressing_send)
@@ -0,0 +1,59 @@
+import random
+
+from google.cloud import firestore
+
+# Per-flow statistics are spread over sharded counter documents so that busy live flows don't hit
+# Firestore's sustained write limit of one write per second per document
+FLOW_STATS_COLLECTION = "flow_stats_shards"
+
+
+def record_segment_changes(
+    db,
+    flow_id: str,
+    shard_count: int,
+    segment_count: int,
+    duration_ns: int,
+    object_bytes: int
+) -> None:
+    """Add the (possibly negative) changes to a randomly chosen shard of the flow's counters"""
+    if segment_count == 0:
+        return
+    shard = random.randrange(shard_count)
+    db.collection(FLOW_STATS_COLLECTION).document(f"{flow_id}:{shard}").set({
+        "flow_id": flow_id,
+        "segment_count": firestore.Increment(segment_count),
+        "duration_ns": firestore.Increment(duration_ns),
+        "object_bytes": firestore.Increment(object_bytes),
+    }, merge=True)
+
+
+def get_flow_stats(db, flow_id: str) -> dict:
+    """Sum the flow's counter shards, read with a single query"""
+    totals = {"segment_count": 0, "duration_ns": 0, "object_bytes": 0}
+    for doc in db.collection(FLOW_STATS_COLLECTION).where("flow_id", "==", flow_id).get():
+        shard = doc.to_dict()
+        for key in totals:
+            totals[key] += shard.get(key, 0)
+    return totals
+
+
+def delete_flow_stats(db, flow_id: str) -> None:
+    """Delete all of the flow's counter shards"""
+    for doc in db.collection(FLOW_STATS_COLLECTION).where("flow_id", "==", flow_id).get():
+        doc.reference.delete()
+
+
+def rebuild_flow_stats(db, flow_id: str) -> None:
+    """Recompute the flow's counters from its segments, for segments that were written without updating them"""
+    totals = {"segment_count": 0, "duration_ns": 0, "object_bytes": 0}
+    segments = db.collection("segments").where("flow_id", "==", flow_id)\
+        .select(["timerange_start", "timerange_end", "object_size"]).stream()
+    for doc in segments:
+        segment = doc.to_dict()
+        totals["segment_count"] += 1
+        if segment.get("timerange_start") is not None and segment.get("timerange_end") is not None:
+            totals["duration_ns"] += segment["timerange_end"] - segment["timerange_start"] + 1
+        totals["object_bytes"] += segment.get("object_size") or 0
+
+    delete_flow_stats(db, flow_id)
+    db.collection(FLOW_STATS_COLLECTION).document(f"{flow_id}:0").set({"flow_id": flow_id, **totals})
@@ -1,22 +1,81 @@
-from fastapi import FastAPI, HTTPException, Body, Response
-from app.models import Service, ServicePost, Source, Flow, FlowSegmentPost, FlowSegment, StorageBackend, WebhookPost, Webhook, StorageAllocationRequest, StorageAllocationResponse
-from typing import List, Union, Optional
+from fastapi import FastAPI, HTTPException, Body, Response, Request, Depends, Header
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse, JSONResponse
+from app.models import Service, ServicePost, Source, Flow, FlowSegmentPost, FlowSegment, StorageBackend, WebhookPost, Webhook, StorageAllocationRequest, StorageAllocationResponse, FlowStats
+from typing import List, Union, Optional, Tuple
 from google.cloud import firestore
 from google.cloud import storage
 import datetime
 import uuid
 import os
-from mediatimestamp.immutable import TimeRange
+from mediatimestamp.immutable import TimeRange, Timestamp
 import re
 import base64
+import hmac
 from cryptography.fernet import Fernet
+from app.storage_pool import StorageAllocationPool
+from app.bulk import export_ndjson_gz, import_ndjson, open_ndjson
+from app.admission import AdmissionController, AdmissionControlMiddleware
+from app.flow_stats import record_segment_changes, get_flow_stats, delete_flow_stats
+from app.compression import CompressionMiddleware
+import tempfile
 
 
 app = FastAPI(title="TAMS API on GCP")
 
+# Admission control for segment ingest writes. The global limit should stay below the threadpool
+# size (40 by default) so that read endpoints, which are never queued, always have threads available.
+admission_controller = AdmissionController(
+    global_limit=int(os.environ.get("TAMS_WRITE_CONCURRENCY", "16")),
+    flow_limit=int(os.environ.get("TAMS_FLOW_WRITE_CONCURRENCY", "4")),
+    queue_size=int(os.environ.get("TAMS_WRITE_QUEUE_SIZE", "64")),
+    queue_timeout=float(os.environ.get("TAMS_WRITE_QUEUE_TIMEOUT_SECONDS", "10"))
+)
+app.add_middleware(
+    AdmissionControlMiddleware,
+    controller=admission_controller,
+    retry_after=int(os.environ.get("TAMS_WRITE_RETRY_AFTER_SECONDS", "1"))
+)
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get("TAMS_COMPRESSION_MINIMUM_SIZE", "1024"))
+)
+
+# Expiry of the presigned URLs handed out for media object GET and PUT
+STORAGE_URL_EXPIRATION = datetime.timedelta(minutes=15)
+
+# Number of sharded counter documents holding each flow's segment statistics
+FLOW_STATS_SHARDS = int(os.environ.get("TAMS_FLOW_STATS_SHARDS", "10"))
+
 # Validation and encryption utilities
 SAFE_OBJECT_ID_REGEX = re.compile(r"^[a-zA-Z0-9_\-\.]+$")
 
+def timerange_bounds_ns(timerange: str) -> Tuple[Optional[int], Optional[int]]:
+    """Return the inclusive start and end in nanoseconds of a timerange string, None where it is unbounded"""
+    tr = TimeRange.from_str(timerange)
+    if tr.is_empty():
+        raise ValueError("timerange is empty")
+    start_ns = tr.start.to_nanosec() + (0 if tr.includes_start() else 1) if tr.start is not None else None
+    end_ns = tr.end.to_nanosec() - (0 if tr.includes_end() else 1) if tr.end is not None else None
+    return start_ns, end_ns
+
+def parse_fields(fields: Optional[str], model) -> Optional[List[str]]:
+    """Parse a comma separated `fields` projection parameter, validated against the model's fields"""
+    if fields is None:
+        return None
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in model.model_fields]
+    if not names or unknown:
+        raise HTTPException(status_code=400, detail=f"Invalid fields parameter: {', '.join(unknown) or fields}")
+    return names
+
+def project(docs: List[dict], fields: List[str]) -> JSONResponse:
+    # Projected documents may omit required model fields, so bypass response model validation
+    return JSONResponse([
+        {name: doc[name] for name in fields if doc.get(name) is not None}
+        for doc in docs
+    ])
+
 def is_safe_object_id(object_id: str) -> bool:
     if not SAFE_OBJECT_ID_REGEX.match(object_id):
         return False
@@ -95,10 +154,12 @@ def post_service(service_post: ServicePost):
         return {"message": "No updates provided"}
 
 @app.get("/sources", response_model=List[Source], response_model_exclude_none=True)
-def get_sources(limit: int = 10):
-    sources_ref = db.collection("sources")
-    docs = sources_ref.limit(limit).stream()
-    return [doc.to_dict() for doc in docs]
+def get_sources(limit: int = 10, fields: Optional[str] = None):
+    field_names = parse_fields(fields, Source)
+    query = db.collection("sources").limit(limit)
+    if field_names:
+        return project([doc.to_dict() for doc in query.select(field_names).stream()], field_names)
+    return [doc.to_dict() for doc in query.stream()]
 
 @app.get("/sources/{sourceId}", response_model=Source, response_model_exclude_none=True)
 def get_source(sourceId: str):
@@ -168,10 +229,12 @@ def delete_source_tag(sourceId: str, name: str):
     return
 
 @app.get("/flows", response_model=List[Flow], response_model_exclude_none=True)
-def get_flows(limit: int = 10):
-    flows_ref = db.collection("flows")
-    docs = flows_ref.limit(limit).stream()
-    return [doc.to_dict() for doc in docs]
+def get_flows(limit: int = 10, fields: Optional[str] = None):
+    field_names = parse_fields(fields, Flow)
+    query = db.collection("flows").limit(limit)
+    if field_names:
+        return project([doc.to_dict() for doc in query.select(field_names).stream()], field_names)
+    return [doc.to_dict() for doc in query.stream()]
 
 @app.get("/flows/{flowId}", response_model=Flow, response_model_exclude_none=True)
 def get_flow(flowId: str):
@@ -182,6 +245,32 @@ def get_flow(flowId: str):
     else:
         raise HTTPException(status_code=404, detail="Flow not found")
 
+def link_collected_sources(collection_source_id: str, flow_collection: List[dict]):
+    """Set the source_collection of a multi-essence flow's source from the sources of the collected flows,
+    and add the collection source to their collected_by"""
+    source_collection = []
+    for item in flow_collection:
+        collected_doc = db.collection("flows").document(item["id"]).get()
+        if not collected_doc.exists:
+            continue
+        collected_flow = collected_doc.to_dict()
+        collected_source_id = collected_flow["source_id"]
+        if collected_source_id == collection_source_id:
+            continue
+        if any(source["id"] == collected_source_id for source in source_collection):
+            continue
+        # Renditions of the same content share a source, so the source role is its format rather than the flow role
+        source_collection.append({"id": collected_source_id, "role": collected_flow["format"].rsplit(":", 1)[-1]})
+
+        collected_source_ref = db.collection("sources").document(collected_source_id)
+        collected_source_doc = collected_source_ref.get()
+        if collected_source_doc.exists:
+            collected_by = collected_source_doc.to_dict().get("collected_by") or []
+            if collection_source_id not in collected_by:
+                collected_source_ref.update({"collected_by": collected_by + [collection_source_id]})
+
+    db.collection("sources").document(collection_source_id).update({"source_collection": source_collection})
+
 @app.put("/flows/{flowId}", status_code=200)
 def put_flow(flowId: str, flow: Flow, response: Response):
     doc_ref = db.collection("flows").document(flowId)
@@ -200,6 +289,9 @@ def put_flow(flowId: str, flow: Flow, response: Response):
             "description": "Source created automatically when flow was created."
         }
         source_ref.set(source_data)
+
+    if flow.flow_collection:
+        link_collected_sources(flow.source_id, flow.flow_collection)
         
     flow_data = flow.model_dump()
     flow_data["id"] = flowId
@@ -225,6 +317,7 @@ def delete_flow(flowId: str):
     if not doc.exists:
         raise HTTPException(status_code=404, detail="Flow not found")
     doc_ref.delete()
+    delete_flow_stats(db, flowId)
     return
 
 @app.post("/flows/{flowId}/segments", status_code=201)
@@ -239,6 +332,9 @@ def create_flow_segments(flowId: str, segments: Union[FlowSegmentPost, List[Flow
         segments = [segments]
         
     failed_segments = []
+    created_count = 0
+    created_duration_ns = 0
+    created_bytes = 0
     for seg in segments:
         if not is_safe_object_id(seg.object_id):
             failed_segments.append({
@@ -281,8 +377,11 @@ def create_flow_segments(flowId: str, segments: Union[FlowSegmentPost, List[Flow
             seg_data["flow_id"] = flowId
             seg_data["timerange_start"] = start_ns
             seg_data["timerange_end"] = end_ns
-            
             db.collection("segments").add(seg_data)
+
+            created_count += 1
+            created_duration_ns += end_ns - start_ns + 1
+            created_bytes += seg.object_size or 0
             
         except Exception as e:
             failed_segments.append({
@@ -291,6 +390,11 @@ def create_flow_segments(flowId: str, segments: Union[FlowSegmentPost, List[Flow
                 "error": str(e)
             })
             
+    record_segment_changes(db, flowId, FLOW_STATS_SHARDS, created_count, created_duration_ns, created_bytes)
+    if created_count:
+        # Lets clients cache segment listings, e.g. generated playlists, until the segments change
+        flow_ref.update({"segments_updated": datetime.datetime.now(datetime.timezone.utc).isoformat() + "Z"})
+
     if failed_segments:
         response.status_code = 200
         return {"failed_segments": failed_segments}
@@ -298,32 +402,67 @@ def create_flow_segments(flowId: str, segments: Union[FlowSegmentPost, List[Flow
     return {"message": "Segments created successfully"}
 
 @app.get("/flows/{flowId}/segments", response_model=List[FlowSegmentPost], response_model_exclude_none=True)
-def get_flow_segments(flowId: str, timerange: Optional[str] = None, limit: Optional[int] = 100, presigned: bool = False):
+def get_flow_segments(
+    flowId: str,
+    request: Request,
+    response: Response,
+    timerange: Optional[str] = None,
+    limit: int = 100,
+    page: Optional[str] = None,
+    presigned: bool = False,
+    fields: Optional[str] = None
+):
+    field_names = parse_fields(fields, FlowSegmentPost)
+    if limit < 1:
+        raise HTTPException(status_code=400, detail="Invalid limit parameter: must be at least 1")
     query = db.collection("segments").where("flow_id", "==", flowId)
-    
-    segments = []
-    
+    if field_names:
+        # Only read the requested fields, plus those needed for filtering, paging and URL signing
+        query = query.select(list(set(field_names) | {"object_id", "timerange_start", "timerange_end"}))
+        presigned = presigned and "get_urls" in field_names
+
+    start_ns = None
+    end_ns = None
     if timerange:
         try:
-            tr = TimeRange.from_str(timerange)
-            start_ns = tr.start.to_nanosec() + (0 if tr.includes_start() else 1)
-            end_ns = tr.end.to_nanosec() - (0 if tr.includes_end() else 1)
-            
-            # Fetch only segments starting before or at the requested end point
-            docs = query.where("timerange_start", "<=", end_ns).get()
-            for doc in docs:
-                seg = doc.to_dict()
-                if seg["timerange_end"] >= start_ns:
-                    segments.append(seg)
+            start_ns, end_ns = timerange_bounds_ns(timerange)
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Invalid timerange parameter: {e}")
-    else:
-        # Prevent OOM by limiting database-side when listing
-        docs = query.limit(limit).get()
-        for doc in docs:
-            segments.append(doc.to_dict())
-            
-    segments = segments[:limit]
+
+    # Segments are paged in timeline order. The page key is the start of the last segment of the previous page,
+    # which is unique because a flow's segments don't overlap
+    page_start = None
+    if page is not None:
+        try:
+            page_start = int(page)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid page parameter")
+
+    segments = []
+    if page_start is None and start_ns is not None:
+        # At most one segment that starts before the timerange can overlap it, and as segments don't overlap it is
+        # the first to end in the timerange. This uses the (flow_id, timerange_end) index
+        docs = query.where("timerange_end", ">=", start_ns).order_by("timerange_end").limit(1).get()
+        segments.extend(seg for seg in (doc.to_dict() for doc in docs) if seg["timerange_start"] < start_ns)
+
+    page_query = query.order_by("timerange_start")
+    if page_start is not None:
+        page_query = page_query.where("timerange_start", ">", page_start)
+    elif start_ns is not None:
+        page_query = page_query.where("timerange_start", ">=", start_ns)
+    if end_ns is not None:
+        page_query = page_query.where("timerange_start", "<=", end_ns)
+    # Read one more segment than the limit to find out whether there is a next page
+    for doc in page_query.limit(limit + 1 - len(segments)).get():
+        segments.append(doc.to_dict())
+
+    paging_headers = {"X-Paging-Limit": str(limit)}
+    if len(segments) > limit:
+        segments = segments[:limit]
+        next_key = str(segments[-1]["timerange_start"])
+        paging_headers["X-Paging-NextKey"] = next_key
+        paging_headers["Link"] = f'<{request.url.include_query_params(page=next_key)}>; rel="next"'
+    response.headers.update(paging_headers)
     
     if presigned and segments:
         bucket_name = os.environ.get("TAMS_BUCKET_NAME", "tams-objects-bucket")
@@ -353,7 +492,7 @@ def get_flow_segments(flowId: str, timerange: Optional[str] = None, limit: Optio
             try:
                 kwargs = {
                     "version": "v4",
-                    "expiration": datetime.timedelta(minutes=15),
+                    "expiration": STORAGE_URL_EXPIRATION,
                     "method": "GET"
                 }
                 if service_account_email:
@@ -364,36 +503,68 @@ def get_flow_segments(flowId: str, timerange: Optional[str] = None, limit: Optio
                 seg["get_urls"] = [{"url": url}]
             except Exception as e:
                 raise HTTPException(status_code=500, detail=f"Failed to generate signed URL for GET: {e}")
-    
+
+    if field_names:
+        projected = project(segments, field_names)
+        projected.headers.update(paging_headers)
+        return projected
     return segments
 
 @app.delete("/flows/{flowId}/segments", status_code=204)
 def delete_flow_segments(flowId: str, timerange: Optional[str] = None):
     query = db.collection("segments").where("flow_id", "==", flowId)
-    
+    deleted = []
+
     if not timerange:
         docs = query.get()
         for doc in docs:
             doc.reference.delete()
-        return
-        
-    try:
-        tr = TimeRange.from_str(timerange)
-        start_ns = tr.start.to_nanosec() + (0 if tr.includes_start() else 1)
-        end_ns = tr.end.to_nanosec() - (0 if tr.includes_end() else 1)
-        
-        # Optimize by fetching only segments starting before or at end_ns
-        docs = query.where("timerange_start", "<=", end_ns).get()
-        for doc in docs:
-            data = doc.to_dict()
-            if data["timerange_start"] >= start_ns and data["timerange_end"] <= end_ns:
-                doc.reference.delete()
-                
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Invalid timerange parameter: {e}")
-        
+            deleted.append(doc.to_dict())
+    else:
+        try:
+            start_ns, end_ns = timerange_bounds_ns(timerange)
+
+            # Optimize by fetching only segments starting within the timerange
+            if start_ns is not None:
+                query = query.where("timerange_start", ">=", start_ns)
+            if end_ns is not None:
+                query = query.where("timerange_start", "<=", end_ns)
+            docs = query.get()
+            for doc in docs:
+                data = doc.to_dict()
+                if end_ns is None or data["timerange_end"] <= end_ns:
+                    doc.reference.delete()
+                    deleted.append(data)
+
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid timerange parameter: {e}")
+
+    record_segment_changes(
+        db,
+        flowId,
+        FLOW_STATS_SHARDS,
+        -len(deleted),
+        -sum(data["timerange_end"] - data["timerange_start"] + 1 for data in deleted),
+        -sum(data.get("object_size") or 0 for data in deleted)
+    )
+    if deleted:
+        flow_ref = db.collection("flows").document(flowId)
+        if flow_ref.get().exists:
+            flow_ref.update({"segments_updated": datetime.datetime.now(datetime.timezone.utc).isoformat() + "Z"})
     return
 
+@app.get("/flows/{flowId}/stats", response_model=FlowStats)
+def get_flow_segment_stats(flowId: str):
+    if not db.collection("flows").document(flowId).get().exists:
+        raise HTTPException(status_code=404, detail="Flow not found")
+
+    stats = get_flow_stats(db, flowId)
+    return {
+        "segment_count": stats["segment_count"],
+        "total_duration": Timestamp.from_nanosec(stats["duration_ns"]).to_sec_nsec(),
+        "total_bytes": stats["object_bytes"]
+    }
+
 @app.get("/service/storage-backends", response_model=List[StorageBackend], response_model_exclude_none=True)
 def get_storage_backends():
     docs = db.collection("storage_backends").get()
@@ -472,55 +643,37 @@ def delete_webhook(webhookId: str):
     doc_ref.delete()
     return
 
-@app.post("/flows/{flowId}/storage", response_model=StorageAllocationResponse, status_code=201)
-def allocate_flow_storage(flowId: str, req: StorageAllocationRequest):
-    flow_ref = db.collection("flows").document(flowId)
-    if not flow_ref.get().exists:
-        raise HTTPException(status_code=404, detail="Flow not found")
-        
+def sign_media_object_allocations(flowId: str, count: int, resumable: bool = False) -> List[dict]:
     bucket_name = os.environ.get("TAMS_BUCKET_NAME", "tams-objects-bucket")
-    
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to initialize storage client: {e}")
+    storage_client = storage.Client()
+    bucket = storage_client.bucket(bucket_name)
+
+    # Refresh credentials once per batch rather than once per object
+    signing_kwargs = {}
+    service_account_email = os.environ.get("SERVICE_ACCOUNT_EMAIL")
+    if service_account_email:
+        import google.auth
+        from google.auth.transport import requests as auth_requests
+
+        credentials, project_id = google.auth.default()
+        auth_request = auth_requests.Request()
+        credentials.refresh(auth_request)
+        signing_kwargs["service_account_email"] = service_account_email
+        signing_kwargs["access_token"] = credentials.token
 
     media_objects = []
-    for _ in range(req.limit):
+    for _ in range(count):
         object_id = str(uuid.uuid4())
-        blob_name = f"{flowId}/{object_id}"
-        blob = bucket.blob(blob_name)
-        
-        try:
-            service_account_email = os.environ.get("SERVICE_ACCOUNT_EMAIL")
-            
-            if service_account_email:
-                import google.auth
-                from google.auth.transport import requests as auth_requests
-                
-                credentials, project_id = google.auth.default()
-                auth_request = auth_requests.Request()
-                credentials.refresh(auth_request)
-                
-                url = blob.generate_signed_url(
-                    version="v4",
-                    expiration=datetime.timedelta(minutes=15),
-                    method="PUT",
-                    content_type="video/mp2t",
-                    service_account_email=service_account_email,
-                    access_token=credentials.token
-                )
-            else:
-                url = blob.generate_signed_url(
-                    version="v4",
-                    expiration=datetime.timedelta(minutes=15),
-                    method="PUT",
-                    content_type="video/mp2t"
-                )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Failed to generate signed URL: {e}")
-            
+        blob = bucket.blob(f"{flowId}/{object_id}")
+        # A RESUMABLE URL is used in a POST with the "x-goog-resumable: start" header, which returns the URL of an
+        # upload session that accepts the object in chunks
+        url = blob.generate_signed_url(
+            version="v4",
+            expiration=STORAGE_URL_EXPIRATION,
+            method="RESUMABLE" if resumable else "PUT",
+            content_type="video/mp2t",
+            **signing_kwargs
+        )
         media_objects.append({
             "object_id": object_id,
             "put_url": {
@@ -528,23 +681,92 @@ def allocate_flow_storage(flowId: str, req: StorageAllocationRequest):
                 "content-type": "video/mp2t"
             }
         })
-        
-    return {"media_objects": media_objects}
-
-
-
-
-
-
-
-
+    return media_objects
 
 
+# Pool of pre-signed allocations served by POST /flows/{flowId}/storage. Disabled when the depth is 0.
+# The pool TTL must stay below STORAGE_URL_EXPIRATION so that pooled URLs are still valid when handed out.
+STORAGE_POOL_DEPTH = int(os.environ.get("TAMS_STORAGE_POOL_DEPTH", "0"))
+storage_pool = None
+if STORAGE_POOL_DEPTH > 0:
+    storage_pool = StorageAllocationPool(
+        sign_media_object_allocations,
+        depth=STORAGE_POOL_DEPTH,
+        ttl_seconds=min(
+            float(os.environ.get("TAMS_STORAGE_POOL_TTL_SECONDS", "600")),
+            STORAGE_URL_EXPIRATION.total_seconds() - 60
+        ),
+        idle_seconds=float(os.environ.get("TAMS_STORAGE_POOL_IDLE_SECONDS", "600"))
+    )
 
 
+@app.post("/flows/{flowId}/storage", response_model=StorageAllocationResponse, status_code=201)
+def allocate_flow_storage(flowId: str, req: StorageAllocationRequest):
+    flow_ref = db.collection("flows").document(flowId)
+    if not flow_ref.get().exists:
+        raise HTTPException(status_code=404, detail="Flow not found")
 
+    try:
+        if storage_pool is not None and not req.resumable:
+            media_objects = storage_pool.take(flowId, req.limit)
+        else:
+            media_objects = sign_media_object_allocations(flowId, req.limit, resumable=req.resumable)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to generate signed URL: {e}")
 
+    return {"media_objects": media_objects}
 
 
+@app.get("/service/metrics")
+def get_service_metrics():
+    metrics = {"admission": admission_controller.stats()}
+    if storage_pool is not None:
+        metrics["storage_pool"] = storage_pool.stats()
+    return metrics
+
+
+# The bulk admin endpoints can read or overwrite the whole store, so are disabled unless explicitly enabled.
+# When TAMS_ADMIN_API_KEY is set, requests must also send it in the X-Admin-Api-Key header.
+ADMIN_ENDPOINTS_ENABLED = os.environ.get("TAMS_ADMIN_ENDPOINTS_ENABLED", "false").lower() in ("1", "true", "yes")
+ADMIN_API_KEY = os.environ.get("TAMS_ADMIN_API_KEY")
+
+def require_admin(x_admin_api_key: Optional[str] = Header(None)):
+    if not ADMIN_ENDPOINTS_ENABLED:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled")
+    if ADMIN_API_KEY and not hmac.compare_digest((x_admin_api_key or "").encode(), ADMIN_API_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin API key")
+
+
+@app.get("/admin/export", dependencies=[Depends(require_admin)])
+def export_store(page_size: int = 1000):
+    return StreamingResponse(
+        export_ndjson_gz(db, page_size),
+        media_type="application/gzip",
+        headers={"Content-Disposition": 'attachment; filename="tams-export.ndjson.gz"'}
+    )
+
+@app.post("/admin/import", dependencies=[Depends(require_admin)])
+async def import_store(request: Request, import_id: Optional[str] = None):
+    # Spool the upload so that large imports don't have to be held in memory
+    with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+
+        # Resume from the checkpoint of a previous attempt with the same import_id
+        checkpoint = None
+        on_checkpoint = None
+        if import_id:
+            checkpoint_ref = db.collection("bulk_import_checkpoints").document(import_id)
+            checkpoint_doc = checkpoint_ref.get()
+            if checkpoint_doc.exists:
+                checkpoint = checkpoint_doc.to_dict()
+
+            on_checkpoint = checkpoint_ref.set
 
+        try:
+            imported = await run_in_threadpool(import_ndjson, db, open_ndjson(spool), checkpoint, on_checkpoint)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid import data: {e}")
 
+    return {"imported": imported}
@@ -64,12 +64,19 @@ class FlowSegmentPost(BaseModel):
     sample_count: Optional[int] = None
     get_urls: Optional[List[dict]] = None
     key_frame_count: Optional[int] = None
+    # Size in bytes of the media object, as reported by the client that uploaded it, counted in the flow statistics
+    object_size: Optional[int] = None
 
 class FlowSegment(FlowSegmentPost):
     flow_id: str
     timerange_start: int
     timerange_end: int
 
+class FlowStats(BaseModel):
+    segment_count: int
+    total_duration: str
+    total_bytes: int
+
 
 class StorageBackend(BaseModel):
     id: str
@@ -98,6 +105,8 @@ class Webhook(BaseModel):
 
 class StorageAllocationRequest(BaseModel):
     limit: int
+    # Allocate URLs that start a resumable upload session rather than URLs for a single PUT
+    resumable: bool = False
 
 class PutUrl(BaseModel):
     url: str
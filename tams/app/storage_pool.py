@@ -0,0 +1,159 @@
+import collections
+import logging
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Window used to report the background refill rate
+REFILL_RATE_WINDOW_SECONDS = 60.0
+
+
+class _FlowPool:
+    def __init__(self):
+        # Entries are (expires_at, media_object) tuples, oldest first
+        self.entries: Deque[Tuple[float, dict]] = collections.deque()
+        self.last_used = time.monotonic()
+
+
+class StorageAllocationPool:
+    """Per-flow pool of pre-signed media object allocations.
+
+    A background thread keeps each recently used flow topped up to `depth` allocations by
+    calling `allocate_fn(flow_id, count)`, so that `POST /flows/{flowId}/storage` can be
+    served from memory instead of signing URLs on the request path.
+
+    Pooled allocations are discarded once they are older than `ttl_seconds`, which must be
+    below the signed URL expiry so that clients always receive a usable URL. Flows that have
+    not been allocated from for `idle_seconds` are no longer refilled.
+    """
+    def __init__(
+        self,
+        allocate_fn: Callable[[str, int], List[dict]],
+        depth: int,
+        ttl_seconds: float,
+        idle_seconds: float,
+        refill_batch: int = 100
+    ):
+        self.allocate_fn = allocate_fn
+        self.depth = depth
+        self.ttl_seconds = ttl_seconds
+        self.idle_seconds = idle_seconds
+        self.refill_batch = refill_batch
+
+        self._pools: Dict[str, _FlowPool] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+        self._served = 0
+        self._signed_inline = 0
+        self._refilled = 0
+        self._expired = 0
+        self._refill_errors = 0
+        self._refill_history: Deque[Tuple[float, int]] = collections.deque()
+
+    def take(self, flow_id: str, count: int) -> List[dict]:
+        """Return `count` allocations for the flow, signing inline only if the pool runs short"""
+        now = time.monotonic()
+        media_objects = []
+        with self._lock:
+            pool = self._pools.get(flow_id)
+            if pool is None:
+                pool = self._pools[flow_id] = _FlowPool()
+            pool.last_used = now
+
+            self._discard_expired(pool, now)
+            while pool.entries and len(media_objects) < count:
+                media_objects.append(pool.entries.popleft()[1])
+            self._served += len(media_objects)
+
+        missing = count - len(media_objects)
+        if missing > 0:
+            media_objects.extend(self.allocate_fn(flow_id, missing))
+            with self._lock:
+                self._signed_inline += missing
+
+        self._ensure_refill_thread()
+        self._wakeup.set()
+        return media_objects
+
+    def refill(self) -> None:
+        """Discard expired allocations, drop idle flows and top up the remaining flows"""
+        now = time.monotonic()
+        with self._lock:
+            for flow_id in list(self._pools):
+                pool = self._pools[flow_id]
+                if now - pool.last_used > self.idle_seconds:
+                    del self._pools[flow_id]
+                    continue
+                self._discard_expired(pool, now)
+            shortfalls = [
+                (flow_id, self.depth - len(pool.entries))
+                for flow_id, pool in self._pools.items()
+                if len(pool.entries) < self.depth
+            ]
+
+        for flow_id, shortfall in shortfalls:
+            while shortfall > 0:
+                batch = min(shortfall, self.refill_batch)
+                try:
+                    media_objects = self.allocate_fn(flow_id, batch)
+                except Exception:
+                    logger.exception(f"Failed to refill storage allocation pool for flow {flow_id}")
+                    with self._lock:
+                        self._refill_errors += 1
+                    break
+
+                expires_at = time.monotonic() + self.ttl_seconds
+                with self._lock:
+                    pool = self._pools.get(flow_id)
+                    if pool is None:
+                        break
+                    pool.entries.extend((expires_at, media_object) for media_object in media_objects)
+                    self._refilled += len(media_objects)
+                    self._refill_history.append((time.monotonic(), len(media_objects)))
+                shortfall -= batch
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            while self._refill_history and now - self._refill_history[0][0] > REFILL_RATE_WINDOW_SECONDS:
+                self._refill_history.popleft()
+            recent_refills = sum(count for _, count in self._refill_history)
+            return {
+                "depth": self.depth,
+                "ttl_seconds": self.ttl_seconds,
+                "flows": {flow_id: len(pool.entries) for flow_id, pool in self._pools.items()},
+                "served_from_pool": self._served,
+                "signed_inline": self._signed_inline,
+                "refilled": self._refilled,
+                "refill_rate_per_second": recent_refills / REFILL_RATE_WINDOW_SECONDS,
+                "refill_errors": self._refill_errors,
+                "expired_discards": self._expired,
+            }
+
+    def _discard_expired(self, pool: _FlowPool, now: float) -> None:
+        # Entries are appended in expiry order so only the head needs checking
+        while pool.entries and pool.entries[0][0] <= now:
+            pool.entries.popleft()
+            self._expired += 1
+
+    def _ensure_refill_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="storage-pool-refill", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        # Wake up on demand after allocations and periodically to discard expired entries
+        while True:
+            self._wakeup.wait(timeout=max(self.ttl_seconds / 4, 1.0))
+            self._wakeup.clear()
+            try:
+                self.refill()
+            except Exception:
+                logger.exception("Storage allocation pool refill failed")
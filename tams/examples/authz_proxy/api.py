@@ -1,16 +1,35 @@
+import hmac
 import os
 from functools import wraps
+from typing import Any
 from uuid import UUID
 
-from token_checker import verify_token, get_signing_key, get_groups_in_token
+from token_checker import TokenVerifier, get_groups_in_token
+from cache import ResourceCache
 from resources import Tams
 from permissions import any_is_admin, filter_read
 from httpx import AsyncClient
 from sanic import Sanic
 from sanic.log import logger
 from sanic.request import Request
+from sanic.response import empty as empty_resp
+from sanic.response import json as json_resp
 from sanic.exceptions import Forbidden, InvalidUsage, NotFound
 
+# Maximum age in seconds of the cached resources used for authorisation decisions. The cache is disabled if 0
+RESOURCE_CACHE_TTL = float(os.environ.get("RESOURCE_CACHE_TTL", "10"))
+RESOURCE_CACHE_SIZE = int(os.environ.get("RESOURCE_CACHE_SIZE", "10000"))
+
+# API key expected in webhook event requests from the TAMS API, which invalidate cached resources. Disabled if not set
+RESOURCE_CACHE_WEBHOOK_API_KEY_NAME = os.environ.get("RESOURCE_CACHE_WEBHOOK_API_KEY_NAME", "X-Api-Key")
+RESOURCE_CACHE_WEBHOOK_API_KEY = os.environ.get("RESOURCE_CACHE_WEBHOOK_API_KEY")
+RESOURCE_CACHE_EVENT_TYPES = ["flows/updated", "flows/deleted", "sources/updated", "sources/deleted"]
+
+# Number of verified tokens whose claims are cached until they expire, and the interval in seconds at which the JWKS
+# signing keys are refreshed
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", "10000"))
+JWKS_REFRESH_INTERVAL = float(os.environ.get("JWKS_REFRESH_INTERVAL", "600"))
+
 app = Sanic("ProxyApp")
 app.config.CORS_ORIGINS = "*"
 
@@ -19,8 +38,22 @@ app.config.CORS_ORIGINS = "*"
 async def setup_client(app):
     client = AsyncClient()
     app.ctx.api_url = os.environ["API_URL"]
-    app.ctx.jwks_client = get_signing_key(os.environ.get("JWKS_URL"))
-    app.ctx.tams = Tams(client, logger, app.ctx.api_url)
+    app.ctx.token_verifier = TokenVerifier(
+        client,
+        os.environ["JWKS_URL"],
+        audience=os.environ.get("OAUTH2_AUDIENCE"),
+        issuer=os.environ.get("OAUTH2_ISSUER"),
+        cache_size=TOKEN_CACHE_SIZE,
+        refresh_interval=JWKS_REFRESH_INTERVAL
+    )
+    await app.ctx.token_verifier.start()
+    app.ctx.cache = ResourceCache(RESOURCE_CACHE_SIZE, RESOURCE_CACHE_TTL) if RESOURCE_CACHE_TTL > 0 else None
+    app.ctx.tams = Tams(client, logger, app.ctx.api_url, app.ctx.cache)
+
+
+@app.after_server_stop
+async def stop_client(app):
+    await app.ctx.token_verifier.stop()
 
 
 def handle_token():
@@ -30,7 +63,7 @@ def handle_token():
         async def decorated_function(request: Request, *args, **kwargs):
             del (request.headers["host"])
 
-            token = verify_token(request, app.ctx.jwks_client)
+            token = await app.ctx.token_verifier.verify(request)
             groups = get_groups_in_token(token)
 
             return await f(request, groups, *args, **kwargs)
@@ -59,6 +92,56 @@ async def options_all(request: Request, path: str):
     return await app.ctx.tams.passthrough_request(request)
 
 
+@app.route('/proxy/resource-cache', methods=['GET'])
+@handle_token()
+async def resource_cache(request: Request, groups: list[str]):
+    # Admin only. Statistics of the cache of resources used for authorisation decisions
+    if not any_is_admin(groups) or app.ctx.cache is None:
+        raise NotFound()
+    return json_resp(app.ctx.cache.stats())
+
+
+@app.route('/proxy/token-cache', methods=['GET'])
+@handle_token()
+async def token_cache(request: Request, groups: list[str]):
+    # Admin only. Statistics of the cache of verified tokens
+    if not any_is_admin(groups):
+        raise NotFound()
+    return json_resp(app.ctx.token_verifier.stats())
+
+
+@app.route('/proxy/resource-cache/events', methods=['POST'])
+async def resource_cache_events(request: Request):
+    # Receives events from a webhook registered with the TAMS API for the "flows/updated", "flows/deleted",
+    # "sources/updated" and "sources/deleted" events, so that resources changed other than through this proxy are
+    # removed from the cache before they expire
+    if app.ctx.cache is None or not RESOURCE_CACHE_WEBHOOK_API_KEY:
+        raise NotFound()
+    api_key = request.headers.get(RESOURCE_CACHE_WEBHOOK_API_KEY_NAME, "")
+    if not hmac.compare_digest(api_key.encode(), RESOURCE_CACHE_WEBHOOK_API_KEY.encode()):
+        raise Forbidden("Invalid API key")
+
+    if not isinstance(request.json, dict):
+        raise InvalidUsage("Expected a JSON event")
+    event_type = request.json.get("event_type")
+    event: Any = request.json.get("event")
+    if event_type not in RESOURCE_CACHE_EVENT_TYPES:
+        # Other events, e.g. of segments, don't change the resources in the cache
+        return empty_resp()
+
+    # "updated" events hold the resource, e.g. `event["flow"]`, and "deleted" events hold its ID, e.g. `flow_id`
+    resource_type, change = event_type.split("/")
+    name = resource_type[:-1]
+    try:
+        resource_id = event[name]["id"] if change == "updated" else event[f"{name}_id"]
+        resource_id = str(UUID(resource_id))
+    except (KeyError, TypeError, ValueError, AttributeError):
+        raise InvalidUsage(f"Missing or invalid {name} ID in event")
+
+    app.ctx.cache.invalidate(f"{resource_type}/{resource_id}")
+    return empty_resp()
+
+
 @app.route('/', methods=['GET', 'HEAD'])
 @handle_token()
 async def root(request: Request, groups: list[str]):
@@ -0,0 +1,86 @@
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+# Paths of the resources whose `auth_classes` tag is used for authorisation decisions
+RESOURCE_PATH_PATTERN = re.compile(r"^/?(flows|sources|service/webhooks)/([0-9a-fA-F-]{36})(/|$)")
+
+
+def get_resource_key(path: str) -> Optional[str]:
+    """Returns the cache key of the Flow, Source or Webhook that the path is for, e.g. `flows/<flow id>`"""
+    match = RESOURCE_PATH_PATTERN.match(path)
+    if match is None:
+        return None
+    return f"{match.group(1)}/{match.group(2).lower()}"
+
+
+class ResourceCache(object):
+    """LRU cache of the upstream resources used for authorisation decisions, keyed by resource
+
+    An entry expires `ttl` seconds after it was requested upstream, however often it is used, which bounds how stale
+    a decision can be. Entries are invalidated when the resource is modified through the proxy, or when notified by a
+    webhook. A resource that is loaded whilst an invalidation happens isn't stored, because the upstream response may
+    be from before the change.
+
+    The cache is only used from the event loop, so needs no locking.
+    """
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._invalidation_count = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires, value = entry
+        if time.monotonic() >= expires:
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def start_load(self) -> tuple[float, int]:
+        """Returns a token to pass to `put` with the value that is then requested upstream"""
+        return time.monotonic(), self._invalidation_count
+
+    def put(self, key: str, value: Any, load_token: tuple[float, int]) -> None:
+        requested, invalidation_count = load_token
+        if invalidation_count != self._invalidation_count:
+            return
+
+        self._entries[key] = (requested + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: str) -> None:
+        self._invalidation_count += 1
+        if self._entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
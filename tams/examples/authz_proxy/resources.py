@@ -2,38 +2,77 @@ import dataclasses
 import json
 from uuid import UUID
 from copy import deepcopy
-from typing import Any, Callable, cast, Optional, List, Dict
+from typing import Any, Callable, cast, Optional, List, Dict, Union
 
-from httpx import AsyncClient
+from httpx import AsyncClient, Response
+from sanic.compat import Header
 from sanic.exceptions import Forbidden, NotFound, InvalidUsage
 from sanic.request import Request
 from sanic.response import raw as raw_resp
 from sanic.response import json as json_resp
-from sanic.response.types import HTTPResponse
+from sanic.response import ResponseStream
+from sanic.response.types import BaseHTTPResponse, HTTPResponse
 from logging import Logger
 
+from cache import ResourceCache, get_resource_key
 from permissions import any_is_read, any_is_write, any_is_delete, any_is_any, filter_read, filter_write, filter_delete
 
+# Headers of the upstream response that only apply to the connection between the proxy and the upstream API
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization", "te", "trailer", "transfer-encoding",
+    "upgrade"
+}
+
+
+def get_response_headers(res: Response, decoded: bool) -> Header:
+    """Returns the headers of the upstream response to return to the client
+
+    If `decoded` is set then the body has been read and decoded, so the original body's encoding and length don't
+    apply.
+    """
+    excluded = HOP_BY_HOP_HEADERS | {"content-encoding", "content-length"} if decoded else HOP_BY_HOP_HEADERS
+    return Header([(name, value) for name, value in res.headers.multi_items() if name.lower() not in excluded])
+
+
+class UpstreamResponseStream(ResponseStream):
+    """Streams the body of an upstream response, closing the upstream response however the stream ends
+
+    The upstream response is also closed if sending the response headers to the client fails before the streaming
+    function is called.
+    """
+
+    def __init__(self, upstream: Response, *args: Any, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.upstream = upstream
+
+    async def stream(self) -> HTTPResponse:
+        try:
+            return await super().stream()
+        finally:
+            await self.upstream.aclose()
+
 
 @dataclasses.dataclass
 class Tams(object):
     client: AsyncClient
     logger: Logger
     api_url: str
+    cache: Optional[ResourceCache] = None
 
     async def Flow(self, request: Request, flow_id: UUID):
-        return await Flow(self.client, self.api_url, request, flow_id)._async_init()
+        return await Flow(self.client, self.api_url, request, flow_id, self.cache)._async_init()
 
     async def Source(self, request: Request, source_id: UUID):
-        return await Source(self.client, self.api_url, request, source_id)._async_init()
+        return await Source(self.client, self.api_url, request, source_id, self.cache)._async_init()
 
     async def Webhook(self, request: Request, webhook_id: UUID):
-        return await Webhook(self.client, self.api_url, request, webhook_id)._async_init()
+        return await Webhook(self.client, self.api_url, request, webhook_id, self.cache)._async_init()
 
     async def MediaObject(self, request: Request, object_id: UUID):
         return await MediaObject(self.client, self.api_url, request, object_id)._async_init()
 
-    async def passthrough_request(self, request: Request) -> HTTPResponse:
+    async def _send_upstream(self, request: Request) -> Response:
+        """Makes the request upstream, returning the response before its body has been read"""
         if request.path == "":
             target_url = self.api_url
         else:
@@ -48,13 +87,23 @@ class Tams(object):
         if "content-length" in request.headers:
             del (request.headers["content-length"])
 
-        res = await self.client.request(
+        # Modifying a resource may change its `auth_classes` tag, so it is removed from the cache before and after the
+        # request, the latter in case it was cached by a concurrent request whilst this one was in progress
+        cache_key = get_resource_key(request.path) if request.method in ["PUT", "DELETE"] else None
+        if self.cache is not None and cache_key is not None:
+            self.cache.invalidate(cache_key)
+
+        upstream_request = self.client.build_request(
             method=request.method,
             headers=request.headers,
             url=target_url,
             json=request.json,
             params=request.args
         )
+        res = await self.client.send(upstream_request, stream=True)
+
+        if self.cache is not None and cache_key is not None:
+            self.cache.invalidate(cache_key)
 
         if res.status_code == 301 or res.status_code == 302:
             # Rewrite the location header to avoid redirecting upstream
@@ -64,7 +113,44 @@ class Tams(object):
             original_origin = f"{protocol}://{original_server}"
             res.headers["Location"] = res.headers["Location"].replace(self.api_url, original_origin)
 
-        return raw_resp(res.text, res.status_code, cast(dict[str, str], res.headers))
+        return res
+
+    async def passthrough_request(self, request: Request) -> Union[ResponseStream, HTTPResponse]:
+        """Makes the request upstream and streams the response to the client as it arrives
+
+        The body is passed on as received, without being decoded, so that large responses such as segment listings
+        aren't held in memory and the first bytes reach the client without waiting for the rest.
+        """
+        res = await self._send_upstream(request)
+        headers = get_response_headers(res, decoded=False)
+
+        if request.method == "HEAD" or request.transport.is_closing():
+            # There's no body to stream to the client, and Sanic may not call the streaming function
+            await res.aclose()
+            return raw_resp(b"", res.status_code, cast(dict[str, str], headers))
+
+        async def stream_body(stream: Union[BaseHTTPResponse, ResponseStream]) -> None:
+            assert isinstance(stream, ResponseStream)
+            async for chunk in res.aiter_raw():
+                await stream.response.send(chunk)
+
+        return UpstreamResponseStream(
+            res,
+            stream_body,
+            status=res.status_code,
+            headers=headers,
+            content_type=res.headers.get("content-type")
+        )
+
+    async def buffered_passthrough_request(self, request: Request) -> HTTPResponse:
+        """Makes the request upstream and reads the whole response, for responses that need to be filtered"""
+        res = await self._send_upstream(request)
+        try:
+            body = await res.aread()
+        finally:
+            await res.aclose()
+
+        return raw_resp(body, res.status_code, cast(dict[str, str], get_response_headers(res, decoded=True)))
 
     async def get_upstream(self, request: Request, url: str, params: Optional[dict] = None) -> Any:
         headers_copy = deepcopy(request.headers)
@@ -84,7 +170,7 @@ class Tams(object):
         orig_auth_classes = orig_auth_classes_str.split(",") if orig_auth_classes_str else []
         request.args["tag.auth_classes"] = ",".join(groups)
 
-        res = await self.passthrough_request(request)
+        res = await self.buffered_passthrough_request(request)
 
         json_body = json.loads(res.body) if res.body else None
 
@@ -118,7 +204,7 @@ class Tams(object):
 
         request.args["tag.auth_classes"] = ",".join(groups)
 
-        res = await self.passthrough_request(request)
+        res = await self.buffered_passthrough_request(request)
 
         assert res.body
         json_body = json.loads(res.body)
@@ -297,11 +383,21 @@ class Resource(object):
     client: AsyncClient
     api_url: str
     request: Request
+    cache: Optional[ResourceCache] = None
 
     classes: list[str] = dataclasses.field(init=False, repr=False, default_factory=list)
     exists: bool = dataclasses.field(init=False, default=False)
 
     async def _get_upstream(self, url: str, throw: bool = False) -> Any:
+        # Only resources that exist are cached, as the upstream response may otherwise depend on the request's token
+        cache_key = get_resource_key(url) if self.cache is not None else None
+        if self.cache is not None and cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                self.exists = True
+                return cached
+            load_token = self.cache.start_load()
+
         headers_copy = deepcopy(self.request.headers)
         if "content-length" in headers_copy:
             del (headers_copy["content-length"])
@@ -318,7 +414,10 @@ class Resource(object):
             return {}
         else:
             self.exists = True
-            return res.json()
+            resource_data = res.json()
+            if self.cache is not None and cache_key is not None:
+                self.cache.put(cache_key, resource_data, load_token)
+            return resource_data
 
     def has_permission(self,
                        check_function: Callable[[list[str]], bool],
@@ -370,8 +469,15 @@ class Resource(object):
 
 
 class Flow(Resource):
-    def __init__(self, client: AsyncClient, api_url: str, request: Request, flow_id: UUID) -> None:
-        super().__init__(client, api_url, request)
+    def __init__(
+        self,
+        client: AsyncClient,
+        api_url: str,
+        request: Request,
+        flow_id: UUID,
+        cache: Optional[ResourceCache] = None
+    ) -> None:
+        super().__init__(client, api_url, request, cache)
         self.flow_id = flow_id
 
     async def _async_init(self):
@@ -385,8 +491,15 @@ class Flow(Resource):
 
 
 class Source(Resource):
-    def __init__(self, client: AsyncClient, api_url: str, request: Request, source_id: UUID) -> None:
-        super().__init__(client, api_url, request)
+    def __init__(
+        self,
+        client: AsyncClient,
+        api_url: str,
+        request: Request,
+        source_id: UUID,
+        cache: Optional[ResourceCache] = None
+    ) -> None:
+        super().__init__(client, api_url, request, cache)
         self.source_id = source_id
 
     async def _async_init(self):
@@ -398,8 +511,15 @@ class Source(Resource):
 
 
 class Webhook(Resource):
-    def __init__(self, client: AsyncClient, api_url: str, request: Request, webhook_id: UUID) -> None:
-        super().__init__(client, api_url, request)
+    def __init__(
+        self,
+        client: AsyncClient,
+        api_url: str,
+        request: Request,
+        webhook_id: UUID,
+        cache: Optional[ResourceCache] = None
+    ) -> None:
+        super().__init__(client, api_url, request, cache)
         self.webhook_id = webhook_id
 
     async def _async_init(self):
@@ -1,51 +1,153 @@
+import asyncio
+import hashlib
 import os
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
 import sanic
+from httpx import AsyncClient
 from sanic.exceptions import Unauthorized
 from sanic.log import logger
 
 import jwt
-from jwt import PyJWKClient, InvalidSignatureError, ExpiredSignatureError
+from jwt import PyJWK, PyJWKSet, InvalidTokenError
 
 GROUPS_CLAIM = os.environ.get("GROUPS_CLAIM", "cognito:groups")
 
 
-def get_signing_key(jwks_url: str):
-    jwks_client = PyJWKClient(jwks_url)
-    jwks_client.get_signing_keys()
-    logger.info("Got signing keys")
-    return jwks_client
+class TokenVerifier(object):
+    """Verifies RS256 JWT access tokens against the keys of a JWKS endpoint
 
+    The keys are fetched asynchronously at startup and then every `refresh_interval` seconds, and also when a token
+    is signed with an unknown key, e.g. after a key rotation, at most once every `min_refresh_interval` seconds.
 
-def verify_token(request: sanic.Request, jwks_client: PyJWKClient) -> dict:
-    try:
-        token_header = request.headers["Authorization"]
-    except KeyError:
-        raise Unauthorized()
-
-    token = token_header[7:]
-    signing_key = jwks_client.get_signing_key_from_jwt(token)
-
-    expected_audience = os.environ.get("OAUTH2_AUDIENCE")
-    expected_issuer = os.environ.get("OAUTH2_ISSUER")
-    
-    decode_kwargs = {
-        "algorithms": ["RS256"]
-    }
-    if expected_audience:
-        decode_kwargs["audience"] = expected_audience
-    if expected_issuer:
-        decode_kwargs["issuer"] = expected_issuer
+    The claims of verified tokens are cached until the token expires, keyed by a hash of the token, so that a
+    repeated token only costs a dict lookup. Tokens without an expiry aren't cached, and cached tokens signed with a
+    key that is removed from the JWKS are dropped.
+    """
+    def __init__(
+        self,
+        client: AsyncClient,
+        jwks_url: str,
+        audience: Optional[str] = None,
+        issuer: Optional[str] = None,
+        cache_size: int = 10000,
+        refresh_interval: float = 600,
+        min_refresh_interval: float = 30
+    ) -> None:
+        self.client = client
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.issuer = issuer
+        self.cache_size = cache_size
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self._keys: dict[str, PyJWK] = {}
+        self._last_refresh = -min_refresh_interval
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        # Cached claims as (expiry, key ID, claims), keyed by token hash
+        self._cache: OrderedDict[bytes, tuple[float, str, dict]] = OrderedDict()
 
-    try:
-        token_decoded = jwt.decode(token, signing_key, **decode_kwargs)
-    except InvalidSignatureError as e:
-        logger.exception(e)
-        raise Unauthorized()
-    except ExpiredSignatureError as e:
-        logger.exception(e)
-        raise Unauthorized()
-
-    return token_decoded
+    async def start(self) -> None:
+        await self.refresh_keys()
+        self._refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    async def stop(self) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+
+    async def refresh_keys(self) -> None:
+        requested = time.monotonic()
+        async with self._refresh_lock:
+            # Another request may have refreshed the keys whilst this one waited
+            if self._last_refresh >= requested:
+                return
+            self._last_refresh = time.monotonic()
+
+            res = await self.client.get(self.jwks_url)
+            res.raise_for_status()
+            keys = {key.key_id: key for key in PyJWKSet.from_dict(res.json()).keys if key.key_id is not None}
+
+            if keys.keys() != self._keys.keys():
+                logger.info(f"Got signing keys {', '.join(keys)}")
+                for token_hash, (_, key_id, _) in list(self._cache.items()):
+                    if key_id not in keys:
+                        del self._cache[token_hash]
+            self._keys = keys
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.refresh_keys()
+            except Exception as e:
+                # Keep using the current keys until a refresh succeeds
+                logger.exception(e)
+
+    async def _get_signing_key(self, key_id: str) -> Optional[PyJWK]:
+        key = self._keys.get(key_id)
+        if key is None and time.monotonic() - self._last_refresh >= self.min_refresh_interval:
+            try:
+                await self.refresh_keys()
+            except Exception as e:
+                logger.exception(e)
+            key = self._keys.get(key_id)
+        return key
+
+    async def verify(self, request: sanic.Request) -> dict:
+        try:
+            token_header = request.headers["Authorization"]
+        except KeyError:
+            raise Unauthorized()
+
+        token = token_header[7:]
+        token_hash = hashlib.sha256(token.encode()).digest()
+        cached = self._cache.get(token_hash)
+        if cached is not None:
+            expiry, _, claims = cached
+            if time.time() < expiry:
+                self._cache.move_to_end(token_hash)
+                self.hits += 1
+                return claims
+            del self._cache[token_hash]
+        self.misses += 1
+
+        try:
+            key_id = jwt.get_unverified_header(token).get("kid")
+            signing_key = await self._get_signing_key(key_id) if key_id is not None else None
+            if key_id is None or signing_key is None:
+                raise InvalidTokenError(f"Unknown signing key {key_id}")
+
+            decode_kwargs: dict[str, Any] = {}
+            if self.audience:
+                decode_kwargs["audience"] = self.audience
+            if self.issuer:
+                decode_kwargs["issuer"] = self.issuer
+            token_decoded = jwt.decode(token, signing_key, algorithms=["RS256"], **decode_kwargs)
+        except InvalidTokenError as e:
+            logger.exception(e)
+            raise Unauthorized()
+
+        if "exp" in token_decoded:
+            self._cache[token_hash] = (float(token_decoded["exp"]), key_id, token_decoded)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return token_decoded
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "size": len(self._cache),
+            "max_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "keys": list(self._keys)
+        }
 
 
 def get_groups_in_token(token: dict) -> list[str]:
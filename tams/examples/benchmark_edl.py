@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# This script benchmarks compiling an edit decision list (EDL) against synthetic source Flow segment indexes
+
+from typing import Optional
+from argparse import ArgumentParser
+from fractions import Fraction
+from uuid import UUID, uuid4
+import logging
+import random
+import statistics
+import time
+
+from mediatimestamp import TimeRange, Timestamp
+
+from compile_edl import EdlEvent, SegmentIndex, compile_events, merge_adjacent_events
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+EDIT_RATE = Fraction(50)
+
+
+def make_source_segments(
+    segment_count: int,
+    segment_frames: int,
+    start: Timestamp
+) -> list[dict]:
+    """Create the segments of a source Flow, which start at an arbitrary time as if they were ingested from HLS"""
+    segment_duration = Timestamp.from_count(segment_frames, EDIT_RATE)
+    return [
+        {
+            "object_id": str(uuid4()),
+            "timerange": str(TimeRange.from_start_length(
+                start + segment_duration * i, segment_duration, TimeRange.INCLUDE_START)),
+            "ts_offset": str(start)
+        }
+        for i in range(segment_count)
+    ]
+
+
+def make_events(
+    rng: random.Random,
+    source_starts: dict[UUID, Timestamp],
+    source_frames: int,
+    event_count: int,
+    continuation_probability: float
+) -> list[EdlEvent]:
+    """Create events of 1 to 10 seconds with cuts on frame boundaries, some of which continue the previous event"""
+    flow_ids = list(source_starts)
+    events: list[EdlEvent] = []
+    record_in = Timestamp()
+    for _ in range(event_count):
+        duration_frames = rng.randint(1 * EDIT_RATE.numerator, 10 * EDIT_RATE.numerator)
+        if events and rng.random() < continuation_probability:
+            flow_id = events[-1].flow_id
+            source_in = events[-1].source_out
+        else:
+            flow_id = rng.choice(flow_ids)
+            source_in = source_starts[flow_id] + Timestamp.from_count(
+                rng.randrange(source_frames - duration_frames), EDIT_RATE)
+        source_out = source_in + Timestamp.from_count(duration_frames, EDIT_RATE)
+        if source_out > source_starts[flow_id] + Timestamp.from_count(source_frames, EDIT_RATE):
+            # The continuation would run off the end of the source
+            continue
+        event = EdlEvent(flow_id, source_in, source_out, record_in)
+        events.append(event)
+        record_in = event.record_out
+    return events
+
+
+def benchmark(
+    event_count: int,
+    source_count: int,
+    source_duration: float,
+    segment_frames: int,
+    continuation_probability: float,
+    repeat: int,
+    seed: int
+) -> None:
+    rng = random.Random(seed)
+    source_frames = int(source_duration * EDIT_RATE)
+    segment_count = source_frames // segment_frames
+    source_frames = segment_count * segment_frames
+
+    source_starts = {
+        uuid4(): Timestamp.from_count(rng.randrange(1000000 * 90000), 90000)
+        for _ in range(source_count)
+    }
+    source_segments = {
+        flow_id: make_source_segments(segment_count, segment_frames, start)
+        for flow_id, start in source_starts.items()
+    }
+    events = make_events(rng, source_starts, source_frames, event_count, continuation_probability)
+    edit_rates: dict[UUID, Optional[Fraction]] = {flow_id: EDIT_RATE for flow_id in source_starts}
+
+    index_times = []
+    compile_times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        indexes = {
+            flow_id: SegmentIndex(segments, EDIT_RATE)
+            for flow_id, segments in source_segments.items()
+        }
+        index_times.append(time.perf_counter() - start_time)
+
+        start_time = time.perf_counter()
+        merged_events = merge_adjacent_events(events)
+        output_segments = compile_events(merged_events, indexes, edit_rates)
+        compile_times.append(time.perf_counter() - start_time)
+
+    # Without merging, every event is compiled separately, so each cut within a run of continuing events adds trimmed
+    # references to the segment it falls in
+    unmerged_segments = compile_events(sorted(events, key=lambda event: event.record_in), indexes, edit_rates)
+
+    trimmed_count = sum(1 for segment in output_segments if "sample_offset" in segment)
+    logger.info(
+        f"{len(events)} events over {source_count} source Flows of {segment_count} segments each, merged into "
+        f"{len(merged_events)} events")
+    logger.info(
+        f"Compiled {len(output_segments)} segments ({trimmed_count} trimmed), compared to {len(unmerged_segments)} "
+        "without merging")
+    logger.info(f"Index build: {statistics.median(index_times) * 1000:.1f} ms")
+    logger.info(
+        f"Merge and compile: {statistics.median(compile_times) * 1000:.1f} ms, "
+        f"{len(events) / statistics.median(compile_times):.0f} events/s")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="benchmark_edl",
+        description="Benchmark EDL compilation against synthetic source Flows"
+    )
+
+    parser.add_argument(
+        "--event-count", type=int, default=1000,
+        help="Number of events in the EDL"
+    )
+    parser.add_argument(
+        "--source-count", type=int, default=8,
+        help="Number of source Flows"
+    )
+    parser.add_argument(
+        "--source-duration", type=float, default=7200,
+        help="Duration of each source Flow in seconds"
+    )
+    parser.add_argument(
+        "--segment-frames", type=int, default=96,
+        help="Number of frames in each source segment, at 50 frames per second"
+    )
+    parser.add_argument(
+        "--continuation-probability", type=float, default=0.25,
+        help="Probability that an event continues the previous event on the same source Flow"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5,
+        help="Number of times the EDL is compiled, with the median time being used"
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed used to generate the EDL"
+    )
+
+    args = parser.parse_args()
+
+    benchmark(
+        args.event_count,
+        args.source_count,
+        args.source_duration,
+        args.segment_frames,
+        args.continuation_probability,
+        args.repeat,
+        args.seed
+    )
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# This script benchmarks transcoding synthetic MPEG-TS segments to proxies with a pool of worker processes, in
+# segments per second per core, without requiring a TAMS instance
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import tempfile
+import time
+
+from benchmark_throughput import make_synthetic_hls
+from ingest_hls import get_hls_segment_filenames
+from utils.proxy import ProxyParameters, transcode_segment
+
+logging.basicConfig()
+logger = logging.getLogger("benchmark_proxy")
+logger.setLevel(logging.INFO)
+
+
+def benchmark_workers(segments: list[bytes], params: ProxyParameters, workers: int) -> dict:
+    """Transcode the segments with a pool of `workers` processes, which are started before the timing"""
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        # Start the workers and load the codecs
+        list(pool.map(transcode_segment, segments[:workers], [params] * workers))
+
+        start_time = time.perf_counter()
+        proxy_sizes = [len(proxy) for proxy in pool.map(transcode_segment, segments, [params] * len(segments))]
+        seconds = time.perf_counter() - start_time
+
+    cores = min(workers, os.cpu_count() or 1)
+    return {
+        "workers": workers,
+        "cores": cores,
+        "segments": len(segments),
+        "bytes": sum(len(segment) for segment in segments),
+        "proxy_bytes": sum(proxy_sizes),
+        "seconds": seconds,
+        "segments_per_second": len(segments) / seconds,
+        "segments_per_second_per_core": len(segments) / seconds / cores
+    }
+
+
+def benchmark(
+    output_filename: str,
+    work_dir: str,
+    segment_bytes: int,
+    segment_count: int,
+    segment_duration: int,
+    worker_counts: list[int],
+    params: ProxyParameters
+) -> None:
+    hls_filename = make_synthetic_hls(work_dir, segment_bytes, segment_count, segment_duration)
+    segments = []
+    for segment_filename in list(get_hls_segment_filenames(hls_filename))[:segment_count]:
+        with open(os.path.join(os.path.dirname(hls_filename), segment_filename), "rb") as f:
+            segments.append(f.read())
+
+    results = []
+    for workers in worker_counts:
+        result = benchmark_workers(segments, params, workers)
+        results.append(result)
+        logger.info(
+            f"{workers} workers: {result['segments_per_second']:.2f} segments/s, "
+            f"{result['segments_per_second_per_core']:.2f} segments/s per core")
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count()
+        },
+        "parameters": {
+            "segment_bytes": segment_bytes,
+            "segment_count": segment_count,
+            "segment_duration": segment_duration,
+            **params._asdict()
+        },
+        "results": results
+    }
+    with open(output_filename, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote results to {output_filename}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="benchmark_proxy",
+        description="TAMS proxy transcoding benchmark"
+    )
+
+    parser.add_argument(
+        "--output", type=str, default="proxy.json",
+        help="Filename of the JSON results"
+    )
+    parser.add_argument(
+        "--work-dir", type=str,
+        help="Directory for the synthetic HLS content, which is reused by later runs. Defaults to a temporary directory"
+    )
+    parser.add_argument(
+        "--segment-megabytes", type=float, default=4.0,
+        help="Size of the synthetic segments"
+    )
+    parser.add_argument(
+        "--segment-count", type=int, default=16,
+        help="Number of segments transcoded with each number of workers"
+    )
+    parser.add_argument(
+        "--segment-duration", type=int, default=2,
+        help="Duration of the synthetic segments in seconds"
+    )
+    parser.add_argument(
+        "--workers", type=int, nargs="+",
+        default=sorted({1, max((os.cpu_count() or 1) // 2, 1), os.cpu_count() or 1}),
+        help="Numbers of worker processes. Defaults to 1, half and all of the CPUs"
+    )
+    parser.add_argument(
+        "--height", type=int, default=ProxyParameters().height,
+        help="Frame height of the proxy"
+    )
+    parser.add_argument(
+        "--bit-rate", type=int, default=ProxyParameters().bit_rate,
+        help="Bit rate of the proxy encoding"
+    )
+    parser.add_argument(
+        "--preset", type=str, default=ProxyParameters().preset,
+        help="Preset of the proxy encoding"
+    )
+
+    args = parser.parse_args()
+
+    # The synthetic content is created with the ingest logging, which isn't needed
+    logging.getLogger().setLevel(logging.WARNING)
+
+    params = ProxyParameters(args.height, args.bit_rate, args.preset)
+    segment_bytes = int(args.segment_megabytes * 1000 * 1000)
+    if args.work_dir:
+        benchmark(
+            args.output, args.work_dir, segment_bytes, args.segment_count, args.segment_duration, args.workers, params)
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            benchmark(
+                args.output, work_dir, segment_bytes, args.segment_count, args.segment_duration, args.workers,
+                params)
@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+# This script benchmarks the throughput of HLS ingest and file outgest against a local TAMS API instance with
+# in-memory storage, using synthetic MPEG-TS segments, and writes the results as JSON for tracking trends
+
+from argparse import ArgumentParser
+from fractions import Fraction
+from uuid import uuid4
+import asyncio
+import copy
+import datetime
+import json
+import logging
+import math
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from mediatimestamp import TimeRange
+import av
+
+from ingest_hls import hls_ingest, extract_segment_timerange, get_hls_segment_filenames, DEFAULT_FLOW_METADATA
+from outgest_file import outgest_file
+from utils.credentials import EmptyCredentials
+from utils.local_tams import wait_for_local_tams
+
+logging.basicConfig()
+logger = logging.getLogger("benchmark_throughput")
+logger.setLevel(logging.INFO)
+
+FRAME_RATE = 25
+
+# Pixels per byte of the target frame size, which keeps the bitrate of the noise content achievable by the encoder
+PIXELS_PER_BYTE = 6
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_frame_size(segment_bytes: int, segment_duration: int) -> tuple[int, int]:
+    """Return a 16:9 frame size, in multiples of 16, that suits the target segment size"""
+    frame_bytes = segment_bytes / (segment_duration * FRAME_RATE)
+    height = math.sqrt(frame_bytes * PIXELS_PER_BYTE * 9 / 16)
+    height = min(max(16 * round(height / 16), 176), 1088)
+    return 16 * round(height * 16 / 9 / 16), height
+
+
+def make_synthetic_hls(work_dir: str, segment_bytes: int, segment_count: int, segment_duration: int) -> str:
+    """Encode an HLS stream of noise at a bitrate that gives segments of about `segment_bytes`, if not already done
+
+    Returns the media playlist filename.
+    """
+    hls_dir = os.path.join(work_dir, f"hls_{segment_bytes}_{segment_duration}s")
+    hls_filename = os.path.join(hls_dir, "index.m3u8")
+    if (
+        os.path.exists(hls_filename)
+        and len(list(get_hls_segment_filenames(hls_filename))) >= segment_count
+    ):
+        return hls_filename
+
+    os.makedirs(hls_dir, exist_ok=True)
+    width, height = get_frame_size(segment_bytes, segment_duration)
+    bit_rate = segment_bytes * 8 // segment_duration
+    logger.info(f"Encoding {segment_count} segments of {segment_bytes} bytes at {width}x{height} to {hls_dir}")
+
+    with av.open(hls_filename, mode="w", format="hls", options={
+        "hls_time": str(segment_duration),
+        "hls_list_size": "0",
+        "hls_segment_filename": os.path.join(hls_dir, "segment%05d.ts")
+    }) as output:
+        stream = output.add_stream("libx264", rate=FRAME_RATE)
+        stream.width = width
+        stream.height = height
+        stream.pix_fmt = "yuv420p"
+        stream.bit_rate = bit_rate
+        gop_size = str(segment_duration * FRAME_RATE)
+        stream.options = {
+            "g": gop_size,
+            "keyint_min": gop_size,
+            "sc_threshold": "0",
+            "preset": "ultrafast",
+            "maxrate": str(bit_rate),
+            "bufsize": str(bit_rate // 2)
+        }
+        for index in range(segment_count * segment_duration * FRAME_RATE):
+            frame = av.VideoFrame(width, height, "yuv420p")
+            for plane in frame.planes:
+                plane.update(os.urandom(plane.buffer_size))
+            frame.pts = index
+            frame.time_base = Fraction(1, FRAME_RATE)
+            for packet in stream.encode(frame):
+                output.mux(packet)
+        for packet in stream.encode():
+            output.mux(packet)
+
+    return hls_filename
+
+
+def make_result(tool: str, segment_bytes: int, concurrency: int, segment_sizes: list[int], times: list[float]) -> dict:
+    seconds = statistics.median(times)
+    total_bytes = sum(segment_sizes)
+    return {
+        "tool": tool,
+        "target_segment_bytes": segment_bytes,
+        "mean_segment_bytes": round(total_bytes / len(segment_sizes)),
+        "concurrency": concurrency,
+        "segments": len(segment_sizes),
+        "bytes": total_bytes,
+        "seconds": seconds,
+        "segments_per_second": len(segment_sizes) / seconds,
+        "megabytes_per_second": total_bytes / seconds / 1000 / 1000
+    }
+
+
+async def benchmark_tools(
+    tams_url: str,
+    work_dir: str,
+    segment_sizes: list[int],
+    concurrency_levels: list[int],
+    segment_count: int,
+    segment_duration: int,
+    repeat: int
+) -> list[dict]:
+    credentials = EmptyCredentials()
+    results: list[dict] = []
+    for segment_bytes in segment_sizes:
+        hls_filename = make_synthetic_hls(work_dir, segment_bytes, segment_count, segment_duration)
+        segment_filenames = [
+            os.path.join(os.path.dirname(hls_filename), segment_filename)
+            for segment_filename in get_hls_segment_filenames(hls_filename)
+        ][:segment_count]
+        sizes = [os.path.getsize(segment_filename) for segment_filename in segment_filenames]
+        # The API only lists segments in a bounded timerange
+        first_timerange = extract_segment_timerange(segment_filenames[0])
+        last_timerange = extract_segment_timerange(segment_filenames[-1])
+        timerange = TimeRange(first_timerange.start, last_timerange.end, last_timerange.inclusivity)
+
+        for concurrency in concurrency_levels:
+            ingest_times: list[float] = []
+            outgest_times: list[float] = []
+            for _ in range(repeat):
+                # Each repeat ingests into a new Flow, so that its segments don't overlap existing ones
+                flow_id = uuid4()
+                start_time = time.perf_counter()
+                await hls_ingest(
+                    tams_url,
+                    credentials,
+                    hls_filename,
+                    0,
+                    segment_count,
+                    flow_id,
+                    uuid4(),
+                    copy.deepcopy(DEFAULT_FLOW_METADATA),
+                    upload_concurrency=concurrency
+                )
+                ingest_times.append(time.perf_counter() - start_time)
+
+                output_filename = os.path.join(work_dir, "outgest.ts")
+                start_time = time.perf_counter()
+                outgest_timerange = await outgest_file(
+                    tams_url,
+                    credentials,
+                    [flow_id],
+                    timerange,
+                    output_filename,
+                    False,
+                    prefetch_window=concurrency
+                )
+                outgest_times.append(time.perf_counter() - start_time)
+                os.remove(output_filename)
+
+                if outgest_timerange != timerange:
+                    raise RuntimeError(
+                        f"Outgest of Flow {flow_id} produced {outgest_timerange!s} rather than the ingested "
+                        f"{timerange!s}")
+
+            for tool, times in (("hls_ingest", ingest_times), ("outgest_file", outgest_times)):
+                result = make_result(tool, segment_bytes, concurrency, sizes, times)
+                results.append(result)
+                logger.info(
+                    f"{tool}: {segment_bytes / 1000 / 1000:g} MB segments, concurrency {concurrency}: "
+                    f"{result['segments_per_second']:.1f} segments/s, {result['megabytes_per_second']:.1f} MB/s")
+
+    return results
+
+
+async def benchmark(
+    output_filename: str,
+    work_dir: str,
+    segment_sizes: list[int],
+    concurrency_levels: list[int],
+    segment_count: int,
+    segment_duration: int,
+    repeat: int
+) -> None:
+    port = get_free_port()
+    object_store_port = get_free_port()
+    tams_url = f"http://127.0.0.1:{port}"
+    # The API runs in its own process, so that it doesn't compete with the tools for the interpreter
+    server = subprocess.Popen(
+        [
+            sys.executable, "-m", "utils.local_tams",
+            "--port", str(port),
+            "--object-store-port", str(object_store_port)
+        ],
+        cwd=os.path.dirname(os.path.abspath(__file__))
+    )
+    try:
+        await wait_for_local_tams(tams_url)
+        results = await benchmark_tools(
+            tams_url, work_dir, segment_sizes, concurrency_levels, segment_count, segment_duration, repeat)
+    finally:
+        server.terminate()
+        server.wait()
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count()
+        },
+        "parameters": {
+            "segment_count": segment_count,
+            "segment_duration": segment_duration,
+            "repeat": repeat
+        },
+        "results": results
+    }
+    with open(output_filename, "w") as f:
+        json.dump(report, f, indent=2)
+    logger.info(f"Wrote results to {output_filename}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="benchmark_throughput",
+        description="TAMS HLS ingest and file outgest throughput benchmark"
+    )
+
+    parser.add_argument(
+        "--output", type=str, default="throughput.json",
+        help="Filename of the JSON results"
+    )
+    parser.add_argument(
+        "--work-dir", type=str,
+        help="Directory for the synthetic HLS content, which is reused by later runs. Defaults to a temporary directory"
+    )
+    parser.add_argument(
+        "--segment-megabytes", type=float, nargs="+", default=[0.5, 2.0, 8.0],
+        help="Sizes of the synthetic segments"
+    )
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 4, 16],
+        help="Concurrency levels, used as the ingest upload concurrency and the outgest prefetch window"
+    )
+    parser.add_argument(
+        "--segment-count", type=int, default=20,
+        help="Number of segments ingested and outgested in each run, which is at most 100"
+    )
+    parser.add_argument(
+        "--segment-duration", type=int, default=2,
+        help="Duration of the synthetic segments in seconds"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=1,
+        help="Number of runs of each tool at each segment size and concurrency. The median time is reported"
+    )
+
+    args = parser.parse_args()
+
+    # The tools log each segment, which would add to the measured times. Outgest also warns about each segment
+    # without an object timerange, which the API doesn't return
+    logging.getLogger().setLevel(logging.ERROR)
+
+    segment_sizes = [int(megabytes * 1000 * 1000) for megabytes in args.segment_megabytes]
+    if args.work_dir:
+        asyncio.run(benchmark(
+            args.output, args.work_dir, segment_sizes, args.concurrency, args.segment_count, args.segment_duration,
+            args.repeat))
+    else:
+        with tempfile.TemporaryDirectory() as work_dir:
+            asyncio.run(benchmark(
+                args.output, work_dir, segment_sizes, args.concurrency, args.segment_count,
+                args.segment_duration, args.repeat))
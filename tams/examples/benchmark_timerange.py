@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# This script benchmarks segment timerange extraction by scanning MPEG-TS PES headers against demuxing with PyAV
+
+import logging
+import os
+import statistics
+import time
+from argparse import ArgumentParser
+from typing import Callable
+
+from mediatimestamp import TimeRange
+
+from ingest_hls import demux_segment_timerange, get_hls_segment_filenames
+from utils.mpegts import scan_ts_timerange
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+def time_probe(probe: Callable[[str], TimeRange], filename: str, repeat: int) -> tuple[float, TimeRange]:
+    """Return the median time taken by the probe and the timerange it extracted"""
+    durations = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        timerange = probe(filename)
+        durations.append(time.perf_counter() - start_time)
+    return statistics.median(durations), timerange
+
+
+def scan_segment_timerange(filename: str) -> TimeRange:
+    """Extract the timerange by scanning PES headers, failing rather than falling back to demuxing"""
+    timerange = scan_ts_timerange(filename)
+    if timerange is None:
+        raise ValueError(f"Failed to scan the timerange of {filename}")
+    return timerange
+
+
+def benchmark(hls_filename: str, segment_count: int, repeat: int) -> None:
+    """Compare the per-segment probe time of the two methods and check that they agree"""
+    segment_filenames = [
+        os.path.join(os.path.dirname(hls_filename), segment_filename)
+        for segment_filename in get_hls_segment_filenames(hls_filename)
+    ][:segment_count]
+
+    demux_times = []
+    scan_times = []
+    total_bytes = 0
+    for filename in segment_filenames:
+        demux_time, demux_timerange = time_probe(demux_segment_timerange, filename, repeat)
+        scan_time, scan_timerange = time_probe(scan_segment_timerange, filename, repeat)
+        if scan_timerange != demux_timerange:
+            logger.warning(
+                f"Timerange mismatch for {filename}: scanned {scan_timerange} and demuxed {demux_timerange}")
+
+        demux_times.append(demux_time)
+        scan_times.append(scan_time)
+        total_bytes += os.path.getsize(filename)
+
+    if not segment_filenames:
+        logger.error(f"No segments found in {hls_filename}")
+        return
+
+    demux_mean = statistics.mean(demux_times)
+    scan_mean = statistics.mean(scan_times)
+    logger.info(
+        f"Probed {len(segment_filenames)} segments with a mean size of "
+        f"{total_bytes / len(segment_filenames) / 1e6:.2f} MB")
+    logger.info(f"PyAV demux: {demux_mean * 1000:.3f} ms per segment")
+    logger.info(f"MPEG-TS scan: {scan_mean * 1000:.3f} ms per segment")
+    logger.info(f"Speedup: {demux_mean / scan_mean:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="benchmark_timerange",
+        description="Benchmark segment timerange extraction"
+    )
+
+    parser.add_argument(
+        "--hls-filename", type=str, default="sample_content/hls_output.m3u8",
+        help="HLS playlist providing segment files"
+    )
+    parser.add_argument(
+        "--segment-count", type=int, default=30,
+        help="Maximum number of segments to probe"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=5,
+        help="Number of times each segment is probed, with the median time being used"
+    )
+
+    args = parser.parse_args()
+
+    benchmark(args.hls_filename, args.segment_count, args.repeat)
@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# This script compiles an edit decision list (EDL) into segment registrations on a new Flow
+
+from typing import Any, NamedTuple, Optional
+from argparse import ArgumentParser
+from bisect import bisect_right
+from fractions import Fraction
+from uuid import UUID, uuid4
+import asyncio
+import json
+import logging
+import os
+import time
+
+from mediatimestamp import TimeRange, Timestamp
+
+from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
+from utils.client import TAMSClient
+from utils.registration import SegmentRegistrar, DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY
+from simple_edit import get_flow, get_segments
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Flow properties copied from the source Flows to the output Flow, which must match between sources
+ESSENCE_PROPERTIES = ["format", "codec", "container", "essence_parameters"]
+
+
+class EdlEvent(NamedTuple):
+    """Places [source_in, source_out) of a Flow on the output timeline starting at `record_in`"""
+    flow_id: UUID
+    source_in: Timestamp
+    source_out: Timestamp
+    record_in: Timestamp
+
+    @property
+    def source_timerange(self) -> TimeRange:
+        return TimeRange(self.source_in, self.source_out, TimeRange.INCLUDE_START)
+
+    @property
+    def record_out(self) -> Timestamp:
+        return self.record_in + (self.source_out - self.source_in)
+
+    @property
+    def record_offset(self) -> Timestamp:
+        """Offset added to the source timeline to get the output timeline"""
+        return self.record_in - self.source_in
+
+
+def load_edl(edl_filename: str) -> tuple[Optional[str], list[EdlEvent]]:
+    """Load the label and events of a JSON EDL
+
+    The EDL is an object with an optional "label" and a list of "events", each of which has a "flow_id", a
+    "source_in" and (exclusive) "source_out" timestamp on the source Flow and a "record_in" timestamp on the output
+    Flow, e.g. {"flow_id": "...", "source_in": "10:0", "source_out": "12:500000000", "record_in": "0:0"}. If
+    "record_in" is omitted the event follows the previous event, or starts at 0 for the first event.
+    """
+    with open(edl_filename) as f:
+        edl = json.load(f)
+
+    events = []
+    record_in = Timestamp()
+    for event in edl["events"]:
+        if "record_in" in event:
+            record_in = Timestamp.from_str(event["record_in"])
+        edl_event = EdlEvent(
+            UUID(event["flow_id"]),
+            Timestamp.from_str(event["source_in"]),
+            Timestamp.from_str(event["source_out"]),
+            record_in
+        )
+        if edl_event.source_out <= edl_event.source_in:
+            raise ValueError(f"Event source out is not after source in: {event}")
+        events.append(edl_event)
+        record_in = edl_event.record_out
+
+    return edl.get("label"), events
+
+
+def merge_adjacent_events(events: list[EdlEvent]) -> list[EdlEvent]:
+    """Sort the events by record time and merge events that continue the previous event on the same source Flow
+    without a jump, e.g. an edit that was split into several events"""
+    merged: list[EdlEvent] = []
+    for event in sorted(events, key=lambda event: event.record_in):
+        if merged:
+            previous = merged[-1]
+            if event.record_in < previous.record_out:
+                raise ValueError(f"Event at {event.record_in} overlaps the previous event on the record timeline")
+            if (
+                event.flow_id == previous.flow_id
+                and event.record_in == previous.record_out
+                and event.source_in == previous.source_out
+            ):
+                merged[-1] = previous._replace(source_out=event.source_out)
+                continue
+        merged.append(event)
+    return merged
+
+
+def get_edit_rate(flow: dict) -> Optional[Fraction]:
+    """Return the rate of the Flow's samples, used for `sample_offset` and `sample_count`"""
+    essence_parameters = flow.get("essence_parameters", {})
+    if "frame_rate" in essence_parameters:
+        frame_rate = essence_parameters["frame_rate"]
+        return Fraction(frame_rate["numerator"], frame_rate.get("denominator", 1))
+    if "sample_rate" in essence_parameters:
+        return Fraction(essence_parameters["sample_rate"])
+    return None
+
+
+class SegmentIndex:
+    """Segments of a Flow sorted by start time, for finding the segments that overlap a timerange
+
+    Segment timeranges are held as half-open [start, end) ranges, where an end that is included in the
+    timerange is converted to an exclusive end using the `edit_rate`.
+    """
+    def __init__(self, segments: list[dict], edit_rate: Optional[Fraction]) -> None:
+        entries: list[tuple[Timestamp, Timestamp, dict]] = []
+        for segment in segments:
+            timerange = TimeRange.from_str(segment["timerange"])
+            start = timerange.start
+            end = timerange.end
+            if start is None or end is None:
+                raise ValueError(f"Segment timerange {timerange} is unbounded")
+            if timerange.includes_end():
+                if edit_rate is None:
+                    raise ValueError(f"Unable to find the exclusive end of segment timerange {timerange}")
+                end += Timestamp.from_count(1, edit_rate)
+            entries.append((start, end, segment))
+        entries.sort(key=lambda entry: entry[0])
+
+        self.starts = [start for start, _, _ in entries]
+        self.entries = entries
+
+    def overlapping(self, start: Timestamp, end: Timestamp) -> list[tuple[Timestamp, Timestamp, dict]]:
+        """Return the (start, end, segment) entries that overlap [start, end), in order"""
+        # Segments in a Flow don't overlap, so only the segment before the first one starting after `start` can
+        # overlap the start of the range
+        index = max(bisect_right(self.starts, start) - 1, 0)
+        overlapping = []
+        while index < len(self.entries) and self.entries[index][0] < end:
+            if self.entries[index][1] > start:
+                overlapping.append(self.entries[index])
+            index += 1
+        return overlapping
+
+
+def compile_event(event: EdlEvent, index: SegmentIndex, edit_rate: Optional[Fraction]) -> list[dict[str, Any]]:
+    """Return the output segments that place the event's source timerange on the record timeline
+
+    Segments that are wholly within the event are referenced as they are. Segments that are cut by the event's
+    in or out point are trimmed using `object_timerange`, as well as the deprecated `sample_offset` and
+    `sample_count`, which are relative to any trim already set on the source segment.
+    """
+    source_start = event.source_in
+    source_end = event.source_out
+    record_offset = event.record_offset
+
+    output_segments = []
+    position = source_start
+    for seg_start, seg_end, segment in index.overlapping(source_start, source_end):
+        if seg_start > position:
+            logger.warning(f"Flow {event.flow_id} has no segments for [{position}_{seg_start}) in event at "
+                           f"{event.record_in}")
+
+        start = max(seg_start, source_start)
+        end = min(seg_end, source_end)
+        ts_offset = Timestamp.from_str(segment.get("ts_offset", "0:0"))
+        output_segment: dict[str, Any] = {
+            "object_id": segment["object_id"],
+            "timerange": TimeRange(start + record_offset, end + record_offset, TimeRange.INCLUDE_START),
+            "ts_offset": ts_offset + record_offset
+        }
+
+        if start != seg_start or end != seg_end:
+            if edit_rate is None:
+                raise ValueError(f"Unable to cut segment {segment['object_id']} of Flow {event.flow_id} without "
+                                 "a frame or sample rate")
+            sample_offset = (start - seg_start).to_count(edit_rate.numerator, edit_rate.denominator)
+            output_segment["sample_offset"] = segment.get("sample_offset", 0) + sample_offset
+            output_segment["sample_count"] = (end - start).to_count(edit_rate.numerator, edit_rate.denominator)
+
+            # The cut on the object's timeline, within any trim already set on the source segment
+            if "object_timerange" in segment:
+                object_timerange = TimeRange.from_str(segment["object_timerange"])
+            else:
+                object_timerange = TimeRange(seg_start - ts_offset, seg_end - ts_offset, TimeRange.INCLUDE_START)
+            output_segment["object_timerange"] = object_timerange.intersect_with(
+                TimeRange(start - ts_offset, end - ts_offset, TimeRange.INCLUDE_START))
+        else:
+            for name in ["object_timerange", "sample_offset", "sample_count"]:
+                if name in segment:
+                    output_segment[name] = segment[name]
+
+        output_segments.append(output_segment)
+        position = end
+
+    if position < source_end:
+        logger.warning(f"Flow {event.flow_id} has no segments for [{position}_{source_end}) in event at "
+                       f"{event.record_in}")
+
+    return output_segments
+
+
+def compile_events(
+    events: list[EdlEvent],
+    indexes: dict[UUID, SegmentIndex],
+    edit_rates: dict[UUID, Optional[Fraction]]
+) -> list[dict[str, Any]]:
+    """Compile the events, which must already be merged, into output segments in record order"""
+    output_segments = []
+    for event in events:
+        output_segments.extend(compile_event(event, indexes[event.flow_id], edit_rates[event.flow_id]))
+    return output_segments
+
+
+async def get_source(
+    client: TAMSClient,
+    tams_url: str,
+    flow_id: UUID,
+    timerange: TimeRange
+) -> tuple[dict, list[dict]]:
+    """Fetch the Flow and the segments in the timerange"""
+    return await asyncio.gather(
+        get_flow(client, tams_url, flow_id),
+        get_segments(client, tams_url, flow_id, timerange)
+    )
+
+
+async def compile_edl(
+    tams_url: str,
+    credentials: Credentials,
+    edl_filename: str,
+    output_flow_id: UUID,
+    output_source_id: UUID,
+    register_batch_size: int = DEFAULT_BATCH_SIZE,
+    register_concurrency: int = DEFAULT_CONCURRENCY
+) -> None:
+    """Create a Flow from the EDL by registering segments that reference the source Flows' media objects"""
+    label, events = load_edl(edl_filename)
+    merged_events = merge_adjacent_events(events)
+    logger.info(f"Merged {len(events)} EDL events into {len(merged_events)} events")
+    if not merged_events:
+        return
+
+    # Each source Flow's segments are fetched for the timerange covering all the events that use it
+    source_timeranges: dict[UUID, TimeRange] = {}
+    for event in merged_events:
+        source_timeranges[event.flow_id] = source_timeranges.get(
+            event.flow_id, event.source_timerange).extend_to_encompass_timerange(event.source_timerange)
+
+    async with TAMSClient(credentials) as client:
+        start_time = time.perf_counter()
+        sources = await asyncio.gather(*(
+            get_source(client, tams_url, flow_id, timerange)
+            for flow_id, timerange in source_timeranges.items()
+        ))
+        logger.info(
+            f"Fetched {sum(len(segments) for _, segments in sources)} segments from {len(sources)} source Flows in "
+            f"{time.perf_counter() - start_time:.3f}s")
+
+        first_flow = sources[0][0]
+        for flow, _ in sources[1:]:
+            for name in ESSENCE_PROPERTIES:
+                if flow.get(name) != first_flow.get(name):
+                    raise ValueError(f"Source Flow {flow['id']} has a different {name} to Flow {first_flow['id']}")
+
+        edit_rates = {flow_id: get_edit_rate(flow) for flow_id, (flow, _) in zip(source_timeranges, sources)}
+        start_time = time.perf_counter()
+        indexes = {
+            flow_id: SegmentIndex(segments, edit_rates[flow_id])
+            for flow_id, (_, segments) in zip(source_timeranges, sources)
+        }
+        output_segments = compile_events(merged_events, indexes, edit_rates)
+        logger.info(
+            f"Compiled {len(output_segments)} segments, of which "
+            f"{sum(1 for segment in output_segments if 'sample_offset' in segment)} are trimmed, in "
+            f"{time.perf_counter() - start_time:.3f}s")
+
+        flow_metadata = {
+            "id": str(output_flow_id),
+            "source_id": str(output_source_id),
+            "label": label or "EDL Edit Flow",
+            **{name: first_flow[name] for name in ESSENCE_PROPERTIES if name in first_flow}
+        }
+        logger.info(f"Creating Flow {output_flow_id}")
+        async with client.put(f"{tams_url}/flows/{output_flow_id}", json=flow_metadata) as resp:
+            resp.raise_for_status()
+
+        start_time = time.perf_counter()
+        async with SegmentRegistrar(
+            client, tams_url, output_flow_id, register_batch_size, register_concurrency
+        ) as registrar:
+            for segment in output_segments:
+                await registrar.add(segment)
+        logger.info(
+            f"Registered {registrar.registered_count} segments with Flow {output_flow_id} in "
+            f"{time.perf_counter() - start_time:.3f}s")
+        client.log_stats()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="compile_edl",
+        description="Create a Flow from an edit decision list of source Flow timeranges"
+    )
+
+    parser.add_argument(
+        "--tams-url", type=str, required=True,
+        help=("URL of the top level endpoint in the TAMS service.")
+    )
+    parser.add_argument(
+        "--oauth2-url", type=str, default=os.environ.get("OAUTH2_URL"),
+        help="OAuth2 URL for getting credential token. Defaults to the 'OAUTH2_URL' environment variable"
+    )
+    parser.add_argument(
+        "--client-id", type=str, default=os.environ.get("CLIENT_ID"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_ID' environment variable"
+    )
+    parser.add_argument(
+        "--client-secret", type=str, default=os.environ.get("CLIENT_SECRET"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_SECRET' environment variable"
+    )
+    parser.add_argument(
+        "--username", type=str, default=os.environ.get("USERNAME"),
+        help="Basic auth username. Defaults to the 'USERNAME' environment variable"
+    )
+    parser.add_argument(
+        "--password", type=str, default=os.environ.get("PASSWORD"),
+        help="Basic auth password. Defaults to the 'PASSWORD' environment variable"
+    )
+    parser.add_argument(
+        "--edl-filename", type=str, required=True,
+        help="JSON EDL file"
+    )
+    parser.add_argument(
+        "--output-flow-id", type=UUID,
+        help="Output Flow ID. Default is to generate an ID"
+    )
+    parser.add_argument(
+        "--output-source-id", type=UUID,
+        help="Output Source ID. Default is to generate an ID"
+    )
+    parser.add_argument(
+        "--register-batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help="Number of segments registered with each request to the output Flow"
+    )
+    parser.add_argument(
+        "--register-concurrency", type=int, default=DEFAULT_CONCURRENCY,
+        help="Maximum number of segment registration requests in flight"
+    )
+    parser.add_argument(
+        "--token", type=str, default=os.environ.get("TOKEN"),
+        help="Bearer token for authentication. Defaults to the 'TOKEN' environment variable"
+    )
+
+    args = parser.parse_args()
+
+    credentials: Credentials
+    if args.token:
+        from utils.credentials import BearerCredentials
+        credentials = BearerCredentials(args.token)
+    elif args.oauth2_url and args.client_id and args.client_secret:
+        credentials = OAuth2ClientCredentials(args.oauth2_url, args.client_id, args.client_secret)
+    elif args.username and args.password:
+        credentials = BasicCredentials(args.username, args.password)
+    else:
+        logger.error(
+            "Require either Bearer token (--token), OAuth2 credentials (--oauth2-url, --client-id, --client-secret) "
+            "or basic credentials (--username, --password)"
+        )
+        exit(1)
+
+    asyncio.run(compile_edl(
+        args.tams_url.rstrip("/"),
+        credentials,
+        args.edl_filename,
+        args.output_flow_id or uuid4(),
+        args.output_source_id or uuid4(),
+        args.register_batch_size,
+        args.register_concurrency
+    ))
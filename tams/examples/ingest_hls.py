@@ -1,12 +1,15 @@
 #!/usr/bin/env python
 # This script demonstrates ingest of media from an HLS playlist into TAMS
 
+import copy
 import json
-from typing import Generator, Any, AsyncGenerator, Optional
+from typing import Generator, Any, AsyncGenerator, Awaitable, Callable, Iterable, Optional, Union
 import asyncio
 import os
 import logging
+import time
 from argparse import ArgumentParser
+from fractions import Fraction
 from uuid import UUID, uuid4
 
 import aiohttp
@@ -16,7 +19,9 @@ import mediajson
 import av
 
 from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
-from utils.client import post_request, put_request
+from utils.client import TAMSClient
+from utils.mpegts import scan_ts_timerange
+from utils.upload import ResumableUpload
 
 logging.basicConfig()
 logger = logging.getLogger()
@@ -45,8 +50,7 @@ DEFAULT_FLOW_METADATA = {
 
 
 async def put_flow(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
+    client: TAMSClient,
     tams_url: str,
     flow_id: UUID,
     source_id: UUID,
@@ -61,9 +65,7 @@ async def put_flow(
 
     logger.info(f"Creating Flow {flow_id}")
 
-    async with put_request(
-        session,
-        credentials,
+    async with client.put(
         f"{tams_url}/flows/{flow_id}",
         json=flow_metadata
     ) as resp:
@@ -71,21 +73,30 @@ async def put_flow(
 
 
 async def get_media_storage_urls(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
+    client: TAMSClient,
     tams_url: str,
     flow_id: UUID,
-    segment_count: int
+    segment_count: int,
+    total_count: Optional[int] = None,
+    resumable: bool = False
 ) -> AsyncGenerator[dict, None]:
-    """Get media storage URLs for uploading media segments"""
-    while True:
-        async with post_request(
-            session,
-            credentials,
+    """Get media storage URLs for uploading media segments, in batches of `segment_count`
+
+    URLs are generated indefinitely unless `total_count` is set. If `resumable` is set then the URLs start
+    resumable upload sessions.
+    """
+    remaining = total_count
+    while remaining is None or remaining > 0:
+        limit = segment_count if remaining is None else min(segment_count, remaining)
+        if remaining is not None:
+            remaining -= limit
+
+        storage_request: dict[str, Any] = {"limit": limit}
+        if resumable:
+            storage_request["resumable"] = True
+        async with client.post(
             f"{tams_url}/flows/{flow_id}/storage",
-            json={
-                "limit": segment_count
-            }
+            json=storage_request
         ) as resp:
             if resp.status != 201:
                 logger.error(f"Storage allocation failed with status {resp.status}")
@@ -107,11 +118,8 @@ def get_hls_segment_filenames(hls_filename: str) -> Generator[str, None, None]:
         yield segment.uri
 
 
-def extract_segment_timerange(filename: str) -> TimeRange:
-    """Extract the presentation timerange from the media object
-
-    This implementation is very basic. It could be optimised further to avoid
-    reading and parsing the complete segment.
+def demux_segment_timerange(filename: str) -> TimeRange:
+    """Extract the presentation timerange from the media object by demuxing all its packets
 
     This implementation assumes that the packet durations are known. This
     allows the segment timerange to include the last frame's duration with an
@@ -128,7 +136,6 @@ def extract_segment_timerange(filename: str) -> TimeRange:
     """
     start_ts = None
     end_ts = None
-    end_duration = None
     with av.open(filename, "r") as input:
         for pkt in input.demux():
             if pkt.pts is None:
@@ -139,31 +146,40 @@ def extract_segment_timerange(filename: str) -> TimeRange:
 
             if start_ts is None:
                 start_ts = ts
-                end_ts = ts
-                end_duration = duration
+                end_ts = ts + duration
             else:
                 start_ts = min(ts, start_ts)
-                end_ts = max(ts, end_ts)
-                if ts == end_ts:
-                    end_duration = duration
+                end_ts = max(ts + duration, end_ts)
+
+    return TimeRange(start_ts, end_ts, TimeRange.INCLUDE_START)
 
-    return TimeRange(start_ts, end_ts + end_duration, TimeRange.INCLUDE_START)
+
+def extract_segment_timerange(filename: str) -> TimeRange:
+    """Extract the presentation timerange from the media object
+
+    MPEG-TS segments are scanned for the PES timestamps near the start and end
+    of the file, which avoids demuxing the complete segment. Other containers,
+    or MPEG-TS segments whose timing can't be determined that way, are demuxed
+    using PyAV.
+    """
+    timerange = scan_ts_timerange(filename)
+    if timerange is None:
+        timerange = demux_segment_timerange(filename)
+    return timerange
 
 
-async def ingest_segment(
+async def upload_segment_object(
     session: aiohttp.ClientSession,
-    credentials: Credentials,
-    tams_url: str,
-    flow_id: UUID,
     object_url: dict[str, Any],
-    filename: str
+    filename: str,
+    resumable_chunk_size: Optional[int] = None
 ) -> None:
-    """Upload the segment's media object and register the segment"""
-    seg_tr = await asyncio.get_running_loop().run_in_executor(
-        None,
-        extract_segment_timerange,
-        filename
-    )
+    """Upload the segment's media object using the pre-signed PUT URL, or in chunks to a resumable upload session
+    if `resumable_chunk_size` is set"""
+    if resumable_chunk_size is not None:
+        await ResumableUpload(session, object_url["put_url"], filename, resumable_chunk_size).upload()
+        logger.info(f"Uploaded object to {object_url['object_id']}")
+        return
 
     first_object_url = object_url["put_url"]["url"]
     content_type = object_url["put_url"]["content-type"]
@@ -179,18 +195,159 @@ async def ingest_segment(
 
     logger.info(f"Uploaded object to {object_url['object_id']}")
 
-    async with post_request(
-        session,
-        credentials,
+
+async def register_segments(
+    client: TAMSClient,
+    tams_url: str,
+    flow_id: UUID,
+    segments: list[dict[str, Any]]
+) -> None:
+    """Register a list of segments with a single request"""
+    async with client.post(
         f"{tams_url}/flows/{flow_id}/segments",
-        json=mediajson.encode_value({
-            "object_id": object_url['object_id'],
-            "timerange": seg_tr
-        })
+        json=mediajson.encode_value(segments)
     ) as resp:
         resp.raise_for_status()
 
-    logger.info(f"Created flow segment for {object_url['object_id']} at {seg_tr.to_sec_nsec_range()}")
+        # The request succeeds with a list of failed segments if some could not be registered, e.g. because they
+        # overlap existing segments
+        if resp.status == 200 and resp.content_type == "application/json":
+            failed_segments = (await resp.json()).get("failed_segments")
+            if failed_segments:
+                raise ValueError(f"Failed to register segments: {failed_segments}")
+
+    for segment in segments:
+        logger.info(
+            f"Created flow segment for {segment['object_id']} at {segment['timerange'].to_sec_nsec_range()}")
+
+
+async def _run_stages(*stages: Awaitable[None]) -> None:
+    """Run pipeline stages concurrently, cancelling the others if any of them fails"""
+    tasks = [asyncio.ensure_future(stage) for stage in stages]
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def ingest_segments(
+    client: TAMSClient,
+    tams_url: str,
+    flow_id: UUID,
+    segment_filenames: Iterable[str],
+    segment_count: int,
+    upload_concurrency: int = 4,
+    storage_batch_size: int = 20,
+    register_batch_size: int = 10,
+    on_registered: Optional[Callable[[list[tuple[str, dict[str, Any]]]], None]] = None,
+    upload_semaphore: Optional[asyncio.Semaphore] = None,
+    probe_timerange: Optional[Callable[[str], Awaitable[TimeRange]]] = None,
+    resumable_chunk_size: Optional[int] = None
+) -> None:
+    """Ingest segment files using a pipeline of probe, upload and register stages
+
+    The stages are connected by bounded queues of futures in segment order. Probing and uploading run
+    concurrently, with at most `upload_concurrency` uploads in flight, whilst segments are registered in
+    order and in batches of up to `register_batch_size`. Storage URLs are allocated in batches of
+    `storage_batch_size` ahead of the uploads that need them.
+
+    `on_registered` is called after each batch is registered with a list of (filename, segment) tuples.
+    `upload_semaphore` can be used to share the upload concurrency limit between concurrent ingests and
+    `probe_timerange` to replace the default timerange extraction, e.g. to share probes between renditions.
+    Media objects are uploaded in chunks of `resumable_chunk_size` to resumable upload sessions if it is set.
+    """
+    loop = asyncio.get_running_loop()
+    queue_size = max(upload_concurrency, register_batch_size) * 2
+    probe_queue: asyncio.Queue[Optional[tuple[str, asyncio.Future]]] = asyncio.Queue(queue_size)
+    upload_queue: asyncio.Queue[Optional[asyncio.Future]] = asyncio.Queue(queue_size)
+    object_url_queue: asyncio.Queue[dict] = asyncio.Queue(storage_batch_size)
+    semaphore = upload_semaphore or asyncio.Semaphore(upload_concurrency)
+    upload_tasks: set[asyncio.Future] = set()
+
+    async def allocate_stage() -> None:
+        # Keeps up to a batch of URLs ready whilst the next batch is requested
+        async for object_url in get_media_storage_urls(
+                client, tams_url, flow_id, storage_batch_size, total_count=segment_count,
+                resumable=resumable_chunk_size is not None):
+            await object_url_queue.put(object_url)
+
+    async def probe_stage() -> None:
+        for filename in segment_filenames:
+            probe: asyncio.Future
+            if probe_timerange is not None:
+                probe = asyncio.ensure_future(probe_timerange(filename))
+            else:
+                probe = loop.run_in_executor(None, extract_segment_timerange, filename)
+            await probe_queue.put((filename, probe))
+        await probe_queue.put(None)
+
+    async def upload(filename: str, probe: asyncio.Future, object_url: dict) -> tuple[str, dict, int]:
+        async with semaphore:
+            await upload_segment_object(client.session, object_url, filename, resumable_chunk_size)
+        size = os.path.getsize(filename)
+        segment = {
+            "object_id": object_url["object_id"],
+            "timerange": await probe,
+            "object_size": size
+        }
+        return filename, segment, size
+
+    async def upload_stage() -> None:
+        while (item := await probe_queue.get()) is not None:
+            filename, probe = item
+            object_url = await object_url_queue.get()
+            upload_task = asyncio.ensure_future(upload(filename, probe, object_url))
+            upload_tasks.add(upload_task)
+            upload_task.add_done_callback(upload_tasks.discard)
+            await upload_queue.put(upload_task)
+        await upload_queue.put(None)
+
+    stats = {"segments": 0, "bytes": 0}
+
+    async def register_stage() -> None:
+        batch: list[tuple[str, dict]] = []
+
+        async def register_batch() -> None:
+            nonlocal batch
+            await register_segments(client, tams_url, flow_id, [segment for _, segment in batch])
+            if on_registered is not None:
+                on_registered(batch)
+            batch = []
+
+        while True:
+            # Register the pending batch rather than hold it whilst waiting for the next upload, to keep latency low
+            if batch and upload_queue.empty():
+                await register_batch()
+            upload_task = await upload_queue.get()
+            if upload_task is None:
+                break
+            if batch and not upload_task.done():
+                await register_batch()
+
+            filename, segment, size = await upload_task
+            stats["segments"] += 1
+            stats["bytes"] += size
+            batch.append((filename, segment))
+            if len(batch) >= register_batch_size:
+                await register_batch()
+
+        if batch:
+            await register_batch()
+
+    start_time = time.monotonic()
+    try:
+        await _run_stages(allocate_stage(), probe_stage(), upload_stage(), register_stage())
+    finally:
+        for upload_task in list(upload_tasks):
+            upload_task.cancel()
+    elapsed = time.monotonic() - start_time
+    if elapsed > 0 and stats["segments"] > 0:
+        logger.info(
+            f"Ingested {stats['segments']} segments ({stats['bytes'] / 1e6:.1f} MB) in {elapsed:.2f}s: "
+            f"{stats['segments'] / elapsed:.1f} segments/s, {stats['bytes'] / 1e6 / elapsed:.2f} MB/s")
 
 
 async def hls_ingest(
@@ -201,38 +358,372 @@ async def hls_ingest(
     hls_segment_count: int,
     flow_id: UUID,
     source_id: UUID,
-    flow_params: Optional[dict]
+    flow_params: Optional[dict],
+    upload_concurrency: int = 4,
+    storage_batch_size: int = 20,
+    register_batch_size: int = 10,
+    resumable_chunk_size: Optional[int] = None
 ) -> None:
-    """Upload segments from the HLS playlist"""
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        await put_flow(session, credentials, tams_url, flow_id, source_id, flow_params)
+    """Upload segments from the HLS playlist
 
-        object_urls = get_media_storage_urls(session, credentials, tams_url, flow_id, hls_segment_count)
-
-        hls_segment_filenames = get_hls_segment_filenames(hls_filename)
+    If the playlist is a master playlist then its renditions are ingested, with `flow_id` being used for the
+    Flow collection.
+    """
+    if m3u8.load(hls_filename).is_variant:
+        await hls_master_ingest(
+            tams_url,
+            credentials,
+            hls_filename,
+            hls_start_segment,
+            hls_segment_count,
+            flow_id,
+            source_id,
+            flow_params,
+            upload_concurrency=upload_concurrency,
+            register_batch_size=register_batch_size,
+            resumable_chunk_size=resumable_chunk_size
+        )
+        return
+
+    async with TAMSClient(credentials) as client:
+        await put_flow(client, tams_url, flow_id, source_id, flow_params)
+
+        hls_segment_filenames = [
+            os.path.join(os.path.dirname(hls_filename), segment_filename)
+            for segment_filename in get_hls_segment_filenames(hls_filename)
+        ][hls_start_segment:hls_start_segment + hls_segment_count]
+
+        await ingest_segments(
+            client,
+            tams_url,
+            flow_id,
+            hls_segment_filenames,
+            len(hls_segment_filenames),
+            upload_concurrency=upload_concurrency,
+            storage_batch_size=storage_batch_size,
+            register_batch_size=register_batch_size,
+            resumable_chunk_size=resumable_chunk_size
+        )
+        client.log_stats()
+
+
+def get_frame_rate(frame_rate: float) -> Fraction:
+    """Convert an HLS FRAME-RATE, which has 3 decimal places, to a rational frame rate"""
+    ntsc_frame_rate = Fraction(round(frame_rate * 1.001) * 1000, 1001)
+    if abs(float(ntsc_frame_rate) - frame_rate) < 0.0005:
+        return ntsc_frame_rate
+    return Fraction(round(frame_rate * 1000), 1000)
+
+
+def get_rendition_flow_metadata(variant: m3u8.Playlist, flow_params: Optional[dict]) -> dict:
+    """Return Flow metadata for a variant stream, based on `flow_params` or the default H.264 video Flow"""
+    flow_metadata: dict[str, Any] = copy.deepcopy(flow_params or DEFAULT_FLOW_METADATA)
+    stream_info = variant.stream_info
+    essence_parameters: dict[str, Any] = flow_metadata.setdefault("essence_parameters", {})
+    if stream_info.resolution:
+        essence_parameters["frame_width"], essence_parameters["frame_height"] = stream_info.resolution
+    if stream_info.frame_rate:
+        frame_rate = get_frame_rate(stream_info.frame_rate)
+        essence_parameters["frame_rate"] = {
+            "numerator": frame_rate.numerator,
+            "denominator": frame_rate.denominator
+        }
+    # TAMS bit rates are in units of 1000 bits/second
+    if stream_info.average_bandwidth:
+        flow_metadata["avg_bit_rate"] = stream_info.average_bandwidth // 1000
+    if stream_info.bandwidth:
+        flow_metadata["max_bit_rate"] = stream_info.bandwidth // 1000
+    if stream_info.codecs and not stream_info.codecs.startswith("avc1"):
+        logger.warning(f"Variant {variant.uri} has codecs {stream_info.codecs} but is described as H.264")
+
+    flow_metadata["label"] = f"{flow_metadata.get('label', 'Flow')} {get_rendition_role(variant)}"
+    return flow_metadata
+
+
+def get_rendition_role(variant: m3u8.Playlist) -> str:
+    """Return the role of the variant stream in the Flow collection"""
+    stream_info = variant.stream_info
+    if stream_info.resolution:
+        return f"{stream_info.resolution[1]}p_{stream_info.bandwidth}"
+    return f"{stream_info.bandwidth}"
+
+
+def renditions_are_aligned(playlists: list[m3u8.M3U8], first_timeranges: list[TimeRange]) -> bool:
+    """Check that the rendition segments have the same durations and that the first segments have the same
+    timerange, in which case each segment's timerange only needs to be extracted once"""
+    durations = [[segment.duration for segment in playlist.segments] for playlist in playlists]
+    if any(rendition_durations != durations[0] for rendition_durations in durations[1:]):
+        return False
+    return all(timerange == first_timeranges[0] for timerange in first_timeranges[1:])
+
+
+async def hls_master_ingest(
+    tams_url: str,
+    credentials: Credentials,
+    hls_filename: str,
+    hls_start_segment: int,
+    hls_segment_count: int,
+    collection_flow_id: UUID,
+    source_id: UUID,
+    flow_params: Optional[dict],
+    upload_concurrency: int = 4,
+    register_batch_size: int = 10,
+    resumable_chunk_size: Optional[int] = None
+) -> None:
+    """Upload the renditions of an HLS master playlist concurrently
 
-        # This sequential upload process could be optimised by using asyncio tasks to
-        # ingest segments concurrently
-        count = 0
-        for segment_filename in hls_segment_filenames:
-            count += 1
-            if count <= hls_start_segment:
-                continue
-            elif count > hls_start_segment + hls_segment_count:
-                break
+    Each variant stream is ingested into its own Flow and the Flows share a Source, as they are different
+    representations of the same content. The Flows are grouped by a multi-essence collection Flow with ID
+    `collection_flow_id`, whose own Source collects the renditions' Source.
 
-            object_url = await anext(object_urls)
+    The renditions share the upload concurrency limit and the storage for each rendition is allocated with a
+    single request. If the renditions' segments are aligned then each segment's timerange is extracted once
+    and used for all renditions.
+    """
+    master_playlist = m3u8.load(hls_filename)
+    variants = list(master_playlist.playlists)
+
+    playlists = []
+    renditions = []
+    for variant in variants:
+        playlist_filename = os.path.join(os.path.dirname(hls_filename), variant.uri)
+        playlist = m3u8.load(playlist_filename)
+        playlists.append(playlist)
+        renditions.append([
+            os.path.join(os.path.dirname(playlist_filename), segment.uri)
+            for segment in playlist.segments
+        ][hls_start_segment:hls_start_segment + hls_segment_count])
+
+    loop = asyncio.get_running_loop()
+    segment_indexes = {
+        filename: index
+        for filenames in renditions
+        for index, filename in enumerate(filenames)
+    }
 
-            full_segment_filename = os.path.join(os.path.dirname(hls_filename), segment_filename)
+    # Probes keyed by segment index if the renditions are aligned, otherwise by filename. The first segments are
+    # probed to check the alignment, and those probes are reused for ingest
+    probes: dict[Union[int, str], asyncio.Future] = {
+        filenames[0]: loop.run_in_executor(None, extract_segment_timerange, filenames[0])
+        for filenames in renditions if filenames
+    }
+    first_timeranges = await asyncio.gather(*probes.values())
+    aligned = renditions_are_aligned(playlists, first_timeranges)
+    if aligned:
+        logger.info("Rendition segments are aligned: extracting each segment timerange once")
+        probes = {0: next(iter(probes.values()))} if probes else {}
+
+    async def probe_timerange(filename: str) -> TimeRange:
+        # If aligned, the first rendition to reach a segment extracts the timerange for all of them
+        key: Union[int, str] = segment_indexes[filename] if aligned else filename
+        if key not in probes:
+            probes[key] = loop.run_in_executor(None, extract_segment_timerange, filename)
+        return await probes[key]
+
+    flow_ids = [uuid4() for _ in variants]
+    upload_semaphore = asyncio.Semaphore(upload_concurrency)
+    async with TAMSClient(credentials) as client:
+        for variant, flow_id in zip(variants, flow_ids):
+            await put_flow(client, tams_url, flow_id, source_id, get_rendition_flow_metadata(variant, flow_params))
+
+        # The collection Flow has its own multi-essence Source, which collects the renditions' Source
+        collection_source_id = uuid4()
+        logger.info(f"Flow collection Source ID is {collection_source_id}")
+        await put_flow(client, tams_url, collection_flow_id, collection_source_id, {
+            "label": "Demo Flow collection",
+            "description": "Flow collection of the renditions in an HLS master playlist",
+            "format": "urn:x-nmos:format:multi",
+            "flow_collection": [
+                {"id": str(flow_id), "role": get_rendition_role(variant)}
+                for variant, flow_id in zip(variants, flow_ids)
+            ]
+        })
 
-            await ingest_segment(
-                session,
-                credentials,
+        await _run_stages(*(
+            ingest_segments(
+                client,
                 tams_url,
                 flow_id,
-                object_url,
-                full_segment_filename
+                filenames,
+                len(filenames),
+                storage_batch_size=max(len(filenames), 1),
+                register_batch_size=register_batch_size,
+                upload_semaphore=upload_semaphore,
+                probe_timerange=probe_timerange,
+                resumable_chunk_size=resumable_chunk_size
             )
+            for flow_id, filenames in zip(flow_ids, renditions)
+        ))
+        client.log_stats()
+
+    for variant, flow_id in zip(variants, flow_ids):
+        logger.info(f"Ingested rendition {get_rendition_role(variant)} into Flow {flow_id}")
+
+
+def load_checkpoint(checkpoint_filename: str) -> Optional[dict[str, Any]]:
+    """Load the live ingest checkpoint, if the file exists"""
+    if not os.path.exists(checkpoint_filename):
+        return None
+    with open(checkpoint_filename) as f:
+        return json.load(f)
+
+
+def save_checkpoint(checkpoint_filename: str, checkpoint: dict[str, Any]) -> None:
+    """Atomically replace the live ingest checkpoint, so that it is never left partially written"""
+    tmp_filename = f"{checkpoint_filename}.tmp"
+    with open(tmp_filename, "w") as f:
+        json.dump(checkpoint, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_filename, checkpoint_filename)
+
+
+async def get_new_live_segments(
+    playlist: m3u8.M3U8,
+    hls_filename: str,
+    checkpoint: dict[str, Any]
+) -> list[tuple[int, str, m3u8.Segment, Optional[TimeRange]]]:
+    """Return the (media sequence, filename, segment, timerange) of playlist segments that follow the checkpoint
+
+    The timerange is only set for segments that had to be probed to compare them with the checkpoint, so that
+    they aren't probed again when they are ingested.
+    """
+    segments = [
+        (media_sequence, os.path.join(os.path.dirname(hls_filename), segment.uri), segment)
+        for media_sequence, segment in enumerate(playlist.segments, start=playlist.media_sequence or 0)
+    ]
+    last_media_sequence = checkpoint["media_sequence"]
+    if last_media_sequence is None or not segments:
+        return [(media_sequence, filename, segment, None) for media_sequence, filename, segment in segments]
+
+    if segments[-1][0] < last_media_sequence and checkpoint["timerange"] is not None:
+        # The media sequence has gone backwards, e.g. because the packager was restarted. Fall back to
+        # comparing the segment timeranges with the last one registered
+        logger.warning(
+            f"Playlist media sequence {segments[-1][0]} is before the checkpoint {last_media_sequence}. "
+            "Resuming from the last registered timerange")
+        last_timerange = TimeRange.from_str(checkpoint["timerange"])
+        loop = asyncio.get_running_loop()
+        timeranges = await asyncio.gather(*(
+            loop.run_in_executor(None, extract_segment_timerange, filename)
+            for _, filename, _ in segments
+        ))
+        return [
+            (media_sequence, filename, segment, timerange)
+            for (media_sequence, filename, segment), timerange in zip(segments, timeranges)
+            if timerange.is_later_than_timerange(last_timerange)
+        ]
+
+    return [
+        (media_sequence, filename, segment, None)
+        for media_sequence, filename, segment in segments
+        if media_sequence > last_media_sequence
+    ]
+
+
+async def hls_live_ingest(
+    tams_url: str,
+    credentials: Credentials,
+    hls_filename: str,
+    checkpoint_filename: Optional[str],
+    flow_id: UUID,
+    source_id: UUID,
+    flow_params: Optional[dict],
+    upload_concurrency: int = 4,
+    storage_batch_size: int = 20,
+    register_batch_size: int = 10,
+    resumable_chunk_size: Optional[int] = None
+) -> None:
+    """Follow a live HLS playlist and ingest segments as they are added
+
+    The playlist is re-loaded every target duration, or half the target duration if no segments were added,
+    and segments are identified by their media sequence number. The last registered media sequence and
+    timerange are saved to the checkpoint file after each batch of segments is registered, so that a
+    restart resumes with the next segment without re-probing or re-uploading the earlier segments.
+
+    The glass-to-registration latency of each segment is measured from the end of the segment, using the
+    EXT-X-PROGRAM-DATE-TIME tags in the playlist. If the playlist has no date-time tags then the latency is
+    measured from when the segment was first seen in the playlist instead.
+
+    Ingest stops once the playlist has an EXT-X-ENDLIST tag and all its segments have been ingested.
+    """
+    checkpoint = load_checkpoint(checkpoint_filename) if checkpoint_filename else None
+    loop = asyncio.get_running_loop()
+    async with TAMSClient(credentials) as client:
+        if checkpoint is not None:
+            flow_id = UUID(checkpoint["flow_id"])
+            logger.info(
+                f"Resuming ingest into Flow {flow_id} after media sequence {checkpoint['media_sequence']}")
+        else:
+            await put_flow(client, tams_url, flow_id, source_id, flow_params)
+            checkpoint = {
+                "flow_id": str(flow_id),
+                "source_id": str(source_id),
+                "media_sequence": None,
+                "timerange": None
+            }
+            if checkpoint_filename:
+                save_checkpoint(checkpoint_filename, checkpoint)
+
+        while True:
+            playlist = m3u8.load(hls_filename)
+            seen_at = time.time()
+            new_segments = await get_new_live_segments(playlist, hls_filename, checkpoint)
+
+            if new_segments:
+                pending = {
+                    filename: (media_sequence, segment) for media_sequence, filename, segment, _ in new_segments
+                }
+                probed = {
+                    filename: timerange for _, filename, _, timerange in new_segments if timerange is not None
+                }
+
+                async def probe_timerange(filename: str) -> TimeRange:
+                    timerange = probed.pop(filename, None)
+                    if timerange is None:
+                        timerange = await loop.run_in_executor(None, extract_segment_timerange, filename)
+                    return timerange
+
+                def on_registered(registered: list[tuple[str, dict[str, Any]]]) -> None:
+                    registered_at = time.time()
+                    for filename, flow_segment in registered:
+                        media_sequence, segment = pending.pop(filename)
+                        if segment.current_program_date_time is not None:
+                            glass_time = segment.current_program_date_time.timestamp() + segment.duration
+                            logger.info(
+                                f"Segment {media_sequence} glass-to-registration latency: "
+                                f"{registered_at - glass_time:.3f}s")
+                        else:
+                            logger.info(
+                                f"Segment {media_sequence} playlist-to-registration latency: "
+                                f"{registered_at - seen_at:.3f}s")
+
+                    checkpoint["media_sequence"] = media_sequence
+                    checkpoint["timerange"] = flow_segment["timerange"].to_sec_nsec_range()
+                    if checkpoint_filename:
+                        save_checkpoint(checkpoint_filename, checkpoint)
+
+                await ingest_segments(
+                    client,
+                    tams_url,
+                    flow_id,
+                    [filename for _, filename, _, _ in new_segments],
+                    len(new_segments),
+                    upload_concurrency=upload_concurrency,
+                    storage_batch_size=storage_batch_size,
+                    register_batch_size=register_batch_size,
+                    on_registered=on_registered,
+                    probe_timerange=probe_timerange,
+                    resumable_chunk_size=resumable_chunk_size
+                )
+
+            if playlist.is_endlist:
+                logger.info("Reached the end of the playlist")
+                client.log_stats()
+                break
+
+            target_duration = playlist.target_duration or 1
+            await asyncio.sleep(target_duration if new_segments else target_duration / 2)
 
 
 if __name__ == "__main__":
@@ -293,6 +784,30 @@ if __name__ == "__main__":
         "--flow-params", type=json.loads,
         help="JSON representation of Flow to write. Default is a basic video Flow"
     )
+    parser.add_argument(
+        "--live", action="store_true",
+        help="Follow a live playlist, ingesting segments as they are added until the playlist ends"
+    )
+    parser.add_argument(
+        "--checkpoint", type=str,
+        help="Checkpoint file used to resume live ingest after a restart"
+    )
+    parser.add_argument(
+        "--upload-concurrency", type=int, default=4,
+        help="Maximum number of media objects uploaded concurrently"
+    )
+    parser.add_argument(
+        "--storage-batch-size", type=int, default=20,
+        help="Number of media object storage URLs allocated per request"
+    )
+    parser.add_argument(
+        "--register-batch-size", type=int, default=10,
+        help="Maximum number of segments registered per request"
+    )
+    parser.add_argument(
+        "--resumable-chunk-megabytes", type=int, default=None,
+        help="Upload media objects in chunks of this size to resumable upload sessions instead of a single PUT"
+    )
 
     args = parser.parse_args()
 
@@ -310,13 +825,36 @@ if __name__ == "__main__":
             "or basic credentials (--username, --password)"
         )
 
-    output_timerange = asyncio.run(hls_ingest(
-        args.tams_url.rstrip("/"),
-        credentials,
-        args.hls_filename,
-        args.hls_start_segment,
-        args.hls_segment_count,
-        args.flow_id or uuid4(),
-        args.source_id or uuid4(),
-        args.flow_params
-    ))
+    resumable_chunk_size = None
+    if args.resumable_chunk_megabytes is not None:
+        resumable_chunk_size = args.resumable_chunk_megabytes * 1024 * 1024
+
+    if args.live:
+        asyncio.run(hls_live_ingest(
+            args.tams_url.rstrip("/"),
+            credentials,
+            args.hls_filename,
+            args.checkpoint,
+            args.flow_id or uuid4(),
+            args.source_id or uuid4(),
+            args.flow_params,
+            upload_concurrency=args.upload_concurrency,
+            storage_batch_size=args.storage_batch_size,
+            register_batch_size=args.register_batch_size,
+            resumable_chunk_size=resumable_chunk_size
+        ))
+    else:
+        output_timerange = asyncio.run(hls_ingest(
+            args.tams_url.rstrip("/"),
+            credentials,
+            args.hls_filename,
+            args.hls_start_segment,
+            args.hls_segment_count,
+            args.flow_id or uuid4(),
+            args.source_id or uuid4(),
+            args.flow_params,
+            upload_concurrency=args.upload_concurrency,
+            storage_batch_size=args.storage_batch_size,
+            register_batch_size=args.register_batch_size,
+            resumable_chunk_size=resumable_chunk_size
+        ))
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# This script demonstrates creating a low resolution proxy Flow from a Flow, by transcoding its segments in parallel
+
+from typing import Any, Awaitable, Callable, Optional
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+from uuid import UUID, uuid4
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+
+from mediatimestamp import Timestamp, TimeRange
+import aiohttp
+
+from ingest_hls import get_media_storage_urls
+from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
+from utils.client import TAMSClient
+from utils.media_cache import MediaObjectCache
+from utils.prefetch import get_download_url
+from utils.proxy import ProxyParameters, get_proxy_frame_size, transcode_segment
+from utils.registration import SegmentRegistrar
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DEFAULT_WORKERS = os.cpu_count() or 1
+DEFAULT_STORAGE_BATCH_SIZE = 20
+DEFAULT_REGISTER_BATCH_SIZE = 10
+
+# Segment properties that are kept by derived segments, e.g. of a proxy, which reference media objects with the same
+# timestamps
+SEGMENT_PROPERTIES = [
+    "timerange", "ts_offset", "last_duration", "object_timerange", "sample_offset", "sample_count"
+]
+
+# Flow tag that links a proxy Flow to the Flow it was created from
+PROXY_TAG = "proxy_of"
+
+
+async def get_optional_flow(client: TAMSClient, tams_url: str, flow_id: UUID) -> Optional[dict]:
+    """Returns a Flow dict for the given Flow ID, or None if it doesn't exist"""
+    async with client.get(f"{tams_url}/flows/{flow_id}") as resp:
+        if resp.status == 404:
+            return None
+        resp.raise_for_status()
+        return await resp.json()
+
+
+def get_proxy_flow_metadata(source_flow: dict, proxy_flow_id: UUID, params: ProxyParameters) -> dict:
+    """Return the metadata of a video Flow for the proxy, under the same Source as the original"""
+    essence_parameters = dict(source_flow.get("essence_parameters", {}))
+    if "frame_width" in essence_parameters and "frame_height" in essence_parameters:
+        essence_parameters["frame_width"], essence_parameters["frame_height"] = get_proxy_frame_size(
+            essence_parameters["frame_width"], essence_parameters["frame_height"], params.height)
+    return {
+        "id": str(proxy_flow_id),
+        "source_id": source_flow["source_id"],
+        "label": f"{source_flow.get('label', source_flow['id'])} (proxy)",
+        "description": f"Low resolution proxy of Flow {source_flow['id']}",
+        "format": "urn:x-nmos:format:video",
+        "codec": "video/h264",
+        "container": "video/mp2t",
+        "essence_parameters": essence_parameters,
+        "avg_bit_rate": params.bit_rate // 1000,
+        "tags": {PROXY_TAG: source_flow["id"]}
+    }
+
+
+def make_derived_segment(source_segment: dict[str, Any], object_id: str) -> dict[str, Any]:
+    derived_segment = {name: source_segment[name] for name in SEGMENT_PROPERTIES if name in source_segment}
+    derived_segment["object_id"] = object_id
+    return derived_segment
+
+
+def get_timerange_key(timerange: str) -> str:
+    return str(TimeRange.from_str(timerange))
+
+
+async def download_object(
+    session: aiohttp.ClientSession,
+    segment: dict,
+    cache: Optional[MediaObjectCache] = None
+) -> bytes:
+    if cache is not None:
+        return await cache.fetch(session, segment["object_id"], get_download_url(segment))
+    async with session.get(get_download_url(segment)) as resp:
+        resp.raise_for_status()
+        return await resp.read()
+
+
+async def upload_object(session: aiohttp.ClientSession, object_url: dict[str, Any], data: bytes) -> None:
+    async with session.put(
+        object_url["put_url"]["url"],
+        data=data,
+        headers={"Content-Type": object_url["put_url"]["content-type"]}
+    ) as resp:
+        resp.raise_for_status()
+
+
+class DerivedStats:
+    def __init__(self) -> None:
+        self.derived = 0
+        self.reused = 0
+        self.skipped = 0
+
+
+async def create_or_resume_derived_flow(
+    client: TAMSClient,
+    tams_url: str,
+    flow_metadata: dict,
+    tag_name: str
+) -> None:
+    """Create the derived Flow, or check that an existing Flow is derived from the same Flow by the linking tag"""
+    flow_id = flow_metadata["id"]
+    source_flow_id = flow_metadata["tags"][tag_name]
+    flow = await get_optional_flow(client, tams_url, flow_id)
+    if flow is None:
+        logger.info(f"Creating Flow {flow_id}")
+        async with client.put(f"{tams_url}/flows/{flow_id}", json=flow_metadata) as resp:
+            resp.raise_for_status()
+    elif (flow.get("tags") or {}).get(tag_name) != source_flow_id:
+        raise ValueError(f"Flow {flow_id} exists without tag '{tag_name}' linking it to Flow {source_flow_id}")
+    else:
+        logger.info(f"Resuming Flow {flow_id}")
+
+
+async def get_existing_derived_objects(
+    client: TAMSClient,
+    tams_url: str,
+    derived_flow_id: UUID,
+    timerange: TimeRange
+) -> dict[str, str]:
+    """Return the media object IDs of the derived Flow's segments, keyed by segment timerange"""
+    segments_url = f"{tams_url}/flows/{derived_flow_id}/segments?timerange={quote(str(timerange))}"
+    existing: dict[str, str] = {}
+    async for segments in client.get_paged_items(segments_url):
+        for segment in segments:
+            existing[get_timerange_key(segment["timerange"])] = segment["object_id"]
+    return existing
+
+
+async def derive_segments(
+    client: TAMSClient,
+    tams_url: str,
+    source_flow_id: UUID,
+    derived_flow_id: UUID,
+    timerange: TimeRange,
+    derive: Callable[[bytes, dict], Awaitable[bytes]],
+    max_in_flight: int,
+    stats: DerivedStats,
+    storage_batch_size: int = DEFAULT_STORAGE_BATCH_SIZE,
+    register_batch_size: int = DEFAULT_REGISTER_BATCH_SIZE,
+    cache: Optional[MediaObjectCache] = None
+) -> Optional[Timestamp]:
+    """Derive media objects from the source Flow's segments in the timerange that the derived Flow doesn't have yet,
+    and register them
+
+    `derive` is called with the data of a source media object and the segment that references it, and returns the
+    data of the derived media object, which must have the same timestamps. The derived Flow's segments are compared
+    with the source segments by timerange, so that an interrupted run can be resumed. Media objects are downloaded,
+    derived and uploaded with at most `max_in_flight` segments in progress, whilst the derived segments are
+    registered in order. A media object that is referenced by several source segments, e.g. of an edited Flow, is
+    only derived once. Source media objects are fetched through the `cache` if set, so that a re-run doesn't
+    download them again.
+
+    Returns the start of the latest source segment, if any.
+    """
+    loop = asyncio.get_running_loop()
+    existing = await get_existing_derived_objects(client, tams_url, derived_flow_id, timerange)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    derived_objects: dict[str, asyncio.Future] = {}
+    results: asyncio.Queue[Optional[tuple[dict, asyncio.Future]]] = asyncio.Queue(max_in_flight)
+    storage_urls = get_media_storage_urls(client, tams_url, derived_flow_id, storage_batch_size)
+    storage_lock = asyncio.Lock()
+    last_start: Optional[Timestamp] = None
+
+    async def derive_object(segment: dict) -> str:
+        try:
+            data = await download_object(client.session, segment, cache)
+            derived_data = await derive(data, segment)
+            async with storage_lock:
+                object_url = await anext(storage_urls)
+            await upload_object(client.session, object_url, derived_data)
+        finally:
+            in_flight.release()
+        stats.derived += 1
+        logger.info(
+            f"Derived object from {segment['object_id']} at {segment['timerange']} of {len(data)} bytes with "
+            f"{len(derived_data)} bytes")
+        return object_url["object_id"]
+
+    async def schedule_stage() -> None:
+        nonlocal last_start
+        segments_url = f"{tams_url}/flows/{source_flow_id}/segments?timerange={quote(str(timerange))}&presigned=true"
+        async for segments in client.get_paged_items(segments_url):
+            for segment in segments:
+                start = TimeRange.from_str(segment["timerange"]).start
+                if start is not None and (last_start is None or start > last_start):
+                    last_start = start
+                object_id = segment["object_id"]
+                existing_object_id = existing.get(get_timerange_key(segment["timerange"]))
+                if existing_object_id is not None:
+                    # The derived media object can be reused by other segments that reference the original
+                    if object_id not in derived_objects:
+                        derived_objects[object_id] = loop.create_future()
+                        derived_objects[object_id].set_result(existing_object_id)
+                    stats.skipped += 1
+                    continue
+
+                derived_object = derived_objects.get(object_id)
+                if derived_object is None:
+                    # Waits once `max_in_flight` media objects are being downloaded, derived or uploaded
+                    await in_flight.acquire()
+                    derived_object = derived_objects[object_id] = asyncio.ensure_future(derive_object(segment))
+                else:
+                    stats.reused += 1
+                await results.put((segment, derived_object))
+        await results.put(None)
+
+    async def register_stage() -> None:
+        async with SegmentRegistrar(client, tams_url, derived_flow_id, register_batch_size) as registrar:
+            while (item := await results.get()) is not None:
+                segment, derived_object = item
+                await registrar.add(make_derived_segment(segment, await derived_object))
+
+    stages = [asyncio.ensure_future(schedule_stage()), asyncio.ensure_future(register_stage())]
+    try:
+        await asyncio.gather(*stages)
+    finally:
+        pending = [future for future in [*stages, *derived_objects.values()] if not future.done()]
+        for future in pending:
+            future.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        await storage_urls.aclose()
+
+    return last_start
+
+
+async def make_proxy(
+    tams_url: str,
+    credentials: Credentials,
+    source_flow_id: UUID,
+    proxy_flow_id: UUID,
+    timerange: Optional[TimeRange],
+    params: ProxyParameters,
+    workers: int = DEFAULT_WORKERS,
+    max_in_flight: Optional[int] = None,
+    follow_interval: Optional[float] = None,
+    storage_batch_size: int = DEFAULT_STORAGE_BATCH_SIZE,
+    register_batch_size: int = DEFAULT_REGISTER_BATCH_SIZE,
+    cache: Optional[MediaObjectCache] = None
+) -> None:
+    """Create or resume a proxy Flow of the source Flow's segments in the timerange
+
+    The timerange defaults to that of the source Flow. If `follow_interval` is set then the source Flow is checked
+    for new segments at that interval until the script is interrupted.
+    """
+    async with TAMSClient(credentials) as client:
+        source_flow = await get_optional_flow(client, tams_url, source_flow_id)
+        if source_flow is None:
+            raise ValueError(f"Source Flow {source_flow_id} doesn't exist")
+        if source_flow.get("container") != "video/mp2t":
+            raise NotImplementedError("Only Flows with MPEG-TS media objects are supported")
+        if timerange is None:
+            timerange = TimeRange.from_str(source_flow.get("timerange", "_"))
+
+        await create_or_resume_derived_flow(
+            client, tams_url, get_proxy_flow_metadata(source_flow, proxy_flow_id, params), PROXY_TAG)
+
+        stats = DerivedStats()
+        start_time = time.perf_counter()
+        # Worker processes are spawned rather than forked from a process running an event loop
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            loop = asyncio.get_running_loop()
+
+            async def transcode(data: bytes, segment: dict) -> bytes:
+                return await loop.run_in_executor(pool, transcode_segment, data, params)
+
+            while True:
+                last_start = await derive_segments(
+                    client,
+                    tams_url,
+                    source_flow_id,
+                    proxy_flow_id,
+                    timerange,
+                    transcode,
+                    max_in_flight or workers * 2,
+                    stats,
+                    storage_batch_size=storage_batch_size,
+                    register_batch_size=register_batch_size,
+                    cache=cache
+                )
+                if follow_interval is None:
+                    break
+                if last_start is not None:
+                    # Only segments from the latest one onwards are listed again
+                    timerange = timerange.intersect_with(TimeRange.from_start(last_start))
+                await asyncio.sleep(follow_interval)
+
+        elapsed = time.perf_counter() - start_time
+        logger.info(
+            f"Transcoded {stats.derived} media objects, reused {stats.reused} and skipped {stats.skipped} existing "
+            f"segments in {elapsed:.2f}s")
+        if stats.derived > 0:
+            logger.info(
+                f"{stats.derived / elapsed:.2f} segments/s with {workers} workers, "
+                f"{stats.derived / elapsed / min(workers, DEFAULT_WORKERS):.2f} segments/s per core")
+        client.log_stats()
+    if cache is not None:
+        cache.log_report()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="make_proxy",
+        description="Create a low resolution proxy Flow from a TAMS Flow"
+    )
+
+    parser.add_argument(
+        "--tams-url", type=str, required=True,
+        help=("URL of the top level endpoint in the TAMS service.")
+    )
+    parser.add_argument(
+        "--oauth2-url", type=str, default=os.environ.get("OAUTH2_URL"),
+        help="OAuth2 URL for getting credential token. Defaults to the 'OAUTH2_URL' environment variable"
+    )
+    parser.add_argument(
+        "--client-id", type=str, default=os.environ.get("CLIENT_ID"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_ID' environment variable"
+    )
+    parser.add_argument(
+        "--client-secret", type=str, default=os.environ.get("CLIENT_SECRET"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_SECRET' environment variable"
+    )
+    parser.add_argument(
+        "--username", type=str, default=os.environ.get("USERNAME"),
+        help="Basic auth username. Defaults to the 'USERNAME' environment variable"
+    )
+    parser.add_argument(
+        "--password", type=str, default=os.environ.get("PASSWORD"),
+        help="Basic auth password. Defaults to the 'PASSWORD' environment variable"
+    )
+    parser.add_argument(
+        "--token", type=str, default=os.environ.get("TOKEN"),
+        help="Bearer token for authentication. Defaults to the 'TOKEN' environment variable"
+    )
+    parser.add_argument(
+        "--flow-id", type=UUID, required=True,
+        help="ID of the Flow to create a proxy of"
+    )
+    parser.add_argument(
+        "--proxy-flow-id", type=UUID,
+        help="ID of the proxy Flow, which is resumed if it exists. Default is to generate an ID"
+    )
+    parser.add_argument(
+        "--timerange", type=TimeRange.from_str,
+        help="Timerange of the Flow to create a proxy of. Defaults to the Flow's timerange"
+    )
+    parser.add_argument(
+        "--height", type=int, default=ProxyParameters().height,
+        help="Frame height of the proxy"
+    )
+    parser.add_argument(
+        "--bit-rate", type=int, default=ProxyParameters().bit_rate,
+        help="Bit rate of the proxy H.264 encoding"
+    )
+    parser.add_argument(
+        "--preset", type=str, default=ProxyParameters().preset,
+        help="Preset of the proxy libx264 encoding"
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help="Number of transcoding processes. Defaults to the number of CPUs"
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int,
+        help="Maximum number of segments being downloaded, transcoded or uploaded. Defaults to twice the workers"
+    )
+    parser.add_argument(
+        "--follow-interval", type=float,
+        help="Interval in seconds at which to check the Flow for new segments. Default is to stop once done"
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=os.environ.get("MEDIA_CACHE_DIR"),
+        help=("Directory of the media object cache shared by the examples. "
+              "Defaults to the 'MEDIA_CACHE_DIR' environment variable. The cache is not used if not set")
+    )
+    parser.add_argument(
+        "--cache-megabytes", type=int, default=10000,
+        help="Maximum size in megabytes of the media object cache"
+    )
+
+    args = parser.parse_args()
+
+    credentials: Credentials
+    if args.token:
+        from utils.credentials import BearerCredentials
+        credentials = BearerCredentials(args.token)
+    elif args.oauth2_url and args.client_id and args.client_secret:
+        credentials = OAuth2ClientCredentials(args.oauth2_url, args.client_id, args.client_secret)
+    elif args.username and args.password:
+        credentials = BasicCredentials(args.username, args.password)
+    else:
+        logger.error(
+            "Require either Bearer token (--token), OAuth2 credentials (--oauth2-url, --client-id, --client-secret) "
+            "or basic credentials (--username, --password)"
+        )
+        exit(1)
+
+    proxy_flow_id = args.proxy_flow_id or uuid4()
+    logger.info(f"Proxy Flow ID is {proxy_flow_id}")
+
+    asyncio.run(make_proxy(
+        args.tams_url.rstrip("/"),
+        credentials,
+        args.flow_id,
+        proxy_flow_id,
+        args.timerange,
+        ProxyParameters(args.height, args.bit_rate, args.preset),
+        workers=args.workers,
+        max_in_flight=args.max_in_flight,
+        follow_interval=args.follow_interval,
+        cache=MediaObjectCache(args.cache_dir, args.cache_megabytes * 1000 * 1000) if args.cache_dir else None
+    ))
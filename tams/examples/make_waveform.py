@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+# This script demonstrates creating a waveform Flow from an audio Flow, holding a small summary of the peaks and
+# loudness of each segment from which a waveform can be drawn without downloading the audio
+
+from typing import Optional
+from argparse import ArgumentParser
+from uuid import UUID, uuid4
+import asyncio
+import json
+import logging
+import os
+import time
+
+from mediatimestamp import TimeRange
+
+from make_proxy import (
+    DerivedStats,
+    create_or_resume_derived_flow,
+    derive_segments,
+    get_optional_flow
+)
+from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
+from utils.client import TAMSClient
+from utils.media_cache import MediaObjectCache
+from utils.waveform import DEFAULT_PEAKS_PER_SECOND, summarise_audio
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Flow tag that links a waveform Flow to the audio Flow it was created from
+WAVEFORM_TAG = "waveform_of"
+
+
+def get_waveform_flow_metadata(audio_flow: dict, waveform_flow_id: UUID) -> dict:
+    """Return the metadata of a data Flow for the waveform, under the same Source as the audio"""
+    return {
+        "id": str(waveform_flow_id),
+        "source_id": audio_flow["source_id"],
+        "label": f"{audio_flow.get('label', audio_flow['id'])} (waveform)",
+        "description": f"Peaks and EBU R128 momentary loudness of Flow {audio_flow['id']}",
+        "format": "urn:x-nmos:format:data",
+        "codec": "application/json",
+        "container": "application/json",
+        "tags": {WAVEFORM_TAG: audio_flow["id"]}
+    }
+
+
+async def make_waveform(
+    tams_url: str,
+    credentials: Credentials,
+    audio_flow_id: UUID,
+    waveform_flow_id: UUID,
+    timerange: Optional[TimeRange],
+    peaks_per_second: int = DEFAULT_PEAKS_PER_SECOND,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+    follow_interval: Optional[float] = None,
+    cache: Optional[MediaObjectCache] = None
+) -> None:
+    """Create or resume a waveform Flow of the audio Flow's segments in the timerange
+
+    Each media object of the waveform Flow is the JSON summary of an audio media object, and the waveform segments
+    have the same timeranges as the audio segments. The timerange defaults to that of the audio Flow. If
+    `follow_interval` is set then the audio Flow is checked for new segments at that interval until the script is
+    interrupted. The audio media objects are fetched through the `cache` if set.
+    """
+    async with TAMSClient(credentials) as client:
+        audio_flow = await get_optional_flow(client, tams_url, audio_flow_id)
+        if audio_flow is None:
+            raise ValueError(f"Audio Flow {audio_flow_id} doesn't exist")
+        if audio_flow.get("format") != "urn:x-nmos:format:audio":
+            raise ValueError(f"Flow {audio_flow_id} isn't an audio Flow")
+        if audio_flow.get("container") != "video/mp2t":
+            raise NotImplementedError("Only Flows with MPEG-TS media objects are supported")
+        if timerange is None:
+            timerange = TimeRange.from_str(audio_flow.get("timerange", "_"))
+
+        await create_or_resume_derived_flow(
+            client, tams_url, get_waveform_flow_metadata(audio_flow, waveform_flow_id), WAVEFORM_TAG)
+
+        loop = asyncio.get_running_loop()
+
+        async def summarise(data: bytes, segment: dict) -> bytes:
+            # Decoding releases the GIL, so the default thread pool is enough for the small amount of audio
+            summary = await loop.run_in_executor(None, summarise_audio, data, peaks_per_second)
+            return json.dumps(summary, separators=(",", ":")).encode()
+
+        stats = DerivedStats()
+        start_time = time.perf_counter()
+        while True:
+            last_start = await derive_segments(
+                client,
+                tams_url,
+                audio_flow_id,
+                waveform_flow_id,
+                timerange,
+                summarise,
+                max_in_flight,
+                stats,
+                cache=cache
+            )
+            if follow_interval is None:
+                break
+            if last_start is not None:
+                # Only segments from the latest one onwards are listed again
+                timerange = timerange.intersect_with(TimeRange.from_start(last_start))
+            await asyncio.sleep(follow_interval)
+
+        logger.info(
+            f"Summarised {stats.derived} media objects, reused {stats.reused} and skipped {stats.skipped} existing "
+            f"segments in {time.perf_counter() - start_time:.2f}s")
+        client.log_stats()
+    if cache is not None:
+        cache.log_report()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="make_waveform",
+        description="Create a waveform Flow of peaks and loudness from a TAMS audio Flow"
+    )
+
+    parser.add_argument(
+        "--tams-url", type=str, required=True,
+        help=("URL of the top level endpoint in the TAMS service.")
+    )
+    parser.add_argument(
+        "--oauth2-url", type=str, default=os.environ.get("OAUTH2_URL"),
+        help="OAuth2 URL for getting credential token. Defaults to the 'OAUTH2_URL' environment variable"
+    )
+    parser.add_argument(
+        "--client-id", type=str, default=os.environ.get("CLIENT_ID"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_ID' environment variable"
+    )
+    parser.add_argument(
+        "--client-secret", type=str, default=os.environ.get("CLIENT_SECRET"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_SECRET' environment variable"
+    )
+    parser.add_argument(
+        "--username", type=str, default=os.environ.get("USERNAME"),
+        help="Basic auth username. Defaults to the 'USERNAME' environment variable"
+    )
+    parser.add_argument(
+        "--password", type=str, default=os.environ.get("PASSWORD"),
+        help="Basic auth password. Defaults to the 'PASSWORD' environment variable"
+    )
+    parser.add_argument(
+        "--token", type=str, default=os.environ.get("TOKEN"),
+        help="Bearer token for authentication. Defaults to the 'TOKEN' environment variable"
+    )
+    parser.add_argument(
+        "--flow-id", type=UUID, required=True,
+        help="ID of the audio Flow to create a waveform of"
+    )
+    parser.add_argument(
+        "--waveform-flow-id", type=UUID,
+        help="ID of the waveform Flow, which is resumed if it exists. Default is to generate an ID"
+    )
+    parser.add_argument(
+        "--timerange", type=TimeRange.from_str,
+        help="Timerange of the Flow to create a waveform of. Defaults to the Flow's timerange"
+    )
+    parser.add_argument(
+        "--peaks-per-second", type=int, default=DEFAULT_PEAKS_PER_SECOND,
+        help="Number of minimum and maximum sample values per second"
+    )
+    parser.add_argument(
+        "--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+        help="Maximum number of segments being downloaded, summarised or uploaded"
+    )
+    parser.add_argument(
+        "--follow-interval", type=float,
+        help="Interval in seconds at which to check the Flow for new segments. Default is to stop once done"
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=os.environ.get("MEDIA_CACHE_DIR"),
+        help=("Directory of the media object cache shared by the examples. "
+              "Defaults to the 'MEDIA_CACHE_DIR' environment variable. The cache is not used if not set")
+    )
+    parser.add_argument(
+        "--cache-megabytes", type=int, default=10000,
+        help="Maximum size in megabytes of the media object cache"
+    )
+
+    args = parser.parse_args()
+
+    credentials: Credentials
+    if args.token:
+        from utils.credentials import BearerCredentials
+        credentials = BearerCredentials(args.token)
+    elif args.oauth2_url and args.client_id and args.client_secret:
+        credentials = OAuth2ClientCredentials(args.oauth2_url, args.client_id, args.client_secret)
+    elif args.username and args.password:
+        credentials = BasicCredentials(args.username, args.password)
+    else:
+        logger.error(
+            "Require either Bearer token (--token), OAuth2 credentials (--oauth2-url, --client-id, --client-secret) "
+            "or basic credentials (--username, --password)"
+        )
+        exit(1)
+
+    waveform_flow_id = args.waveform_flow_id or uuid4()
+    logger.info(f"Waveform Flow ID is {waveform_flow_id}")
+
+    asyncio.run(make_waveform(
+        args.tams_url.rstrip("/"),
+        credentials,
+        args.flow_id,
+        waveform_flow_id,
+        args.timerange,
+        peaks_per_second=args.peaks_per_second,
+        max_in_flight=args.max_in_flight,
+        follow_interval=args.follow_interval,
+        cache=MediaObjectCache(args.cache_dir, args.cache_megabytes * 1000 * 1000) if args.cache_dir else None
+    ))
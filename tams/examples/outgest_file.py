@@ -1,71 +1,98 @@
 #!/usr/bin/env python
 # This script demonstrates outgest of a TAMS Flow to a local file
 
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Generator, Optional
 from argparse import ArgumentParser
+from collections import deque
+from contextlib import AsyncExitStack
 from uuid import UUID
 from io import BytesIO
 import os
 from fractions import Fraction
 import asyncio
+import heapq
 import logging
+import time
 
 from mediatimestamp import Timestamp, TimeRange
-import aiohttp
 import av
 
 from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
-from utils.client import get_request
+from utils.client import TAMSClient, DEFAULT_CONNECTION_LIMIT_PER_HOST
+from utils.media_cache import MediaObjectCache
+from utils.prefetch import PacketIndexStore, SegmentPrefetcher
 
 logging.basicConfig()
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
-async def get_flow(tams_url: str, credentials: Credentials, flow_id: UUID) -> dict:
+async def get_flow(client: TAMSClient, tams_url: str, flow_id: UUID) -> dict:
     """Returns a Flow dict for the given Flow ID"""
-    flow_url = f"{tams_url}/flows/{flow_id}"
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        async with get_request(session, credentials, flow_url) as resp:
-            resp.raise_for_status()
-            return await resp.json()
+    async with client.get(f"{tams_url}/flows/{flow_id}") as resp:
+        resp.raise_for_status()
+        return await resp.json()
+
+
+def get_segment_start(segment: dict) -> Timestamp:
+    start = TimeRange.from_str(segment["timerange"]).start
+    if start is None:
+        raise ValueError(f"Segment {segment['object_id']} has a timerange without a start")
+    return start
 
 
 async def get_flow_segments(
+    client: TAMSClient,
     tams_url: str,
-    credentials: Credentials,
     flow: dict,
     timerange: TimeRange
 ) -> AsyncGenerator[dict, None]:
-    """Generator of Flow Segment dicts for the given Flow ID and timerange"""
+    """Generator of Flow Segment dicts for the given Flow ID and timerange, in timeline order
+
+    Segments are yielded as the pages arrive. The pages are expected to be in timeline order and a reorder
+    buffer keyed on the segment start is used to handle segments that are out of order within a page. Segments
+    in the buffer are released once the next page shows that no earlier segment can follow.
+    """
     segments_url = (
         f"{tams_url}/flows/{flow['id']}/segments?timerange={timerange!s}"
         "&presigned=true&include_object_timerange=true")
-    
-    all_segments = []
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        while True:
-            async with get_request(session, credentials, segments_url) as resp:
-                resp.raise_for_status()
-                segments = await resp.json()
-                all_segments.extend(segments)
-                try:
-                    segments_url = str(resp.links["next"]["url"])
-                except KeyError:
-                    break
-                    
-    # Sort segments by timerange start
-    all_segments.sort(key=lambda s: TimeRange.from_str(s["timerange"]).start)
-    
-    for segment in all_segments:
-        segment_timerange = TimeRange.from_str(segment["timerange"])
-        if segment_timerange.overlaps_with_timerange(timerange):
-            yield segment
-        else:
-            logger.warning(
-                f"Skipping segment returned by TAMS with a timerange {segment_timerange!s} "
-                f"that does not overlap with the target timerange {timerange!s}"
-            )
+
+    # Heap of (start, sequence number, segment). The sequence number keeps the page order for equal starts
+    reorder_buffer: list[tuple[Timestamp, int, dict]] = []
+    sequence = 0
+    last_start = None
+
+    def release_segments(before: Optional[Timestamp]) -> Generator[dict, None, None]:
+        nonlocal last_start
+        while reorder_buffer and (before is None or reorder_buffer[0][0] <= before):
+            start, _, segment = heapq.heappop(reorder_buffer)
+            if last_start is not None and start < last_start:
+                logger.warning(
+                    f"Segment at {segment['timerange']} was returned by TAMS after a later segment "
+                    "and is out of order")
+            last_start = start
+
+            segment_timerange = TimeRange.from_str(segment["timerange"])
+            if segment_timerange.overlaps_with_timerange(timerange):
+                yield segment
+            else:
+                logger.warning(
+                    f"Skipping segment returned by TAMS with a timerange {segment_timerange!s} "
+                    f"that does not overlap with the target timerange {timerange!s}"
+                )
+
+    async for segments in client.get_paged_items(segments_url):
+        page_starts = [get_segment_start(segment) for segment in segments]
+        if page_starts:
+            # Segments that start no later than this page can't be preceded by a segment on a later page
+            for segment in release_segments(min(page_starts)):
+                yield segment
+        for start, segment in zip(page_starts, segments):
+            heapq.heappush(reorder_buffer, (start, sequence, segment))
+            sequence += 1
+
+    for segment in release_segments(None):
+        yield segment
 
 
 def normalise_and_transfer_media(
@@ -73,11 +100,19 @@ def normalise_and_transfer_media(
     segment: dict,
     media_essence: BytesIO,
     av_output: av.container.OutputContainer,
-    check_timing: bool
+    check_timing: bool,
+    trim_timerange: Optional[TimeRange] = None,
+    output_stream_index: int = 0,
+    packets: Optional[list[av.Packet]] = None
 ) -> TimeRange:
     """Transfer the essence from the media object to the output file.
 
-    Also normalise the included sample range and timing using the Flow Segment information.
+    Also normalise the included sample range and timing using the Flow Segment information. If `trim_timerange` is
+    set then `media_essence` only holds the packets needed for that part of the segment, which are all transferred.
+
+    The packets are transferred to the output stream at `output_stream_index`, which is added from the media
+    object's stream if it doesn't exist yet. If `packets` is given then the packets are appended to it for the caller
+    to mux, e.g. interleaved with the packets of other Flows, rather than being muxed.
     """
     # Identify the stream in the input MPEG-TS container
     if "container_mapping" in flow and flow["container_mapping"] is not None:
@@ -153,6 +188,11 @@ def normalise_and_transfer_media(
 
     skip_start_duration = segment_timerange.start - offset_object_timerange.start
     skip_end_duration = offset_object_timerange.end - segment_timerange.end
+    if trim_timerange is not None:
+        # The packets were selected using the media object's packet index, from the random access point before the
+        # start of the trimmed timerange, so counting samples from the start of the object doesn't apply
+        skip_start_duration = Timestamp()
+        skip_end_duration = Timestamp()
 
     discarding_samples = skip_start_duration > 0 or skip_end_duration > 0
     output_timerange = TimeRange.never()
@@ -207,9 +247,9 @@ def normalise_and_transfer_media(
                 continue
 
             # Re-assign the packet to the output stream
-            if len(av_output.streams) == 0:
+            if len(av_output.streams) <= output_stream_index:
                 av_output.add_stream_from_template(pkt.stream)
-            pkt.stream = av_output.streams[0]
+            pkt.stream = av_output.streams[output_stream_index]
 
             # Adjust the packet timing to place it on the Flow's timeline using FlowSegment.ts_offset
             if pkt.pts is not None:
@@ -235,7 +275,10 @@ def normalise_and_transfer_media(
             if pkt.dts is not None:
                 pkt.dts = pkt.dts + ts_offset.to_count(1/pkt.time_base)
 
-            av_output.mux([pkt])
+            if packets is None:
+                av_output.mux([pkt])
+            else:
+                packets.append(pkt)
 
             # Discard media units after segment_timerange end
             if process_media_packet_offsets and not output_timerange.ends_earlier_than_timerange(segment_timerange):
@@ -250,7 +293,7 @@ def normalise_and_transfer_media(
                     )
                 break
 
-    if check_timing and not discarding_samples:
+    if check_timing and not discarding_samples and trim_timerange is None:
         # Warn if the normalised timerange calculated from the media pts and FlowSegment.ts_offset
         # does not equal the normalised FlowSegment.timerange.
         # Note that normalisation will hide differences that are less than 1/2 the media unit duration
@@ -266,63 +309,192 @@ def normalise_and_transfer_media(
     return output_timerange
 
 
+def check_flow_supported(flow: dict) -> None:
+    """Raise NotImplementedError unless the Flow has MPEG-TS media objects containing audio or video"""
+    if "container" not in flow:
+        raise NotImplementedError(f"Flow {flow['id']} without a container is not supported")
+    if flow["container"] != "video/mp2t":
+        raise NotImplementedError(f"Flow {flow['id']} container '{flow['container']}' is not supported")
+    if flow["format"] not in ["urn:x-nmos:format:video", "urn:x-nmos:format:audio"]:
+        raise NotImplementedError(f"Flow {flow['id']} format '{flow['format']}' is not supported")
+
+
+async def get_output_flows(client: TAMSClient, tams_url: str, flow_ids: list[UUID]) -> list[dict]:
+    """Returns the Flow dicts to outgest for the Flow IDs, with multi-essence Flows replaced by their collection"""
+    flows = []
+    for flow_id in flow_ids:
+        flow = await get_flow(client, tams_url, flow_id)
+        if flow["format"] == "urn:x-nmos:format:multi":
+            if not flow.get("flow_collection"):
+                raise ValueError(f"Multi-essence Flow {flow_id} has no Flow collection")
+            for item in flow["flow_collection"]:
+                flows.append(await get_flow(client, tams_url, item["id"]))
+        else:
+            flows.append(flow)
+    return flows
+
+
+class FlowOutput:
+    """The state of a Flow that is outgested to one of the output streams
+
+    `packets` holds the packets of the Flow's current segment that are waiting to be interleaved with the packets of
+    the other Flows.
+    """
+    def __init__(self, flow: dict, prefetcher: SegmentPrefetcher, stream_index: int) -> None:
+        self.flow = flow
+        self.prefetcher = prefetcher
+        self.stream_index = stream_index
+        self.packets: deque[av.Packet] = deque()
+        self.done = False
+
+
+def get_packet_time(pkt: av.Packet) -> Fraction:
+    """Return the decode time of the packet in seconds, which is the order in which packets are muxed"""
+    timestamp = pkt.dts if pkt.dts is not None else pkt.pts
+    assert timestamp is not None and pkt.time_base is not None
+    return timestamp * pkt.time_base
+
+
+def interleave_packets(outputs: list[FlowOutput], av_output: av.container.OutputContainer) -> None:
+    """Mux the waiting packets of the Flows in decode time order, until a Flow that isn't done has no packets
+
+    The Flow without packets needs its next segment before it is known which packet comes next.
+    """
+    while True:
+        waiting = [output for output in outputs if output.packets]
+        if not waiting or any(not output.packets and not output.done for output in outputs):
+            return
+        next_output = min(waiting, key=lambda output: get_packet_time(output.packets[0]))
+        av_output.mux(next_output.packets.popleft())
+
+
 async def outgest_file(
     tams_url: str,
     credentials: Credentials,
-    flow_id: UUID,
+    flow_ids: list[UUID],
     timerange: TimeRange,
     output_filename: str,
-    check_timing: bool
+    check_timing: bool,
+    prefetch_window: int = 4,
+    prefetch_bytes: int = 256 * 1000 * 1000,
+    cache: Optional[MediaObjectCache] = None,
+    trim: bool = False,
+    index_cache: Optional[MediaObjectCache] = None
 ) -> TimeRange:
-    flow = await get_flow(tams_url, credentials, flow_id)
-
-    # Support is limited to Flows with MPEG-TS media objects containing audio or video
-    if "container" not in flow:
-        raise NotImplementedError("Flow without a container is not supported")
-    if flow["container"] != "video/mp2t":
-        raise NotImplementedError(f"Flow container '{flow['container']}' is not supported")
-    if flow["format"] not in ["urn:x-nmos:format:video", "urn:x-nmos:format:audio"]:
-        raise NotImplementedError(f"Flow format '{flow['format']}' is not supported")
-
-    output_timerange = TimeRange.never()
-    with av.open(output_filename, mode="w", format="mpegts") as av_output:
-        async with aiohttp.ClientSession(trust_env=True) as media_object_session:
-            async for segment in get_flow_segments(tams_url, credentials, flow, timerange):
-                try:
-                    download_url = segment["get_urls"][0]["url"]
-                except KeyError:
-                    raise ValueError("Unable to find download URL for segment "
-                                     f"{segment['object_id']} at {segment['timerange']}")
-
-                # Assuming the media object is small enough to load into memory. An alternative
-                # would be to use streaming responses, although that's complicated here as
-                # PyAV doesn't support async file / stream inputs.
-                # An optimisation would be to add some concurrency by fetching media objects
-                # in multiple asyncio tasks and to also use a queue + threads to parse and process
-                # the packets.
-                async with media_object_session.get(download_url) as resp:
-                    resp.raise_for_status()
-                    media_essence = BytesIO(await resp.read())
-
-                # Note: not passing timerange to discard media units outside the target timerange.
-                # This is because they may be needed for video precharge / audio priming or
-                # video rollout / audio remainder. The output may therefore have more media than
-                # that requested using the timerange.
-                # An alternative is to take the timerange into account and then deal with precharge etc.
-                # Formats such as MP4 could identify how much precharge etc. there is.
-
-                seg_output_timerange = await asyncio.get_running_loop().run_in_executor(
-                    None,
-                    normalise_and_transfer_media,
-                    flow,
-                    segment,
-                    media_essence,
-                    av_output,
-                    check_timing
-                )
-                output_timerange = output_timerange.extend_to_encompass_timerange(seg_output_timerange)
+    """Outgest the Flows to a file, with a stream for each Flow
 
-                logger.info(f"Outgested flow segment at {segment['timerange']}")
+    Multi-essence Flows are replaced by the Flows in their collection. If there are several Flows then their
+    segments are listed and downloaded concurrently, each with its own `prefetch_window` and an equal share of
+    `prefetch_bytes`, and the packets are interleaved by decode time into the output.
+    """
+    async with TAMSClient(credentials) as client:
+        flows = await get_output_flows(client, tams_url, flow_ids)
+        for flow in flows:
+            check_flow_supported(flow)
+
+    # The TAMS API requests and media object downloads share a connection pool, and the downloads are limited to the
+    # number of prefetched segments of each Flow
+    limit_per_host = max(prefetch_window * len(flows), DEFAULT_CONNECTION_LIMIT_PER_HOST)
+    interleave = len(flows) > 1
+    async with TAMSClient(credentials, limit_per_host=limit_per_host) as client:
+        loop = asyncio.get_running_loop()
+        output_timerange = TimeRange.never()
+        start_time = time.monotonic()
+        mux_duration = 0.0
+        indexes = PacketIndexStore(index_cache)
+        with av.open(output_filename, mode="w", format="mpegts") as av_output:
+            async with AsyncExitStack() as stack:
+                # Media objects are downloaded up to `prefetch_window` segments ahead whilst earlier segments are
+                # muxed, with the downloaded media held in memory limited by `prefetch_bytes`. Streaming responses
+                # aren't used because PyAV doesn't support async file / stream inputs.
+                outputs = []
+                for stream_index, flow in enumerate(flows):
+                    prefetcher = await stack.enter_async_context(SegmentPrefetcher(
+                        client.session,
+                        get_flow_segments(client, tams_url, flow, timerange),
+                        prefetch_window,
+                        prefetch_bytes // len(flows),
+                        cache=cache,
+                        trim_timerange=timerange if trim else None,
+                        indexes=indexes
+                    ))
+                    outputs.append(FlowOutput(flow, prefetcher, stream_index))
+
+                async def transfer_next_segment(output: FlowOutput) -> None:
+                    nonlocal output_timerange, mux_duration
+                    prefetched = await anext(output.prefetcher, None)
+                    if prefetched is None:
+                        output.done = True
+                        return
+                    segment = prefetched.segment
+
+                    # Note: unless `trim` is set, the timerange is not used to discard media units outside the
+                    # target timerange. This is because they may be needed for video precharge / audio priming or
+                    # video rollout / audio remainder. The output may therefore have more media than
+                    # that requested using the timerange.
+                    # If `trim` is set then the segments at the ends of the timerange are reduced to the packets
+                    # needed to decode the frames within it, which still includes the precharge from the
+                    # preceding key frame. Formats such as MP4 could identify how much precharge etc. there is.
+
+                    # The packets of several Flows are held until they can be interleaved, which is at most a
+                    # segment of each Flow
+                    packets: Optional[list[av.Packet]] = [] if interleave else None
+                    mux_start_time = time.monotonic()
+                    seg_output_timerange = await loop.run_in_executor(
+                        None,
+                        normalise_and_transfer_media,
+                        output.flow,
+                        segment,
+                        prefetched.media_essence,
+                        av_output,
+                        check_timing,
+                        prefetched.trim_timerange,
+                        output.stream_index,
+                        packets
+                    )
+                    mux_duration += time.monotonic() - mux_start_time
+                    await output.prefetcher.release(prefetched)
+                    if packets is not None:
+                        output.packets.extend(packets)
+                    output_timerange = output_timerange.extend_to_encompass_timerange(seg_output_timerange)
+
+                    flow_label = f"flow {output.flow['id']} segment" if interleave else "flow segment"
+                    if prefetched.trim_timerange is not None:
+                        logger.info(
+                            f"Outgested {flow_label} at {segment['timerange']}, trimmed to "
+                            f"{prefetched.trim_timerange!s} using {prefetched.size} bytes of the media object")
+                    else:
+                        logger.info(f"Outgested {flow_label} at {segment['timerange']}")
+
+                # The output streams are added in order by the first segment of each Flow, before any packets are
+                # muxed
+                for output in outputs:
+                    while not output.packets and not output.done and len(av_output.streams) <= output.stream_index:
+                        await transfer_next_segment(output)
+                    if len(av_output.streams) <= output.stream_index:
+                        raise ValueError(f"Flow {output.flow['id']} has no media in the timerange {timerange!s}")
+
+                while True:
+                    await asyncio.gather(*(
+                        transfer_next_segment(output)
+                        for output in outputs
+                        if not output.packets and not output.done
+                    ))
+                    if all(output.done and not output.packets for output in outputs):
+                        break
+                    if interleave:
+                        mux_start_time = time.monotonic()
+                        await loop.run_in_executor(None, interleave_packets, outputs, av_output)
+                        mux_duration += time.monotonic() - mux_start_time
+
+        client.log_stats()
+
+    peak_prefetched = sum(output.prefetcher.budget.peak for output in outputs)
+    logger.info(
+        f"Outgest took {time.monotonic() - start_time:.2f}s, of which muxing took {mux_duration:.2f}s. "
+        f"Peak prefetched media was {peak_prefetched / 1e6:.1f} MB")
+    if cache is not None:
+        cache.log_report()
 
     return output_timerange
 
@@ -358,8 +530,9 @@ if __name__ == "__main__":
         help="Basic auth password. Defaults to the 'PASSWORD' environment variable"
     )
     parser.add_argument(
-        "--flow-id", type=UUID, required=True,
-        help="Output media from this Flow"
+        "--flow-id", type=UUID, nargs="+", required=True,
+        help=("Output media from these Flows, e.g. a video Flow and its audio Flows, with a stream for each. "
+              "A multi-essence Flow is replaced by the Flows in its collection")
     )
     parser.add_argument(
         "--output", type=str, required=True,
@@ -377,6 +550,37 @@ if __name__ == "__main__":
         "--token", type=str, default=os.environ.get("TOKEN"),
         help="Bearer token for authentication. Defaults to the 'TOKEN' environment variable"
     )
+    parser.add_argument(
+        "--prefetch-segments", type=int, default=4,
+        help="Maximum number of segment media objects downloaded ahead of the muxing"
+    )
+    parser.add_argument(
+        "--prefetch-megabytes", type=int, default=256,
+        help="Maximum size in megabytes of the media objects downloaded ahead of the muxing"
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=os.environ.get("MEDIA_CACHE_DIR"),
+        help=("Directory of the media object cache shared by the examples. "
+              "Defaults to the 'MEDIA_CACHE_DIR' environment variable. The cache is not used if not set")
+    )
+    parser.add_argument(
+        "--cache-megabytes", type=int, default=10000,
+        help="Maximum size in megabytes of the media object cache"
+    )
+    parser.add_argument(
+        "--trim", action="store_true",
+        help=("Trim the segments at the ends of the timerange to the packets needed to decode the frames within it, "
+              "using byte range requests for media objects that have been indexed")
+    )
+    parser.add_argument(
+        "--index-cache-dir", type=str, default=os.environ.get("PACKET_INDEX_CACHE_DIR"),
+        help=("Directory of the media object packet index cache used by --trim. Defaults to the "
+              "'PACKET_INDEX_CACHE_DIR' environment variable, or a sub-directory of --cache-dir if that is set")
+    )
+    parser.add_argument(
+        "--index-cache-megabytes", type=int, default=100,
+        help="Maximum size in megabytes of the packet index cache"
+    )
 
     args = parser.parse_args()
 
@@ -395,19 +599,31 @@ if __name__ == "__main__":
         )
         exit(1)
 
-    logger.info(f"Outputing timerange {args.timerange!s} of flow {args.flow_id} to {args.output}")
+    logger.info(
+        f"Outputing timerange {args.timerange!s} of flows {', '.join(str(flow_id) for flow_id in args.flow_id)} "
+        f"to {args.output}")
     if args.timerange.start is not None:
         logger.info(f"Timerange start as UTC is {args.timerange.start.to_iso8601_utc()}")
     if args.timerange.end is not None:
         logger.info(f"Timerange end as UTC is {args.timerange.end.to_iso8601_utc()}")
 
+    index_cache_dir = args.index_cache_dir
+    if index_cache_dir is None and args.cache_dir:
+        index_cache_dir = os.path.join(args.cache_dir, "packet_index")
+
     output_timerange = asyncio.run(outgest_file(
         args.tams_url.rstrip("/"),
         credentials,
         args.flow_id,
         args.timerange,
         args.output,
-        args.check_timing
+        args.check_timing,
+        prefetch_window=args.prefetch_segments,
+        prefetch_bytes=args.prefetch_megabytes * 1000 * 1000,
+        cache=MediaObjectCache(args.cache_dir, args.cache_megabytes * 1000 * 1000) if args.cache_dir else None,
+        trim=args.trim,
+        index_cache=(
+            MediaObjectCache(index_cache_dir, args.index_cache_megabytes * 1000 * 1000) if index_cache_dir else None)
     ))
 
     logger.info(f"Output timerange {output_timerange!s}")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+# This script demonstrates drawing the waveform of a timerange of audio from the summaries in a waveform Flow, as
+# created by make_waveform.py, without downloading the audio
+
+from typing import Any, Optional
+from argparse import ArgumentParser
+from uuid import UUID
+import asyncio
+import json
+import logging
+import os
+
+from mediatimestamp import TimeRange
+
+from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
+from utils.client import TAMSClient
+from utils.media_cache import MediaObjectCache
+from utils.waveform import LOUDNESS_FLOOR, get_summaries, render_columns
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+SVG_HEIGHT = 200
+
+
+def make_svg(waveform: dict[str, Any]) -> str:
+    """Return an SVG drawing of the rendered columns, with the peaks as lines and the loudness as a polyline"""
+    middle = SVG_HEIGHT // 2
+    lines = []
+    for column, peaks in enumerate(waveform["peaks"]):
+        if peaks is not None:
+            lines.append(
+                f'<line x1="{column}" x2="{column}" y1="{middle - peaks[1] * middle // 128}" '
+                f'y2="{middle - peaks[0] * middle // 128}"/>')
+    points = " ".join(
+        f"{column},{round(value / LOUDNESS_FLOOR * SVG_HEIGHT)}"
+        for column, value in enumerate(waveform["momentary_loudness"])
+        if value is not None
+    )
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{waveform["columns"]}" height="{SVG_HEIGHT}">\n'
+        f'<g stroke="steelblue">\n' + "\n".join(lines) + "\n</g>\n"
+        f'<polyline fill="none" stroke="orange" points="{points}"/>\n'
+        "</svg>\n"
+    )
+
+
+async def render_waveform(
+    tams_url: str,
+    credentials: Credentials,
+    waveform_flow_id: UUID,
+    timerange: TimeRange,
+    columns: int,
+    output_filename: str,
+    cache: Optional[MediaObjectCache] = None
+) -> None:
+    async with TAMSClient(credentials) as client:
+        summaries = await get_summaries(client, tams_url, waveform_flow_id, timerange, cache=cache)
+        logger.info(f"Downloaded {len(summaries)} summaries")
+        waveform = render_columns(summaries, timerange, columns)
+    if cache is not None:
+        cache.log_report()
+
+    with open(output_filename, "w") as f:
+        if output_filename.endswith(".svg"):
+            f.write(make_svg(waveform))
+        else:
+            json.dump(waveform, f)
+    logger.info(f"Wrote waveform to {output_filename}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="render_waveform",
+        description="Draw the waveform of a timerange from a TAMS waveform Flow"
+    )
+
+    parser.add_argument(
+        "--tams-url", type=str, required=True,
+        help=("URL of the top level endpoint in the TAMS service.")
+    )
+    parser.add_argument(
+        "--oauth2-url", type=str, default=os.environ.get("OAUTH2_URL"),
+        help="OAuth2 URL for getting credential token. Defaults to the 'OAUTH2_URL' environment variable"
+    )
+    parser.add_argument(
+        "--client-id", type=str, default=os.environ.get("CLIENT_ID"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_ID' environment variable"
+    )
+    parser.add_argument(
+        "--client-secret", type=str, default=os.environ.get("CLIENT_SECRET"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_SECRET' environment variable"
+    )
+    parser.add_argument(
+        "--username", type=str, default=os.environ.get("USERNAME"),
+        help="Basic auth username. Defaults to the 'USERNAME' environment variable"
+    )
+    parser.add_argument(
+        "--password", type=str, default=os.environ.get("PASSWORD"),
+        help="Basic auth password. Defaults to the 'PASSWORD' environment variable"
+    )
+    parser.add_argument(
+        "--token", type=str, default=os.environ.get("TOKEN"),
+        help="Bearer token for authentication. Defaults to the 'TOKEN' environment variable"
+    )
+    parser.add_argument(
+        "--waveform-flow-id", type=UUID, required=True,
+        help="ID of the waveform Flow"
+    )
+    parser.add_argument(
+        "--timerange", type=TimeRange.from_str, required=True,
+        help="Bounded timerange to draw"
+    )
+    parser.add_argument(
+        "--columns", type=int, default=1000,
+        help="Number of columns, e.g. the pixel width of the drawing"
+    )
+    parser.add_argument(
+        "--output", type=str, default="waveform.svg",
+        help="Filename of the drawing, which is SVG if it ends with '.svg' and otherwise the columns as JSON"
+    )
+    parser.add_argument(
+        "--cache-dir", type=str, default=os.environ.get("MEDIA_CACHE_DIR"),
+        help=("Directory of the media object cache shared by the examples. "
+              "Defaults to the 'MEDIA_CACHE_DIR' environment variable. The cache is not used if not set")
+    )
+    parser.add_argument(
+        "--cache-megabytes", type=int, default=10000,
+        help="Maximum size in megabytes of the media object cache"
+    )
+
+    args = parser.parse_args()
+
+    credentials: Credentials
+    if args.token:
+        from utils.credentials import BearerCredentials
+        credentials = BearerCredentials(args.token)
+    elif args.oauth2_url and args.client_id and args.client_secret:
+        credentials = OAuth2ClientCredentials(args.oauth2_url, args.client_id, args.client_secret)
+    elif args.username and args.password:
+        credentials = BasicCredentials(args.username, args.password)
+    else:
+        logger.error(
+            "Require either Bearer token (--token), OAuth2 credentials (--oauth2-url, --client-id, --client-secret) "
+            "or basic credentials (--username, --password)"
+        )
+        exit(1)
+
+    asyncio.run(render_waveform(
+        args.tams_url.rstrip("/"),
+        credentials,
+        args.waveform_flow_id,
+        args.timerange,
+        args.columns,
+        args.output,
+        cache=MediaObjectCache(args.cache_dir, args.cache_megabytes * 1000 * 1000) if args.cache_dir else None
+    ))
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+# This script demonstrates playback of TAMS Flows by serving HLS media playlists generated from their segments
+
+from argparse import ArgumentParser
+from uuid import UUID
+import asyncio
+import logging
+import os
+import signal
+import time
+
+from aiohttp import web, ClientResponseError
+from mediatimestamp import TimeRange
+
+from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
+from utils.client import TAMSClient
+from utils.hls_playlist import (
+    PlaylistGenerator,
+    DEFAULT_CACHE_SIZE,
+    DEFAULT_LIVE_WINDOW,
+    DEFAULT_MAX_AGE_SECONDS,
+    DEFAULT_PAGE_LIMIT
+)
+
+logging.basicConfig()
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+PLAYLIST_CONTENT_TYPE = "application/vnd.apple.mpegurl"
+
+
+def playlist_response(text: str, cache_control: str) -> web.Response:
+    return web.Response(
+        text=text,
+        content_type=PLAYLIST_CONTENT_TYPE,
+        headers={
+            "Cache-Control": cache_control,
+            # Allows browser players, e.g. hls.js, served from other origins
+            "Access-Control-Allow-Origin": "*"
+        }
+    )
+
+
+def get_flow_id(request: web.Request) -> str:
+    try:
+        return str(UUID(request.match_info["flow_id"]))
+    except ValueError:
+        raise web.HTTPBadRequest(text="Invalid Flow ID")
+
+
+async def generate_playlist(request: web.Request, live: bool) -> str:
+    generator: PlaylistGenerator = request.app["generator"]
+    flow_id = get_flow_id(request)
+    start_time = time.perf_counter()
+    try:
+        if live:
+            text = await generator.live_playlist(flow_id)
+        else:
+            try:
+                timerange = TimeRange.from_str(request.query.get("timerange", "_"))
+            except ValueError:
+                raise web.HTTPBadRequest(text="Invalid timerange")
+            text = await generator.media_playlist(flow_id, timerange)
+    except ClientResponseError as e:
+        if e.status == 404:
+            raise web.HTTPNotFound(text="Flow not found")
+        raise web.HTTPBadGateway(text=f"TAMS request failed with status {e.status}")
+    except ValueError as e:
+        raise web.HTTPBadGateway(text=str(e))
+
+    logger.info(f"Generated {'live' if live else 'VOD'} playlist for {flow_id} in "
+                f"{(time.perf_counter() - start_time) * 1000:.1f} ms")
+    return text
+
+
+async def vod_playlist(request: web.Request) -> web.Response:
+    text = await generate_playlist(request, live=False)
+    max_age = int(request.app["generator"].max_age)
+    return playlist_response(text, f"max-age={max_age}")
+
+
+async def live_playlist(request: web.Request) -> web.Response:
+    text = await generate_playlist(request, live=True)
+    return playlist_response(text, "no-cache")
+
+
+async def serve_hls(
+    tams_url: str,
+    credentials: Credentials,
+    host: str,
+    port: int,
+    max_age: float = DEFAULT_MAX_AGE_SECONDS,
+    cache_size: int = DEFAULT_CACHE_SIZE,
+    live_window: int = DEFAULT_LIVE_WINDOW,
+    page_limit: int = DEFAULT_PAGE_LIMIT
+) -> None:
+    async with TAMSClient(credentials) as client:
+        app = web.Application()
+        app["generator"] = generator = PlaylistGenerator(
+            client,
+            tams_url,
+            max_age=max_age,
+            cache_size=cache_size,
+            live_window=live_window,
+            page_limit=page_limit
+        )
+        app.add_routes([
+            web.get("/flows/{flow_id}/index.m3u8", vod_playlist),
+            web.get("/flows/{flow_id}/live.m3u8", live_playlist),
+        ])
+
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Serving HLS playlists at http://{host}:{port}/flows/<flow_id>/index.m3u8")
+        # Serve until the process is interrupted or terminated
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        try:
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            generator.log_stats()
+            client.log_stats()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="serve_hls",
+        description="TAMS Flow HLS playlist service example"
+    )
+
+    parser.add_argument(
+        "--tams-url", type=str, required=True,
+        help=("URL of the top level endpoint in the TAMS service.")
+    )
+    parser.add_argument(
+        "--oauth2-url", type=str, default=os.environ.get("OAUTH2_URL"),
+        help="OAuth2 URL for getting credential token. Defaults to the 'OAUTH2_URL' environment variable"
+    )
+    parser.add_argument(
+        "--client-id", type=str, default=os.environ.get("CLIENT_ID"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_ID' environment variable"
+    )
+    parser.add_argument(
+        "--client-secret", type=str, default=os.environ.get("CLIENT_SECRET"),
+        help="Keycloak client secret. Defaults to the 'CLIENT_SECRET' environment variable"
+    )
+    parser.add_argument(
+        "--username", type=str, default=os.environ.get("USERNAME"),
+        help="Basic auth username. Defaults to the 'USERNAME' environment variable"
+    )
+    parser.add_argument(
+        "--password", type=str, default=os.environ.get("PASSWORD"),
+        help="Basic auth password. Defaults to the 'PASSWORD' environment variable"
+    )
+    parser.add_argument(
+        "--token", type=str, default=os.environ.get("TOKEN"),
+        help="Bearer token for authentication. Defaults to the 'TOKEN' environment variable"
+    )
+    parser.add_argument(
+        "--host", type=str, default="localhost",
+        help="Host address the playlists are served on"
+    )
+    parser.add_argument(
+        "--port", type=int, default=8080,
+        help="Port the playlists are served on"
+    )
+    parser.add_argument(
+        "--max-age", type=float, default=DEFAULT_MAX_AGE_SECONDS,
+        help="Maximum age in seconds of a cached playlist, which must be less than the expiry of pre-signed URLs"
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=DEFAULT_CACHE_SIZE,
+        help="Maximum number of cached playlists"
+    )
+    parser.add_argument(
+        "--live-window", type=int, default=DEFAULT_LIVE_WINDOW,
+        help="Number of segments in live playlists"
+    )
+    parser.add_argument(
+        "--page-limit", type=int, default=DEFAULT_PAGE_LIMIT,
+        help="Number of segments requested per listing page"
+    )
+
+    args = parser.parse_args()
+
+    credentials: Credentials
+    if args.token:
+        from utils.credentials import BearerCredentials
+        credentials = BearerCredentials(args.token)
+    elif args.oauth2_url and args.client_id and args.client_secret:
+        credentials = OAuth2ClientCredentials(args.oauth2_url, args.client_id, args.client_secret)
+    elif args.username and args.password:
+        credentials = BasicCredentials(args.username, args.password)
+    else:
+        logger.error(
+            "Require either Bearer token (--token), OAuth2 credentials (--oauth2-url, --client-id, --client-secret) "
+            "or basic credentials (--username, --password)"
+        )
+        exit(1)
+
+    asyncio.run(serve_hls(
+        args.tams_url.rstrip("/"),
+        credentials,
+        args.host,
+        args.port,
+        max_age=args.max_age,
+        cache_size=args.cache_size,
+        live_window=args.live_window,
+        page_limit=args.page_limit
+    ))
@@ -8,13 +8,13 @@ import logging
 from argparse import ArgumentParser
 from uuid import UUID, uuid4
 from fractions import Fraction
+from urllib.parse import quote
 
-import aiohttp
 from mediatimestamp import TimeRange, Timestamp
-import mediajson
 
 from utils.credentials import Credentials, BasicCredentials, OAuth2ClientCredentials
-from utils.client import post_request, put_request, get_request
+from utils.client import TAMSClient
+from utils.registration import SegmentRegistrar, DEFAULT_BATCH_SIZE, DEFAULT_CONCURRENCY
 
 logging.basicConfig()
 logger = logging.getLogger()
@@ -24,8 +24,7 @@ FLOW_FRAME_RATE = 50
 
 
 async def put_flow(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
+    client: TAMSClient,
     tams_url: str,
     flow_id: UUID,
     source_id: UUID,
@@ -57,9 +56,7 @@ async def put_flow(
 
     logger.info(f"Creating Flow {flow_id}")
 
-    async with put_request(
-        session,
-        credentials,
+    async with client.put(
         f"{tams_url}/flows/{flow_id}",
         json=flow_metadata
     ) as resp:
@@ -67,33 +64,24 @@ async def put_flow(
 
 
 async def get_segments(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
+    client: TAMSClient,
     tams_url: str,
     flow_id: UUID,
     timerange: TimeRange
 ) -> list[dict]:
-    """Fetch a single page of segments from the given Flow"""
-    async with get_request(
-        session,
-        credentials,
-        f"{tams_url}/flows/{flow_id}/segments?timerange={timerange!s}"
-    ) as resp:
-        resp.raise_for_status()
-        return await resp.json()
+    """Fetch all the segments in the timerange from the given Flow, in timeline order, following the pages"""
+    segments = []
+    async for page in client.get_paged_items(f"{tams_url}/flows/{flow_id}/segments?timerange={quote(str(timerange))}"):
+        segments.extend(page)
+    return segments
 
 
 async def get_flow(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
+    client: TAMSClient,
     tams_url: str,
     flow_id: UUID
 ) -> dict:
-    async with get_request(
-        session,
-        credentials,
-        f"{tams_url}/flows/{flow_id}"
-    ) as resp:
+    async with client.get(f"{tams_url}/flows/{flow_id}") as resp:
         resp.raise_for_status()
         return await resp.json()
 
@@ -107,78 +95,74 @@ async def simple_edit(
     input_2_timerange: TimeRange,
     output_flow_id: UUID,
     output_source_id: UUID,
+    register_batch_size: int = DEFAULT_BATCH_SIZE,
+    register_concurrency: int = DEFAULT_CONCURRENCY
 ) -> None:
     """Add timerange of segments from input 1 followed by a timerange of segments from input 2"""
-    async with aiohttp.ClientSession(trust_env=True) as session:
-        await put_flow(session, credentials, tams_url, output_flow_id, output_source_id)
-
-        # Add segments from input 1 to output
-        flow_1_segments = await get_segments(session, credentials, tams_url, input_1_flow_id, input_1_timerange)
-
-        for segment in flow_1_segments:
-            async with post_request(
-                session,
-                credentials,
-                f"{tams_url}/flows/{output_flow_id}/segments",
-                json=mediajson.encode_value({
+    async with TAMSClient(credentials) as client:
+        await put_flow(client, tams_url, output_flow_id, output_source_id)
+
+        # Fetch the segments of both inputs concurrently
+        flow_1_segments, flow_2_segments = await asyncio.gather(
+            get_segments(client, tams_url, input_1_flow_id, input_1_timerange),
+            get_segments(client, tams_url, input_2_flow_id, input_2_timerange)
+        )
+
+        async with SegmentRegistrar(
+            client, tams_url, output_flow_id, register_batch_size, register_concurrency
+        ) as registrar:
+            # Add segments from input 1 to output
+            for segment in flow_1_segments:
+                await registrar.add({
                     "object_id": segment["object_id"],
                     "timerange": segment["timerange"]
                 })
-            ) as resp:
-                resp.raise_for_status()
                 print(f"Added segment from Flow {input_1_flow_id} from and to timerange {segment['timerange']}")
 
-        # Add segments from input 2 to output after the input 1 segments
-        if flow_1_segments:
-            seg_tr = TimeRange.from_str(segment["timerange"])
-            if seg_tr.includes_end():
-                part_2_offset = seg_tr.end + Timestamp.from_count(1, Fraction(FLOW_FRAME_RATE))
+            # Add segments from input 2 to output after the input 1 segments
+            if flow_1_segments:
+                seg_tr = TimeRange.from_str(flow_1_segments[-1]["timerange"])
+                if seg_tr.includes_end():
+                    part_2_offset = seg_tr.end + Timestamp.from_count(1, Fraction(FLOW_FRAME_RATE))
+                else:
+                    part_2_offset = seg_tr.end
             else:
-                part_2_offset = seg_tr.end
-        else:
-            part_2_offset = Timestamp(0)
-
-        flow_2_segments = await get_segments(session, credentials, tams_url, input_2_flow_id, input_2_timerange)
-
-        seg_tr_offset = None
-        for segment in flow_2_segments:
-            seg_tr = TimeRange.from_str(segment["timerange"])
-
-            # Calculate the offset to place the segment on the output flow timeline starting
-            # at `part_2_offset`
-            if seg_tr_offset is None:
-                seg_tr_offset = part_2_offset - seg_tr.start
-
-            new_seg_tr = TimeRange(
-                seg_tr.start + seg_tr_offset,
-                seg_tr.end + seg_tr_offset,
-                seg_tr.inclusivity
-            )
-
-            # The media timeline started at zero when the ingest started, so `ts_offset` indicates what must be
-            # added to the media time to get the Flow time.
-            # So we can calculate media time at the start of the segment
-            seg_offset = Timestamp.from_str(segment.get("ts_offset", "0:0"))
-            media_time = seg_tr.start - seg_offset
-
-            # Now we want to know what to add to that media time to get the new start time
-            new_ts_offset = new_seg_tr.start - media_time
-
-            async with post_request(
-                session,
-                credentials,
-                f"{tams_url}/flows/{output_flow_id}/segments",
-                json=mediajson.encode_value({
+                part_2_offset = Timestamp(0)
+
+            seg_tr_offset = None
+            for segment in flow_2_segments:
+                seg_tr = TimeRange.from_str(segment["timerange"])
+
+                # Calculate the offset to place the segment on the output flow timeline starting
+                # at `part_2_offset`
+                if seg_tr_offset is None:
+                    seg_tr_offset = part_2_offset - seg_tr.start
+
+                new_seg_tr = TimeRange(
+                    seg_tr.start + seg_tr_offset,
+                    seg_tr.end + seg_tr_offset,
+                    seg_tr.inclusivity
+                )
+
+                # The media timeline started at zero when the ingest started, so `ts_offset` indicates what must be
+                # added to the media time to get the Flow time.
+                # So we can calculate media time at the start of the segment
+                seg_offset = Timestamp.from_str(segment.get("ts_offset", "0:0"))
+                media_time = seg_tr.start - seg_offset
+
+                # Now we want to know what to add to that media time to get the new start time
+                new_ts_offset = new_seg_tr.start - media_time
+
+                await registrar.add({
                     "object_id": segment["object_id"],
                     "timerange": new_seg_tr,
                     "ts_offset": new_ts_offset
                 })
-            ) as resp:
-                resp.raise_for_status()
                 print(f"Added segment from Flow {input_2_flow_id} and timerange "
-                      "{segment['timerange']} to {new_seg_tr!s}")
+                      f"{segment['timerange']} to {new_seg_tr!s}")
 
-        print(f"Finished writing output {output_flow_id}")
+        print(f"Finished writing {registrar.registered_count} segments to output {output_flow_id}")
+        client.log_stats()
 
 
 async def interval_edit(
@@ -190,9 +174,11 @@ async def interval_edit(
     input_2_timerange: TimeRange,
     output_flow_id: UUID,
     output_source_id: UUID,
-    cut_interval_sec: float
+    cut_interval_sec: float,
+    register_batch_size: int = DEFAULT_BATCH_SIZE,
+    register_concurrency: int = DEFAULT_CONCURRENCY
 ) -> None:
-    """Cut between inputs 1 and 2 at fixed interval. Note: this will only handle a single page of segments"""
+    """Cut between inputs 1 and 2 at fixed interval"""
     cut_interval_ts = Timestamp.from_millisec(int(cut_interval_sec * 1000))
 
     edit_rate = Fraction(FLOW_FRAME_RATE, 1)
@@ -202,12 +188,16 @@ async def interval_edit(
         "_copy_edit_interval": cut_interval_ts.to_sec_nsec()
     }
 
-    async with aiohttp.ClientSession(trust_env=True) as session:
+    async with TAMSClient(credentials) as client:
         # Create output Flow
-        await put_flow(session, credentials, tams_url, output_flow_id, output_source_id, custom_tags=custom_tags)
+        await put_flow(client, tams_url, output_flow_id, output_source_id, custom_tags=custom_tags)
 
-        flow_1_segments = deque(await get_segments(session, credentials, tams_url, input_1_flow_id, input_1_timerange))
-        flow_2_segments = deque(await get_segments(session, credentials, tams_url, input_2_flow_id, input_2_timerange))
+        input_1_segments, input_2_segments = await asyncio.gather(
+            get_segments(client, tams_url, input_1_flow_id, input_1_timerange),
+            get_segments(client, tams_url, input_2_flow_id, input_2_timerange)
+        )
+        flow_1_segments = deque(input_1_segments)
+        flow_2_segments = deque(input_2_segments)
         working_time = Timestamp.from_str("0:0")
 
         next_switch_at = working_time + cut_interval_ts
@@ -223,75 +213,74 @@ async def interval_edit(
             "timeshift": input_2_timerange.start
         }
 
-        while (len(flow_1_segments) > 0 and len(flow_2_segments) > 0):
-            position_in_flow_timeline = working_time + current_seg["timeshift"]
-
-            # Draw a segment from the current list (and drop segments if we've passed them)
-            next_seg = current_seg["list"][0]
-            next_seg_tr = TimeRange.from_str(next_seg["timerange"]).normalise(edit_rate.numerator,
-                                                                              edit_rate.denominator)
-            if next_seg_tr.ends_earlier_than_timerange(position_in_flow_timeline):
-                print(f"Segment {next_seg_tr} is before current position {position_in_flow_timeline} - dropping")
-                current_seg["list"].popleft()
-                continue
-
-            next_seg_ts_offset = Timestamp.from_str(next_seg.get("ts_offset", "0:0"))
-
-            # Work out how many seconds into the underlying segment we start
-            seg_start_offset = (working_time + current_seg["timeshift"]) - next_seg_tr.start
-
-            # Work out how much of the segment to include in the output
-            segment_length_remaining = next_seg_tr.end - position_in_flow_timeline
-            remaining_time_in_cut = next_switch_at - working_time
+        async with SegmentRegistrar(
+            client, tams_url, output_flow_id, register_batch_size, register_concurrency
+        ) as registrar:
+            while (len(flow_1_segments) > 0 and len(flow_2_segments) > 0):
+                position_in_flow_timeline = working_time + current_seg["timeshift"]
+
+                # Draw a segment from the current list (and drop segments if we've passed them)
+                next_seg = current_seg["list"][0]
+                next_seg_tr = TimeRange.from_str(next_seg["timerange"]).normalise(edit_rate.numerator,
+                                                                                  edit_rate.denominator)
+                if next_seg_tr.ends_earlier_than_timerange(position_in_flow_timeline):
+                    print(f"Segment {next_seg_tr} is before current position {position_in_flow_timeline} - dropping")
+                    current_seg["list"].popleft()
+                    continue
+
+                next_seg_ts_offset = Timestamp.from_str(next_seg.get("ts_offset", "0:0"))
+
+                # Work out how many seconds into the underlying segment we start
+                seg_start_offset = (working_time + current_seg["timeshift"]) - next_seg_tr.start
+
+                # Work out how much of the segment to include in the output
+                segment_length_remaining = next_seg_tr.end - position_in_flow_timeline
+                remaining_time_in_cut = next_switch_at - working_time
+
+                # Note that for non-integer media rates this simple approach may lead to rounding anomalies
+                # however this approach is used to keep the example simple.
+                if (remaining_time_in_cut < segment_length_remaining):
+                    # Rest of this cut fits in the current segment, so we can write a new segment
+                    new_seg_tr = TimeRange(working_time, next_switch_at, TimeRange.INCLUDE_START)
+                else:
+                    # We need to add all of the rest of this segment,
+                    # and then some more of the next one before cutting
+                    new_seg_tr = TimeRange.from_start_length(working_time, segment_length_remaining,
+                                                             TimeRange.INCLUDE_START)
+
+                # Note that `sample_offset` and `sample_count` are deprecated but still set for backwards compatibility.
+                # They have been replaced by `object_timerange`.
+                # As this is referencing an existing Object, `object_timerange` will already be set against the Object
+                # and will not need setting here.
+                # When `sample_offset` and `sample_count` are dropped from the spec, they will be deleted here.
+                new_segment = {
+                    "object_id": next_seg["object_id"],
+                    "timerange": new_seg_tr,
+                    "ts_offset": next_seg_ts_offset - current_seg["timeshift"],
+                    "sample_offset": seg_start_offset.to_count(edit_rate.numerator, edit_rate.denominator),
+                    "sample_count": new_seg_tr.length.to_count(edit_rate.numerator, edit_rate.denominator)
+                }
 
-            # Note that for non-integer media rates this simple approach may lead to rounding anomalies
-            # however this approach is used to keep the example simple.
-            if (remaining_time_in_cut < segment_length_remaining):
-                # Rest of this cut fits in the current segment, so we can write a new segment
-                new_seg_tr = TimeRange(working_time, next_switch_at, TimeRange.INCLUDE_START)
-            else:
-                # We need to add all of the rest of this segment,
-                # and then some more of the next one before cutting
-                new_seg_tr = TimeRange.from_start_length(working_time, segment_length_remaining,
-                                                         TimeRange.INCLUDE_START)
-
-            # Note that `sample_offset` and `sample_count` are deprecated but still set for backwards compatibility.
-            # They have been replaced by `object_timerange`.
-            # As this is referencing an existing Object, `object_timerange` will already be set against the Object and
-            # will not need setting here.
-            # When `sample_offset` and `sample_count` are dropped from the spec, they will be deleted here.
-            new_segment = {
-                "object_id": next_seg["object_id"],
-                "timerange": new_seg_tr,
-                "ts_offset": next_seg_ts_offset - current_seg["timeshift"],
-                "sample_offset": seg_start_offset.to_count(edit_rate.numerator, edit_rate.denominator),
-                "sample_count": new_seg_tr.length.to_count(edit_rate.numerator, edit_rate.denominator)
-            }
-
-            async with post_request(
-                session,
-                credentials,
-                f"{tams_url}/flows/{output_flow_id}/segments",
-                json=mediajson.encode_value(new_segment)
-            ) as resp:
-                resp.raise_for_status()
+                await registrar.add(new_segment)
                 print(f"Added segment from Flow {current_seg['id']} and timerange {next_seg_tr} to {new_seg_tr!s}")
 
-            # Advance our time pointer
-            working_time = new_seg_tr.end
+                # Advance our time pointer
+                working_time = new_seg_tr.end
 
-            if (remaining_time_in_cut <= segment_length_remaining):
-                # We've finished this cut, so swap to the other Flow
-                past_seg = current_seg
-                current_seg = other_seg
-                other_seg = past_seg
+                if (remaining_time_in_cut <= segment_length_remaining):
+                    # We've finished this cut, so swap to the other Flow
+                    past_seg = current_seg
+                    current_seg = other_seg
+                    other_seg = past_seg
 
-                next_switch_at += cut_interval_ts
-            else:
-                # Drop the fully consumed segment
-                current_seg["list"].popleft()
+                    next_switch_at += cut_interval_ts
+                else:
+                    # Drop the fully consumed segment
+                    current_seg["list"].popleft()
 
-        print(f"At least one Flow segment list exhausted: stopping writing output {output_flow_id}")
+        print(f"At least one Flow segment list exhausted: finished writing {registrar.registered_count} segments to "
+              f"output {output_flow_id}")
+        client.log_stats()
 
 
 if __name__ == "__main__":
@@ -353,6 +342,14 @@ if __name__ == "__main__":
         help="By default this script pulls a timerange from each input sequentially. Set this to a number of seconds "
              "to linger on each before cutting between them instead"
     )
+    parser.add_argument(
+        "--register-batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help="Number of segments registered with each request to the output Flow"
+    )
+    parser.add_argument(
+        "--register-concurrency", type=int, default=DEFAULT_CONCURRENCY,
+        help="Maximum number of segment registration requests in flight"
+    )
     parser.add_argument(
         "--token", type=str, default=os.environ.get("TOKEN"),
         help="Bearer token for authentication. Defaults to the 'TOKEN' environment variable"
@@ -385,7 +382,9 @@ if __name__ == "__main__":
             args.input2_timerange,
             args.output_flow_id or uuid4(),
             args.output_source_id or uuid4(),
-            args.cut_interval_sec
+            args.cut_interval_sec,
+            args.register_batch_size,
+            args.register_concurrency
         ))
     else:
         output_timerange = asyncio.run(simple_edit(
@@ -397,4 +396,6 @@ if __name__ == "__main__":
             args.input2_timerange,
             args.output_flow_id or uuid4(),
             args.output_source_id or uuid4(),
+            args.register_batch_size,
+            args.register_concurrency
         ))
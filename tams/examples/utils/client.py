@@ -1,89 +1,283 @@
-# This file provides functions to make HTTP requests to the TAMS API.
-# The functions include a retry on authentication failures when using renewable credentials.
+# This file provides a client to make HTTP requests to the TAMS API.
+# The client reuses connections, retries transient failures with backoff and renews credentials before they expire.
 
-from typing import AsyncGenerator
+from typing import AsyncGenerator, Callable, Mapping, Optional
+from collections import Counter
 from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import asyncio
+import logging
+import random
+import time
 
 import aiohttp
 
 from .credentials import Credentials, RenewableCredentials
 
+logger = logging.getLogger(__name__)
 
-@asynccontextmanager
-async def request(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
-    method: str,
-    url: str,
-    **kwargs
-) -> AsyncGenerator[aiohttp.ClientResponse, None]:
-    """Execute a request and retry once if there is a credentials failure"""
-    # Extract the 'headers' as they need to be extended with the auth credentials
-    in_headers = {
-        "Content-Type": "application/json"
-    }
-    if "headers" in kwargs:
-        in_headers = kwargs.pop("headers")
-
-    if isinstance(credentials, RenewableCredentials):
-        await credentials.ensure_credentials()
-
-    have_retried = False
-    while True:
-        async with session.request(method, url, headers=in_headers | credentials.header(), **kwargs) as resp:
-            if resp.status != 401 or not isinstance(credentials, RenewableCredentials) or have_retried:
-                yield resp
-                break
-
-        # Renew the credentials and retry
-        await credentials.renew_credentials()
-        have_retried = True
-
-
-@asynccontextmanager
-async def get_request(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
-    url: str,
-    **kwargs
-) -> AsyncGenerator[aiohttp.ClientResponse, None]:
-    """Execute a GET request and retry once if there is a credentials failure"""
-    async with request(session, credentials, "GET", url, **kwargs) as resp:
-        yield resp
-
-
-@asynccontextmanager
-async def put_request(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
-    url: str,
-    **kwargs
-) -> AsyncGenerator[aiohttp.ClientResponse, None]:
-    """Execute a PUT request and retry once if there is a credentials failure"""
-    async with request(session, credentials, "PUT", url, **kwargs) as resp:
-        yield resp
-
-
-@asynccontextmanager
-async def post_request(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
-    url: str,
-    json: dict = {},
-    **kwargs
-) -> AsyncGenerator[aiohttp.ClientResponse, None]:
-    """Execute a POST request and retry once if there is a credentials failure"""
-    async with request(session, credentials, "POST", url, json=json, **kwargs) as resp:
-        yield resp
-
-
-@asynccontextmanager
-async def delete_request(
-    session: aiohttp.ClientSession,
-    credentials: Credentials,
-    url: str,
-    **kwargs
-) -> AsyncGenerator[aiohttp.ClientResponse, None]:
-    """Execute a DELETE request and retry once if there is a credentials failure"""
-    async with request(session, credentials, "DELETE", url, **kwargs) as resp:
-        yield resp
+# Methods that can be retried after a server error or a connection failure without risk of repeating their effect
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+# Statuses that indicate that the request was not processed, which can therefore be retried for any method
+NOT_PROCESSED_STATUSES = {429, 503}
+
+DEFAULT_CONNECTION_LIMIT = 100
+DEFAULT_CONNECTION_LIMIT_PER_HOST = 32
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 0.5
+DEFAULT_BACKOFF_MAX = 30.0
+
+# Fraction of a token's lifetime before its expiry at which it is renewed in the background, the minimum time
+# before expiry and the minimum interval between attempts, e.g. if renewal fails
+TOKEN_REFRESH_FRACTION = 0.1
+TOKEN_REFRESH_MIN_SECONDS = 10.0
+TOKEN_REFRESH_INTERVAL_SECONDS = 5.0
+
+# Hook called after each request attempt with the method, URL, status (None if the connection failed) and the time
+# taken to receive the response headers in seconds
+RequestHook = Callable[[str, str, Optional[int], float], None]
+
+
+def get_retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Return the delay in seconds given by a Retry-After header, which is either a number of seconds or a date"""
+    value = headers.get("Retry-After")
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+class TAMSClient:
+    """Long-lived TAMS API client, shared by all the requests made by a tool
+
+    All requests share a connection pool, limited to `limit` connections in total and `limit_per_host` connections
+    to each host, so that connections (and TLS sessions) are reused between requests. The pool is also used for
+    requests to pre-signed media object URLs made with `session`, which are not authenticated.
+
+    Requests that fail with a 5xx status or a connection error are retried up to `max_retries` times with jittered
+    exponential backoff if the method is idempotent, as are requests of any method that fail with 429 (Too Many
+    Requests) or 503 (Service Unavailable). A Retry-After header sets the minimum delay. A 401 response renews
+    renewable credentials and retries once.
+
+    Renewable credentials with an expiry are renewed in the background before they expire, so that requests don't
+    wait for a renewal or fail with a 401.
+
+    `hooks` are called after every request attempt, e.g. to collect metrics. The client also counts the requests,
+    retries and statuses, which can be logged with `log_stats`.
+
+    Usage:
+
+        async with TAMSClient(credentials) as client:
+            async with client.get(f"{tams_url}/flows/{flow_id}") as resp:
+                ...
+    """
+    def __init__(
+        self,
+        credentials: Credentials,
+        limit: int = DEFAULT_CONNECTION_LIMIT,
+        limit_per_host: int = DEFAULT_CONNECTION_LIMIT_PER_HOST,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        backoff_base: float = DEFAULT_BACKOFF_BASE,
+        backoff_max: float = DEFAULT_BACKOFF_MAX,
+        hooks: Optional[list[RequestHook]] = None
+    ) -> None:
+        self.credentials = credentials
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.hooks = hooks or []
+
+        self.request_count = 0
+        self.retry_count = 0
+        self.total_latency = 0.0
+        self.status_counts: Counter[Optional[int]] = Counter()
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._renew_lock = asyncio.Lock()
+
+    async def __aenter__(self) -> "TAMSClient":
+        connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host)
+        self._session = aiohttp.ClientSession(trust_env=True, connector=connector)
+        if isinstance(self.credentials, RenewableCredentials):
+            await self.credentials.ensure_credentials()
+            self._refresh_task = asyncio.create_task(self._refresh_credentials(self.credentials))
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            await asyncio.gather(self._refresh_task, return_exceptions=True)
+            self._refresh_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The pooled session, for requests that don't use the TAMS API credentials, e.g. pre-signed URLs"""
+        if self._session is None:
+            raise RuntimeError("TAMSClient is used outside its context")
+        return self._session
+
+    @asynccontextmanager
+    async def request(
+        self,
+        method: str,
+        url: str,
+        **kwargs
+    ) -> AsyncGenerator[aiohttp.ClientResponse, None]:
+        """Execute a request, retrying transient failures and renewing the credentials on a 401"""
+        # Extract the 'headers' as they need to be extended with the auth credentials
+        in_headers = {
+            "Content-Type": "application/json"
+        }
+        if "headers" in kwargs:
+            in_headers = kwargs.pop("headers")
+
+        if isinstance(self.credentials, RenewableCredentials):
+            await self.credentials.ensure_credentials()
+
+        have_renewed = False
+        attempt = 0
+        while True:
+            auth_header = self.credentials.header()
+            start_time = time.perf_counter()
+            try:
+                resp = await self.session.request(method, url, headers=in_headers | auth_header, **kwargs)
+            except aiohttp.ClientConnectionError:
+                self._record(method, url, None, time.perf_counter() - start_time)
+                if method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                logger.warning(f"Connection failed for {method} {url}: retrying in {delay:.2f}s")
+            else:
+                self._record(method, url, resp.status, time.perf_counter() - start_time)
+                if (
+                    resp.status == 401
+                    and isinstance(self.credentials, RenewableCredentials)
+                    and not have_renewed
+                ):
+                    resp.release()
+                    await self._renew_credentials(self.credentials, auth_header)
+                    have_renewed = True
+                    continue
+
+                if not self._is_retryable(method, resp.status) or attempt >= self.max_retries:
+                    try:
+                        yield resp
+                    finally:
+                        resp.release()
+                    return
+
+                retry_after = get_retry_after(resp.headers)
+                delay = max(self._backoff_delay(attempt), retry_after or 0.0)
+                resp.release()
+                logger.warning(f"{method} {url} returned {resp.status}: retrying in {delay:.2f}s")
+
+            self.retry_count += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    @asynccontextmanager
+    async def get(self, url: str, **kwargs) -> AsyncGenerator[aiohttp.ClientResponse, None]:
+        """Execute a GET request"""
+        async with self.request("GET", url, **kwargs) as resp:
+            yield resp
+
+    @asynccontextmanager
+    async def put(self, url: str, **kwargs) -> AsyncGenerator[aiohttp.ClientResponse, None]:
+        """Execute a PUT request"""
+        async with self.request("PUT", url, **kwargs) as resp:
+            yield resp
+
+    @asynccontextmanager
+    async def post(self, url: str, json: dict = {}, **kwargs) -> AsyncGenerator[aiohttp.ClientResponse, None]:
+        """Execute a POST request"""
+        async with self.request("POST", url, json=json, **kwargs) as resp:
+            yield resp
+
+    @asynccontextmanager
+    async def delete(self, url: str, **kwargs) -> AsyncGenerator[aiohttp.ClientResponse, None]:
+        """Execute a DELETE request"""
+        async with self.request("DELETE", url, **kwargs) as resp:
+            yield resp
+
+    async def get_paged_items(self, url: str, **kwargs) -> AsyncGenerator[list, None]:
+        """Yield the pages of a paged list response, following the "next" links.
+
+        The next page is requested whilst the current page is being consumed.
+        """
+        async def get_page(page_url: str) -> tuple[list, Optional[str]]:
+            async with self.get(page_url, **kwargs) as resp:
+                resp.raise_for_status()
+                items = await resp.json()
+                next_link = resp.links.get("next")
+                return items, str(next_link["url"]) if next_link is not None else None
+
+        next_page: Optional[asyncio.Future] = asyncio.ensure_future(get_page(url))
+        try:
+            while next_page is not None:
+                items, next_url = await next_page
+                next_page = asyncio.ensure_future(get_page(next_url)) if next_url is not None else None
+                yield items
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+                await asyncio.gather(next_page, return_exceptions=True)
+
+    def log_stats(self) -> None:
+        mean_latency = self.total_latency / self.request_count if self.request_count else 0.0
+        statuses = ", ".join(
+            f"{status or 'failed'}: {count}"
+            for status, count in sorted(self.status_counts.items(), key=lambda item: item[0] or 0)
+        )
+        logger.info(
+            f"TAMS API requests: {self.request_count} ({self.retry_count} retries), mean latency "
+            f"{mean_latency * 1000:.1f} ms, statuses {{{statuses}}}")
+
+    def _is_retryable(self, method: str, status: int) -> bool:
+        if status in NOT_PROCESSED_STATUSES:
+            return True
+        return status >= 500 and method in IDEMPOTENT_METHODS
+
+    def _backoff_delay(self, attempt: int) -> float:
+        # "Full jitter" spreads out the retries of concurrent requests that failed at the same time
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def _record(self, method: str, url: str, status: Optional[int], latency: float) -> None:
+        self.request_count += 1
+        self.total_latency += latency
+        self.status_counts[status] += 1
+        for hook in self.hooks:
+            hook(method, url, status, latency)
+
+    async def _renew_credentials(self, credentials: RenewableCredentials, stale_header: dict[str, str]) -> None:
+        """Renew the credentials, unless they were renewed by another request after `stale_header` was used"""
+        async with self._renew_lock:
+            if credentials.header() == stale_header:
+                await credentials.renew_credentials()
+
+    async def _refresh_credentials(self, credentials: RenewableCredentials) -> None:
+        """Renew the credentials in the background before they expire"""
+        while credentials.expires_at is not None and credentials.lifetime is not None:
+            refresh_before = max(credentials.lifetime * TOKEN_REFRESH_FRACTION, TOKEN_REFRESH_MIN_SECONDS)
+            await asyncio.sleep(
+                max(credentials.expires_at - refresh_before - time.monotonic(), TOKEN_REFRESH_INTERVAL_SECONDS))
+            try:
+                await self._renew_credentials(credentials, credentials.header())
+                logger.debug("Renewed credentials before expiry")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Requests will renew the credentials if they expire before the next attempt
+                logger.warning(f"Failed to renew credentials before expiry: {e!r}")
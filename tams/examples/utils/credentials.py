@@ -1,7 +1,9 @@
 # This file provides functions to handle TAMS API credentials
 
+from typing import Optional
 from abc import ABCMeta, abstractmethod
 import base64
+import time
 
 import aiohttp
 
@@ -44,7 +46,14 @@ class BearerCredentials(Credentials):
 
 
 class RenewableCredentials(Credentials):
-    """Base class for credentials that need to be renewed"""
+    """Base class for credentials that need to be renewed
+
+    Credentials that expire set `expires_at`, in `time.monotonic` seconds, and their `lifetime` in seconds when
+    they are renewed, which allows them to be renewed before they expire.
+    """
+    expires_at: Optional[float] = None
+    lifetime: Optional[float] = None
+
     @abstractmethod
     async def ensure_credentials(self) -> None:
         pass
@@ -69,7 +78,7 @@ class OAuth2ClientCredentials(RenewableCredentials):
         self.expires_in = 0.0
 
     async def ensure_credentials(self) -> None:
-        if not self.access_token:
+        if not self.access_token or (self.expires_at is not None and time.monotonic() >= self.expires_at):
             await self.renew_credentials()
 
     async def renew_credentials(self) -> None:
@@ -79,6 +88,7 @@ class OAuth2ClientCredentials(RenewableCredentials):
         }
         headers = get_basic_auth_header(self.client_id, self.client_secret)
 
+        requested_at = time.monotonic()
         async with aiohttp.ClientSession(trust_env=True) as session:
             async with session.post(self.authorization_url, data=form_data, headers=headers) as resp:
                 resp.raise_for_status()
@@ -86,6 +96,8 @@ class OAuth2ClientCredentials(RenewableCredentials):
                 token_response = await resp.json()
                 self.access_token = token_response["access_token"]
                 self.expires_in = token_response["expires_in"]
+                self.lifetime = float(self.expires_in)
+                self.expires_at = requested_at + self.lifetime
 
     def header(self) -> dict[str, str]:
         return {"Authorization": f"Bearer {self.access_token}"}
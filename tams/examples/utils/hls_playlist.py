@@ -0,0 +1,326 @@
+# This file generates HLS media playlists from the segments of a Flow, so that a Flow can be played without first
+# outgesting it to a file.
+
+from typing import Any, Awaitable, Callable, Iterable, NamedTuple, Optional
+from collections import OrderedDict, deque
+from urllib.parse import quote
+import asyncio
+import logging
+import math
+import time
+
+from mediatimestamp import Timestamp, TimeRange
+
+from .client import TAMSClient
+
+logger = logging.getLogger(__name__)
+
+# Maximum age of a cached playlist, which is kept well below the expiry of the pre-signed URLs in it
+DEFAULT_MAX_AGE_SECONDS = 300.0
+
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_LIVE_WINDOW = 6
+
+# Segments requested per page, so that most playlists need a single listing request
+DEFAULT_PAGE_LIMIT = 1000
+
+# Version 3 allows decimal EXTINF durations
+HLS_VERSION = 3
+
+
+class PlaylistEntry(NamedTuple):
+    sequence: int
+    start: Timestamp
+    timerange: TimeRange
+    ts_offset: Timestamp
+    url: str
+    duration: float
+    discontinuity: bool
+
+
+class CachedPlaylist(NamedTuple):
+    segments_updated: str
+    created: float
+    text: str
+
+
+class LiveWindow:
+    """The sliding window of segments in the live playlist of a Flow
+
+    Media sequence numbers are assigned to segments as they enter the window, so that they keep their number when
+    the window moves on. The discontinuity sequence counts the discontinuities that have left the window and the
+    target duration never decreases, as required for playlists that are reloaded.
+    """
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.entries: deque[PlaylistEntry] = deque()
+        self.next_sequence = 0
+        self.discontinuity_sequence = 0
+        self.target_duration = 1
+
+    def update(self, segments: list[dict[str, Any]]) -> None:
+        """Update the window from the segments listed from the start of the window onwards"""
+        known = {entry.start: entry for entry in self.entries}
+        last_start = self.entries[-1].start if self.entries else None
+        entries: list[PlaylistEntry] = []
+        for segment in segments:
+            start = get_segment_start(segment)
+            known_entry = known.get(start)
+            if known_entry is not None:
+                # The pre-signed URLs are renewed with each listing
+                entries.append(known_entry._replace(url=get_segment_url(segment)))
+            elif last_start is not None and start < last_start:
+                # A segment that fills a gap in the window can't be given a media sequence number
+                logger.warning(f"Ignoring segment {segment['timerange']} added within the live window")
+            else:
+                entries.append(make_entry(self.next_sequence, segment, entries[-1] if entries else None))
+                self.next_sequence += 1
+
+        window = entries[-self.size:]
+        first_sequence = window[0].sequence if window else self.next_sequence
+        listed = {entry.sequence for entry in entries}
+        dropped = entries[:-self.size] + [
+            entry for entry in self.entries if entry.sequence not in listed and entry.sequence < first_sequence
+        ]
+        self.discontinuity_sequence += sum(entry.discontinuity for entry in dropped)
+        self.entries = deque(window)
+        self.target_duration = max(self.target_duration, get_target_duration(self.entries))
+
+    def render(self) -> str:
+        return render_media_playlist(
+            list(self.entries),
+            self.target_duration,
+            discontinuity_sequence=self.discontinuity_sequence,
+            endlist=False
+        )
+
+
+def get_segment_url(segment: dict[str, Any]) -> str:
+    """Return the URL a player can use to get the segment's media object"""
+    get_urls = segment.get("get_urls")
+    if not get_urls:
+        raise ValueError(f"Segment for object {segment['object_id']} has no get_urls")
+    # Players don't have the TAMS credentials, so pre-signed URLs are preferred
+    for get_url in get_urls:
+        if get_url.get("presigned", True):
+            return get_url["url"]
+    return get_urls[0]["url"]
+
+
+def get_segment_start(segment: dict[str, Any]) -> Timestamp:
+    start = TimeRange.from_str(segment["timerange"]).start
+    if start is None:
+        raise ValueError(f"Segment for object {segment['object_id']} has an unbounded timerange")
+    return start
+
+
+def make_entry(sequence: int, segment: dict[str, Any], previous: Optional[PlaylistEntry]) -> PlaylistEntry:
+    """Return the playlist entry for a segment, which follows the `previous` entry"""
+    timerange = TimeRange.from_str(segment["timerange"])
+    if timerange.start is None or timerange.end is None:
+        raise ValueError(f"Segment for object {segment['object_id']} has an unbounded timerange")
+    ts_offset = Timestamp.from_str(segment.get("ts_offset", "0:0"))
+
+    # Players follow the timestamps in the media, so a discontinuity is signalled where the Flow's timeline has a gap
+    # or where the timestamps in the media jump, e.g. at an edit. Segments that only use some of the samples in the
+    # media object are also marked, although the extra samples are still played.
+    discontinuity = previous is not None and (
+        not previous.timerange.is_contiguous_with_timerange(timerange)
+        or ts_offset != previous.ts_offset
+        or "sample_offset" in segment
+        or "sample_count" in segment
+    )
+    return PlaylistEntry(
+        sequence,
+        timerange.start,
+        timerange,
+        ts_offset,
+        get_segment_url(segment),
+        (timerange.end - timerange.start).to_float(),
+        discontinuity
+    )
+
+
+def make_entries(segments: list[dict[str, Any]]) -> list[PlaylistEntry]:
+    entries: list[PlaylistEntry] = []
+    for sequence, segment in enumerate(segments):
+        entries.append(make_entry(sequence, segment, entries[-1] if entries else None))
+    return entries
+
+
+def get_target_duration(entries: Iterable[PlaylistEntry]) -> int:
+    # Each EXTINF duration, rounded to the nearest integer, must not exceed the target duration
+    return max((math.ceil(entry.duration) for entry in entries), default=1)
+
+
+def render_media_playlist(
+    entries: list[PlaylistEntry],
+    target_duration: int,
+    discontinuity_sequence: int = 0,
+    endlist: bool = True
+) -> str:
+    lines = [
+        "#EXTM3U",
+        f"#EXT-X-VERSION:{HLS_VERSION}",
+        f"#EXT-X-TARGETDURATION:{target_duration}",
+        f"#EXT-X-MEDIA-SEQUENCE:{entries[0].sequence if entries else 0}",
+    ]
+    if discontinuity_sequence:
+        lines.append(f"#EXT-X-DISCONTINUITY-SEQUENCE:{discontinuity_sequence}")
+    if endlist:
+        lines.append("#EXT-X-PLAYLIST-TYPE:VOD")
+    for entry in entries:
+        if entry.discontinuity:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines.append(f"#EXTINF:{entry.duration:.6f},")
+        lines.append(entry.url)
+    if endlist:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
+
+
+class PlaylistGenerator:
+    """Generates HLS media playlists that reference the media objects of a Flow's segments
+
+    The segments are listed with pre-signed `get_urls`, so players fetch the media objects directly from the object
+    store and the time to first frame is that of a Flow request plus a segment listing request. The EXTINF
+    durations are taken from the segment timeranges, and a discontinuity is signalled where the timeline has a gap
+    or the media timestamps jump.
+
+    Playlists are cached, keyed on the Flow and timerange, until the Flow's `segments_updated` changes or they are
+    `max_age` seconds old, so a cached playlist costs a single Flow request. Playlists aren't cached for Flows
+    without `segments_updated`. Concurrent requests for a playlist that isn't cached share one segment listing.
+
+    Live playlists are a sliding window of the last `live_window` segments. The window is only re-listed from its
+    first segment onwards when the segments change.
+    """
+    def __init__(
+        self,
+        client: TAMSClient,
+        tams_url: str,
+        max_age: float = DEFAULT_MAX_AGE_SECONDS,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+        live_window: int = DEFAULT_LIVE_WINDOW,
+        page_limit: int = DEFAULT_PAGE_LIMIT
+    ) -> None:
+        self.client = client
+        self.tams_url = tams_url
+        self.max_age = max_age
+        self.cache_size = cache_size
+        self.live_window = live_window
+        self.page_limit = page_limit
+
+        self.hits = 0
+        self.misses = 0
+        self.listing_requests = 0
+
+        self._cache: OrderedDict[tuple[str, str], CachedPlaylist] = OrderedDict()
+        self._pending: dict[tuple[str, str], asyncio.Future] = {}
+        self._live_windows: dict[str, LiveWindow] = {}
+
+    async def media_playlist(self, flow_id: str, timerange: TimeRange = TimeRange.eternity()) -> str:
+        """Return a VOD playlist of the Flow's segments that overlap `timerange`
+
+        Segments at the ends of the timerange are included whole.
+        """
+        async def generate(flow: dict[str, Any]) -> str:
+            entries = make_entries(await self._list_segments(flow_id, timerange))
+            return render_media_playlist(entries, get_target_duration(entries))
+
+        return await self._get_playlist(flow_id, str(timerange), generate)
+
+    async def live_playlist(self, flow_id: str) -> str:
+        """Return a sliding window playlist of the Flow's last segments"""
+        async def generate(flow: dict[str, Any]) -> str:
+            window = self._live_windows.get(flow_id)
+            if window is None:
+                window = self._live_windows[flow_id] = LiveWindow(self.live_window)
+            if window.entries:
+                list_timerange = TimeRange.from_start(window.entries[0].start)
+            else:
+                list_timerange = get_live_timerange(flow, self.live_window)
+            window.update(await self._list_segments(flow_id, list_timerange))
+            return window.render()
+
+        return await self._get_playlist(flow_id, "live", generate)
+
+    def log_stats(self) -> None:
+        logger.info(
+            f"Playlists: {self.hits} cache hits, {self.misses} misses, {self.listing_requests} listing requests")
+
+    async def _get_playlist(
+        self,
+        flow_id: str,
+        name: str,
+        generate: Callable[[dict[str, Any]], Awaitable[str]]
+    ) -> str:
+        flow = await self._get_flow(flow_id)
+        segments_updated = flow.get("segments_updated")
+        key = (flow_id, name)
+
+        cached = self._cache.get(key)
+        if (
+            cached is not None
+            and cached.segments_updated == segments_updated
+            and time.monotonic() - cached.created < self.max_age
+        ):
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return cached.text
+
+        # Requests that arrive whilst the playlist is generated wait for it rather than listing the segments again
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.ensure_future(generate(flow))
+        self._pending[key] = future
+        try:
+            text = await asyncio.shield(future)
+        finally:
+            del self._pending[key]
+
+        if segments_updated is not None:
+            self._cache[key] = CachedPlaylist(segments_updated, time.monotonic(), text)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return text
+
+    async def _get_flow(self, flow_id: str) -> dict[str, Any]:
+        async with self.client.get(f"{self.tams_url}/flows/{flow_id}") as resp:
+            resp.raise_for_status()
+            return await resp.json()
+
+    async def _list_segments(self, flow_id: str, timerange: TimeRange) -> list[dict[str, Any]]:
+        segments_url = (
+            f"{self.tams_url}/flows/{flow_id}/segments"
+            f"?presigned=true&limit={self.page_limit}&timerange={quote(str(timerange))}"
+        )
+        segments: list[dict[str, Any]] = []
+        async for page in self.client.get_paged_items(segments_url):
+            self.listing_requests += 1
+            segments.extend(page)
+
+        # The pages are expected to be in timeline order, but that isn't relied on
+        segments.sort(key=get_segment_start)
+        return segments
+
+
+def get_live_timerange(flow: dict[str, Any], live_window: int) -> TimeRange:
+    """Return the timerange to list the segments of a live window from when it isn't known yet
+
+    If the Flow has a bounded timerange and a segment duration then only the segments near the end are listed,
+    otherwise all the segments are listed once.
+    """
+    if "timerange" not in flow or "segment_duration" not in flow:
+        return TimeRange.eternity()
+    flow_timerange = TimeRange.from_str(flow["timerange"])
+    if flow_timerange.end is None:
+        return TimeRange.eternity()
+    segment_duration = flow["segment_duration"]
+    window_duration = Timestamp.from_float(
+        2 * live_window * segment_duration["numerator"] / segment_duration.get("denominator", 1))
+    return TimeRange.from_start(flow_timerange.end - window_duration)
@@ -0,0 +1,181 @@
+# This file provides a local instance of the TAMS API with in-memory metadata and media object storage, so that the
+# examples can be run and benchmarked without a cloud deployment or network access.
+#
+# The API is the application in ../app, run with the in-memory Firestore and Cloud Storage stand-ins used by its unit
+# tests. The pre-signed URLs it returns point at a local object store that holds the media objects in memory. This
+# requires the API requirements (../requirements.txt) as well as the examples' requirements.
+#
+# Usage:
+#
+#     python -m utils.local_tams --port 4010 --object-store-port 4011
+
+from typing import Optional
+from argparse import ArgumentParser
+import asyncio
+import logging
+import os
+import sys
+import threading
+import urllib.error
+import urllib.request
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# The directory containing the API application and its tests
+TAMS_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_range(range_header: str, size: int) -> Optional[tuple[int, int]]:
+    """Return the [start, end) byte range of a single range "bytes=" header, or None if it isn't satisfiable"""
+    try:
+        unit, byte_range = range_header.split("=", 1)
+        first, last = byte_range.split("-", 1)
+        if unit.strip() != "bytes":
+            return None
+        if first:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        else:
+            start = max(size - int(last), 0)
+            end = size
+    except ValueError:
+        return None
+    if start >= end:
+        return None
+    return start, end
+
+
+class ObjectStore:
+    """An in-memory object store serving PUT, GET (with a single byte range) and HEAD requests at /{bucket}/{name}"""
+    def __init__(self) -> None:
+        self.objects: dict[str, bytes] = {}
+
+    async def put(self, request: web.Request) -> web.Response:
+        self.objects[request.match_info["path"]] = await request.read()
+        return web.Response(status=200)
+
+    async def get(self, request: web.Request) -> web.Response:
+        data = self.objects.get(request.match_info["path"])
+        if data is None:
+            raise web.HTTPNotFound()
+        if request.method == "HEAD":
+            return web.Response(headers={"Content-Length": str(len(data))})
+        if "Range" not in request.headers:
+            return web.Response(body=data, content_type="video/mp2t")
+        byte_range = parse_range(request.headers["Range"], len(data))
+        if byte_range is None:
+            raise web.HTTPRequestRangeNotSatisfiable(headers={"Content-Range": f"bytes */{len(data)}"})
+        start, end = byte_range
+        return web.Response(
+            status=206,
+            body=data[start:end],
+            content_type="video/mp2t",
+            headers={"Content-Range": f"bytes {start}-{end - 1}/{len(data)}"}
+        )
+
+    def make_app(self) -> web.Application:
+        # Allow media objects larger than the default 1 MB request body limit
+        app = web.Application(client_max_size=1024 ** 3)
+        app.add_routes([
+            web.put("/{path:.+}", self.put),
+            web.get("/{path:.+}", self.get),
+        ])
+        return app
+
+
+def start_object_store(host: str, port: int) -> None:
+    """Serve the object store from a thread, which ends with the process"""
+    async def serve() -> None:
+        runner = web.AppRunner(ObjectStore().make_app(), access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        started.set()
+        await asyncio.Event().wait()
+
+    started = threading.Event()
+    threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+    started.wait()
+
+
+def install_in_memory_backends(object_store_url: str) -> None:
+    """Replace the Google Cloud clients used by the API with in-memory stand-ins
+
+    This must be called before the API application is imported. Pre-signed URLs are replaced with URLs of objects
+    in the local object store, which is also asked for the object sizes recorded with segments.
+    """
+    sys.path.insert(0, TAMS_DIR)
+    # Importing the test configuration installs the stand-ins in sys.modules
+    from tests import conftest as backends
+
+    def generate_signed_url(blob, **kwargs) -> str:
+        return f"{object_store_url}/{blob.bucket.name}/{blob.name}"
+
+    def get_blob(bucket, name: str):
+        request = urllib.request.Request(f"{object_store_url}/{bucket.name}/{name}", method="HEAD")
+        try:
+            with urllib.request.urlopen(request) as resp:
+                size = int(resp.headers["Content-Length"])
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+        blob = backends.MockBlob(name, bucket)
+        blob.size = size
+        return blob
+
+    backends.MockBlob.generate_signed_url = generate_signed_url
+    backends.MockBucket.get_blob = get_blob
+
+
+def run_local_tams(host: str, port: int, object_store_port: int) -> None:
+    """Run the API and the object store until the process is interrupted or terminated"""
+    start_object_store(host, object_store_port)
+    install_in_memory_backends(f"http://{host}:{object_store_port}")
+    from app.main import app
+    import uvicorn
+
+    logger.info(f"Serving TAMS API at http://{host}:{port} with objects at http://{host}:{object_store_port}")
+    uvicorn.run(app, host=host, port=port, log_level="warning", access_log=False)
+
+
+async def wait_for_local_tams(tams_url: str, timeout: float = 30.0) -> None:
+    """Wait until the local API responds, e.g. after starting it in a subprocess"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    async with aiohttp.ClientSession() as session:
+        while True:
+            try:
+                async with session.get(f"{tams_url}/service") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientConnectionError:
+                pass
+            if loop.time() > deadline:
+                raise TimeoutError(f"Local TAMS API at {tams_url} did not start within {timeout} seconds")
+            await asyncio.sleep(0.1)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="local_tams",
+        description="Local TAMS API with in-memory storage"
+    )
+    parser.add_argument(
+        "--host", type=str, default="127.0.0.1",
+        help="Host address the API and the object store are served on"
+    )
+    parser.add_argument(
+        "--port", type=int, default=4010,
+        help="Port the API is served on"
+    )
+    parser.add_argument(
+        "--object-store-port", type=int, default=4011,
+        help="Port the object store is served on"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    run_local_tams(args.host, args.port, args.object_store_port)
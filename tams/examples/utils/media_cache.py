@@ -0,0 +1,210 @@
+# This file provides an on-disk cache of media objects that can be shared by the example tools.
+
+from typing import Optional
+import asyncio
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the size limit the cache is reduced to when it is exceeded, to avoid evicting on every write
+EVICTION_LOW_WATERMARK = 0.9
+
+# Number of writes after which the cache directory is re-scanned, to include objects written by other processes
+RESCAN_WRITE_COUNT = 100
+
+# Age after which temporary files are assumed to have been left behind by a process that failed whilst writing
+STALE_TMP_FILE_SECONDS = 3600
+
+
+class MediaObjectCache:
+    """Content-addressed on-disk LRU cache of media objects, keyed by object ID
+
+    Media objects in TAMS are immutable, so the object ID identifies the content. Objects are written to a
+    temporary file and renamed into place, so readers never see a partial object, and a lock file serialises
+    eviction between processes. A reader that has opened an object can still read it if it is evicted.
+
+    The least recently used objects, by file modification time, are evicted once the total size exceeds
+    `max_bytes`. Hits update the modification time.
+    """
+    def __init__(self, directory: str, max_bytes: int) -> None:
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._objects_dir = os.path.join(directory, "objects")
+        self._tmp_dir = os.path.join(directory, "tmp")
+        self._lock_filename = os.path.join(directory, "lock")
+        self._stats_filename = os.path.join(directory, "stats.json")
+        os.makedirs(self._objects_dir, exist_ok=True)
+        os.makedirs(self._tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._estimated_size: Optional[int] = None
+        self._writes_since_scan = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.hit_bytes = 0
+        self.miss_bytes = 0
+
+    def object_path(self, object_id: str) -> str:
+        # Hash the object ID so that it is always a safe filename
+        digest = hashlib.sha256(object_id.encode()).hexdigest()
+        return os.path.join(self._objects_dir, digest[:2], digest)
+
+    def get(self, object_id: str) -> Optional[bytes]:
+        """Return the cached media object, or None if it is not cached"""
+        path = self.object_path(object_id)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # Evicted by another process after it was read
+            pass
+
+        with self._lock:
+            self.hits += 1
+            self.hit_bytes += len(data)
+        return data
+
+    def put(self, object_id: str, data: bytes) -> None:
+        """Atomically add a downloaded media object to the cache, evicting objects if the cache is full"""
+        path = self.object_path(object_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=self._tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_filename, path)
+        except BaseException:
+            os.unlink(tmp_filename)
+            raise
+
+        with self._lock:
+            self.misses += 1
+            self.miss_bytes += len(data)
+            self._writes_since_scan += 1
+            if self._estimated_size is not None:
+                self._estimated_size += len(data)
+            needs_eviction = (
+                self._estimated_size is None
+                or self._estimated_size > self.max_bytes
+                or self._writes_since_scan >= RESCAN_WRITE_COUNT
+            )
+
+        if needs_eviction:
+            self.evict()
+
+    def evict(self) -> None:
+        """Evict the least recently used objects if the cache exceeds its size limit"""
+        with open(self._lock_filename, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                entries = []
+                for dir_entry in os.scandir(self._objects_dir):
+                    if not dir_entry.is_dir():
+                        continue
+                    for file_entry in os.scandir(dir_entry.path):
+                        try:
+                            stat = file_entry.stat()
+                        except FileNotFoundError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, file_entry.path))
+
+                now = time.time()
+                for file_entry in os.scandir(self._tmp_dir):
+                    try:
+                        if now - file_entry.stat().st_mtime > STALE_TMP_FILE_SECONDS:
+                            os.unlink(file_entry.path)
+                    except FileNotFoundError:
+                        pass
+
+                total_size = sum(size for _, size, _ in entries)
+                if total_size > self.max_bytes:
+                    target_size = self.max_bytes * EVICTION_LOW_WATERMARK
+                    entries.sort()
+                    evicted = 0
+                    for _, size, path in entries:
+                        if total_size <= target_size:
+                            break
+                        try:
+                            os.unlink(path)
+                        except FileNotFoundError:
+                            pass
+                        total_size -= size
+                        evicted += 1
+                    logger.debug(f"Evicted {evicted} media objects from the cache")
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        with self._lock:
+            self._estimated_size = total_size
+            self._writes_since_scan = 0
+
+    async def fetch(self, session: aiohttp.ClientSession, object_id: str, url: str) -> bytes:
+        """Return the media object from the cache, or download it from `url` and add it to the cache"""
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, self.get, object_id)
+        if data is not None:
+            return data
+
+        async with session.get(url) as resp:
+            resp.raise_for_status()
+            data = await resp.read()
+        await loop.run_in_executor(None, self.put, object_id, data)
+        return data
+
+    def report(self) -> dict:
+        """Return the hit rate and download volume saved by this process since the last report, and the totals
+        for all processes, which are updated with this process's counts"""
+        with self._lock:
+            run = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+                "bytes_saved": self.hit_bytes,
+                "bytes_downloaded": self.miss_bytes,
+            }
+            self.hits = self.misses = self.hit_bytes = self.miss_bytes = 0
+
+        # Accumulate the totals in the cache directory, under the lock used for eviction
+        with open(self._lock_filename, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self._stats_filename) as f:
+                        total = json.load(f)
+                except (FileNotFoundError, ValueError):
+                    total = {"hits": 0, "misses": 0, "bytes_saved": 0, "bytes_downloaded": 0}
+                for name in total:
+                    total[name] += run[name]
+                tmp_filename = f"{self._stats_filename}.tmp"
+                with open(tmp_filename, "w") as f:
+                    json.dump(total, f)
+                os.replace(tmp_filename, self._stats_filename)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        requests = total["hits"] + total["misses"]
+        total["hit_rate"] = total["hits"] / requests if requests else 0.0
+        return {"run": run, "total": total}
+
+    def log_report(self) -> None:
+        report = self.report()
+        for name, stats in report.items():
+            logger.info(
+                f"Media object cache ({name}): {stats['hits']} hits, {stats['misses']} misses, "
+                f"hit rate {stats['hit_rate']:.1%}, saved {stats['bytes_saved'] / 1e6:.1f} MB of "
+                f"{(stats['bytes_saved'] + stats['bytes_downloaded']) / 1e6:.1f} MB")
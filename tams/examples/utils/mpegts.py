@@ -0,0 +1,359 @@
+# This file provides functions to extract timing from MPEG-TS files without demuxing the complete file.
+
+from typing import Iterator, NamedTuple, Optional, Union
+import base64
+import json
+import mmap
+
+from mediatimestamp import TimeRange, Timestamp
+
+TS_PACKET_SIZE = 188
+TS_SYNC_BYTE = 0x47
+PES_CLOCK_RATE = 90000
+VIDEO_STREAM_IDS = (0xe0, 0xef)
+RANDOM_ACCESS_INDICATOR = 0x40
+
+# Number of PES headers read per stream at each end of the file. This must cover the frame re-ordering depth, e.g.
+# B-frames, so that the lowest and highest PTS values in the file are found
+DEFAULT_PES_WINDOW = 16
+
+# Number of packets whose headers are processed at a time
+SCAN_CHUNK_PACKETS = 256
+
+# Translation table used to locate packets with the payload_unit_start_indicator set (and no transport error)
+# from a strided slice of the second header byte of each packet
+_PUSI_TABLE = bytes(1 if (i & 0xc0) == 0x40 else 0 for i in range(256))
+
+# Maximum number of packets before the first PES packet that are kept in a packet index, which are expected to be
+# the PSI tables (PAT, PMT and SDT) that a demuxer needs to read the streams
+PSI_PACKET_LIMIT = 16
+
+AAC_FRAME_SAMPLES = 1024
+ADTS_SAMPLE_RATES = [96000, 88200, 64000, 48000, 44100, 32000, 24000, 22050, 16000, 12000, 11025, 8000, 7350]
+
+
+def is_mpegts(data: Union[bytes, mmap.mmap]) -> bool:
+    """Check for the sync byte at the start of the first few packets"""
+    packet_count = min(len(data) // TS_PACKET_SIZE, 4)
+    return packet_count > 0 and all(data[i * TS_PACKET_SIZE] == TS_SYNC_BYTE for i in range(packet_count))
+
+
+def _payload_offset(data: Union[bytes, mmap.mmap], packet_offset: int) -> Optional[int]:
+    """Return the offset of the TS packet payload, or None if the packet has no payload"""
+    adaptation_field_control = (data[packet_offset + 3] >> 4) & 0x3
+    if not adaptation_field_control & 0x1:
+        return None
+
+    payload_offset = packet_offset + 4
+    if adaptation_field_control & 0x2:
+        payload_offset += 1 + data[packet_offset + 4]
+    return payload_offset
+
+
+def _packet_pid(data: Union[bytes, mmap.mmap], packet_offset: int) -> int:
+    return ((data[packet_offset + 1] & 0x1f) << 8) | data[packet_offset + 2]
+
+
+def parse_pes_pts(data: Union[bytes, mmap.mmap], packet_offset: int) -> Optional[tuple[int, int, int]]:
+    """Return the (PID, stream_id, PTS) of the PES header starting in the TS packet at `packet_offset`
+
+    None is returned if the packet does not start an audio or video PES packet with a PTS.
+    """
+    payload_offset = _payload_offset(data, packet_offset)
+    if payload_offset is None or packet_offset + TS_PACKET_SIZE - payload_offset < 14:
+        return None
+
+    header = data[payload_offset:payload_offset + 14]
+    stream_id = header[3]
+    if header[0:3] != b"\x00\x00\x01" or not (stream_id == 0xbd or 0xc0 <= stream_id <= 0xef):
+        return None
+    if not header[7] & 0x80:
+        return None
+
+    pts = (
+        ((header[9] >> 1) & 0x07) << 30
+        | header[10] << 22
+        | (header[11] >> 1) << 15
+        | header[12] << 7
+        | header[13] >> 1
+    )
+    return _packet_pid(data, packet_offset), stream_id, pts
+
+
+def _pes_payload(data: mmap.mmap, packet_offset: int, packet_count: int) -> bytes:
+    """Reassemble the payload of the PES packet starting at `packet_offset`, which is assumed to be the last PES
+    packet of its stream in the file"""
+    pid = _packet_pid(data, packet_offset)
+    payload_offset = _payload_offset(data, packet_offset)
+    assert payload_offset is not None
+    header_length = 9 + data[payload_offset + 8]
+    chunks = [data[payload_offset + header_length:packet_offset + TS_PACKET_SIZE]]
+    for offset in range(packet_offset + TS_PACKET_SIZE, packet_count * TS_PACKET_SIZE, TS_PACKET_SIZE):
+        if _packet_pid(data, offset) != pid:
+            continue
+        payload_offset = _payload_offset(data, offset)
+        if payload_offset is not None:
+            chunks.append(data[payload_offset:offset + TS_PACKET_SIZE])
+    return b"".join(chunks)
+
+
+def adts_duration(payload: bytes) -> Optional[int]:
+    """Return the duration in 90 kHz units of the AAC frames in an ADTS payload, or None if it is not ADTS"""
+    offset = 0
+    frame_count = 0
+    sample_rate = None
+    while offset + 7 <= len(payload):
+        if payload[offset] != 0xff or payload[offset + 1] & 0xf6 != 0xf0:
+            return None
+        sample_rate_index = (payload[offset + 2] >> 2) & 0x0f
+        if sample_rate_index >= len(ADTS_SAMPLE_RATES):
+            return None
+        sample_rate = ADTS_SAMPLE_RATES[sample_rate_index]
+        frame_length = ((payload[offset + 3] & 0x03) << 11) | (payload[offset + 4] << 3) | (payload[offset + 5] >> 5)
+        if frame_length < 7:
+            return None
+        # Each ADTS frame contains between 1 and 4 raw data blocks of 1024 samples
+        frame_count += (payload[offset + 6] & 0x03) + 1
+        offset += frame_length
+
+    if sample_rate is None or offset != len(payload):
+        return None
+    return round(frame_count * AAC_FRAME_SAMPLES * PES_CLOCK_RATE / sample_rate)
+
+
+def _is_random_access(data: Union[bytes, mmap.mmap], packet_offset: int) -> bool:
+    """Check the random_access_indicator of the packet's adaptation field, which muxers set on video key frames"""
+    adaptation_field_control = (data[packet_offset + 3] >> 4) & 0x3
+    return bool(
+        adaptation_field_control & 0x2
+        and data[packet_offset + 4] > 0
+        and data[packet_offset + 5] & RANDOM_ACCESS_INDICATOR
+    )
+
+
+def _pes_start_offsets(data: Union[bytes, mmap.mmap], packet_count: int, reverse: bool) -> Iterator[int]:
+    """Yield the offsets of packets that start a PES packet or section, from the start or end of the file
+
+    Only a strided slice of the packet header bytes is read for each chunk of packets, which avoids touching the
+    payload of most packets.
+    """
+    chunk_starts = range(0, packet_count, SCAN_CHUNK_PACKETS)
+    for chunk_start in (reversed(chunk_starts) if reverse else chunk_starts):
+        chunk_end = min(chunk_start + SCAN_CHUNK_PACKETS, packet_count)
+        flags = data[chunk_start * TS_PACKET_SIZE + 1:chunk_end * TS_PACKET_SIZE:TS_PACKET_SIZE].translate(
+            _PUSI_TABLE)
+        if reverse:
+            index = flags.rfind(1)
+            while index >= 0:
+                yield (chunk_start + index) * TS_PACKET_SIZE
+                index = flags.rfind(1, 0, index)
+        else:
+            index = flags.find(1)
+            while index >= 0:
+                yield (chunk_start + index) * TS_PACKET_SIZE
+                index = flags.find(1, index + 1)
+
+
+class _StreamTimestamps:
+    def __init__(self, stream_id: int, first_offset: int):
+        self.stream_id = stream_id
+        # Offset of the first PES packet found, which is the last one in the stream when scanning in reverse
+        self.first_offset = first_offset
+        self.pts_values: list[int] = []
+
+
+def _collect_pts(
+    data: mmap.mmap,
+    packet_count: int,
+    reverse: bool,
+    window: int
+) -> dict[int, _StreamTimestamps]:
+    """Collect PTS values from the first (or last) `window` PES headers of each stream"""
+    streams: dict[int, _StreamTimestamps] = {}
+    for offset in _pes_start_offsets(data, packet_count, reverse):
+        if data[offset] != TS_SYNC_BYTE:
+            raise ValueError(f"Lost MPEG-TS packet sync at offset {offset}")
+
+        pes = parse_pes_pts(data, offset)
+        if pes is None:
+            continue
+        pid, stream_id, pts = pes
+        stream = streams.get(pid)
+        if stream is None:
+            stream = streams[pid] = _StreamTimestamps(stream_id, offset)
+        stream.pts_values.append(pts)
+
+        # Stop once every stream seen so far has a full window. A stream that first appears after this point could
+        # in theory be missed, but streams in a segment are interleaved well within the window
+        if all(len(stream.pts_values) >= window for stream in streams.values()):
+            break
+
+    return streams
+
+
+def _stream_end_pts(data: mmap.mmap, packet_count: int, stream: _StreamTimestamps) -> Optional[int]:
+    """Return the exclusive end PTS of a stream from the PES headers found at the end of the file"""
+    last_pts = max(stream.pts_values)
+    if VIDEO_STREAM_IDS[0] <= stream.stream_id <= VIDEO_STREAM_IDS[1]:
+        distinct_pts = sorted(set(stream.pts_values))
+        if len(distinct_pts) < 2:
+            return None
+        return last_pts + min(b - a for a, b in zip(distinct_pts, distinct_pts[1:]))
+
+    # Audio PES packets usually contain a variable number of frames, so the duration of the last one is found from
+    # its frames
+    if last_pts != stream.pts_values[0]:
+        return None
+    duration = adts_duration(_pes_payload(data, stream.first_offset, packet_count))
+    if duration is None:
+        return None
+    return last_pts + duration
+
+
+def scan_ts_timerange(filename: str, window: int = DEFAULT_PES_WINDOW) -> Optional[TimeRange]:
+    """Extract the presentation timerange of an MPEG-TS file by reading PES headers near its start and end
+
+    The start is the lowest PTS found in the first `window` PES headers of each stream and the exclusive end is the
+    highest PTS in the last `window` PES headers plus the duration of that stream's last PES packet. The duration of a
+    video frame is taken to be the smallest difference between the PTS values at the end of the stream, which assumes
+    a constant frame rate. The duration of the last audio PES packet is found from its AAC ADTS frames.
+
+    None is returned if the file is not an MPEG-TS file or if the timing could not be determined, e.g. because a
+    video stream has only a single PTS value or the audio is not AAC, in which case the caller should fall back to
+    demuxing the file.
+
+    As with demuxing the complete file, timestamp rollover in the MPEG-TS container is not accounted for.
+    """
+    with open(filename, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file
+            return None
+
+    with data:
+        if not is_mpegts(data):
+            return None
+        packet_count = len(data) // TS_PACKET_SIZE
+
+        head_streams = _collect_pts(data, packet_count, False, window)
+        tail_streams = _collect_pts(data, packet_count, True, window)
+        if not head_streams or not tail_streams:
+            return None
+
+        start_pts = min(min(stream.pts_values) for stream in head_streams.values())
+        stream_end_pts = [_stream_end_pts(data, packet_count, stream) for stream in tail_streams.values()]
+
+    if None in stream_end_pts:
+        return None
+    end_pts = max(pts for pts in stream_end_pts if pts is not None)
+
+    return TimeRange(
+        Timestamp.from_count(start_pts, PES_CLOCK_RATE),
+        Timestamp.from_count(end_pts, PES_CLOCK_RATE),
+        TimeRange.INCLUDE_START
+    )
+
+
+class IndexedPESPacket(NamedTuple):
+    offset: int
+    pts: int
+    random_access: bool
+
+
+class TSPacketIndex:
+    """Index of the PES packets in an MPEG-TS media object, which maps PTS values to byte offsets
+
+    The index holds the offset, PTS and random access flag of every PES packet of each stream, in the order they
+    appear in the object, i.e. decode order, and the PSI packets from the start of the object that a demuxer needs
+    to identify the streams. A range of the object's packets can then be demuxed by prefixing it with `psi`.
+    """
+    def __init__(self, size: int, psi: bytes, streams: dict[int, list[IndexedPESPacket]]) -> None:
+        self.size = size
+        self.psi = psi
+        self.streams = streams
+
+    def byte_range(self, start_pts: int, end_pts: int) -> Optional[tuple[int, int]]:
+        """Return the (start, exclusive end) byte offsets of the packets needed to decode the frames with a PTS in
+        [`start_pts`, `end_pts`), or None if there are none
+
+        The range starts at the last random access point of each stream with a PTS no later than `start_pts`, and
+        ends after the last PES packet in decode order with a PTS before `end_pts`, so it includes the frames that
+        the frames in the range are predicted from.
+        """
+        range_start: Optional[int] = None
+        range_end: Optional[int] = None
+        for packets in self.streams.values():
+            last_index = None
+            for index, packet in enumerate(packets):
+                if packet.pts < end_pts:
+                    last_index = index
+            if last_index is None:
+                continue
+
+            first_index = 0
+            for index, packet in enumerate(packets[:last_index + 1]):
+                if packet.random_access and packet.pts <= start_pts:
+                    first_index = index
+
+            stream_end = packets[last_index + 1].offset if last_index + 1 < len(packets) else self.size
+            range_start = min(packets[first_index].offset, range_start or self.size)
+            range_end = max(stream_end, range_end or 0)
+
+        if range_start is None or range_end is None:
+            return None
+        return range_start, range_end
+
+    def to_bytes(self) -> bytes:
+        return json.dumps({
+            "size": self.size,
+            "psi": base64.b64encode(self.psi).decode(),
+            "streams": {
+                str(pid): [list(packet) for packet in packets]
+                for pid, packets in self.streams.items()
+            }
+        }, separators=(",", ":")).encode()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "TSPacketIndex":
+        index = json.loads(data)
+        return cls(
+            index["size"],
+            base64.b64decode(index["psi"]),
+            {
+                int(pid): [IndexedPESPacket(offset, pts, bool(random_access)) for offset, pts, random_access in packets]
+                for pid, packets in index["streams"].items()
+            }
+        )
+
+
+def build_ts_packet_index(data: bytes) -> Optional[TSPacketIndex]:
+    """Index the PES packets of an MPEG-TS media object, or return None if it is not MPEG-TS
+
+    Only the packets that start a PES packet or section are parsed, as in `scan_ts_timerange`. Audio PES packets are
+    all treated as random access points. As with `scan_ts_timerange`, timestamp rollover is not accounted for.
+    """
+    if not is_mpegts(data):
+        return None
+    packet_count = len(data) // TS_PACKET_SIZE
+
+    streams: dict[int, list[IndexedPESPacket]] = {}
+    first_pes_offset = None
+    for offset in _pes_start_offsets(data, packet_count, False):
+        if data[offset] != TS_SYNC_BYTE:
+            raise ValueError(f"Lost MPEG-TS packet sync at offset {offset}")
+
+        pes = parse_pes_pts(data, offset)
+        if pes is None:
+            continue
+        pid, stream_id, pts = pes
+        if first_pes_offset is None:
+            first_pes_offset = offset
+        is_video = VIDEO_STREAM_IDS[0] <= stream_id <= VIDEO_STREAM_IDS[1]
+        streams.setdefault(pid, []).append(
+            IndexedPESPacket(offset, pts, _is_random_access(data, offset) or not is_video))
+
+    if first_pes_offset is None:
+        return None
+    psi = bytes(data[:min(first_pes_offset, PSI_PACKET_LIMIT * TS_PACKET_SIZE)])
+    return TSPacketIndex(packet_count * TS_PACKET_SIZE, psi, streams)
@@ -0,0 +1,344 @@
+# This file provides a prefetcher that downloads segment media objects ahead of their use.
+
+from typing import AsyncIterable, Optional
+from collections import OrderedDict
+from io import BytesIO
+import asyncio
+import logging
+
+from mediatimestamp import Timestamp, TimeRange
+import aiohttp
+
+from .media_cache import MediaObjectCache
+from .mpegts import PES_CLOCK_RATE, TSPacketIndex, build_ts_packet_index
+
+logger = logging.getLogger(__name__)
+
+# Number of packet indexes held in memory, e.g. for segments of an edited Flow that share media objects
+PACKET_INDEX_MEMORY_SIZE = 1024
+
+
+class ByteBudget:
+    """Limits the number of bytes held by media objects that have been downloaded but not yet processed
+
+    Reservations are granted in ticket order, i.e. segment order, so that later segments can't hold the budget
+    needed by the segment the consumer is waiting for. A reservation larger than the budget is allowed once
+    nothing else is reserved, so that a single large media object can't stall the download.
+    """
+    def __init__(self, budget: int) -> None:
+        self.budget = budget
+        self.reserved = 0
+        self.peak = 0
+        self._next_ticket = 0
+        self._condition = asyncio.Condition()
+
+    async def reserve(self, ticket: int, size: int) -> None:
+        async with self._condition:
+            await self._condition.wait_for(
+                lambda: ticket == self._next_ticket and (self.reserved == 0 or self.reserved + size <= self.budget))
+            self.reserved += size
+            self.peak = max(self.peak, self.reserved)
+            self._next_ticket += 1
+            self._condition.notify_all()
+
+    async def release(self, size: int) -> None:
+        async with self._condition:
+            self.reserved -= size
+            self._condition.notify_all()
+
+
+class PrefetchedSegment:
+    """A segment and its downloaded media object, which holds `size` bytes of the byte budget until released
+
+    If only part of the segment is needed then `trim_timerange` is that part, and `media_essence` only holds the
+    packets needed to decode it.
+    """
+    def __init__(
+        self,
+        segment: dict,
+        media_essence: BytesIO,
+        size: int,
+        trim_timerange: Optional[TimeRange] = None
+    ) -> None:
+        self.segment = segment
+        self.media_essence = media_essence
+        self.size = size
+        self.trim_timerange = trim_timerange
+
+
+class PacketIndexStore:
+    """Packet indexes of MPEG-TS media objects, keyed by object ID
+
+    Indexes are held in memory and, if `cache` is given, on disk so that they are only computed once. Media objects
+    are immutable, so an index never needs to be invalidated.
+    """
+    def __init__(self, cache: Optional[MediaObjectCache] = None) -> None:
+        self.cache = cache
+        self._indexes: OrderedDict[str, TSPacketIndex] = OrderedDict()
+
+    async def get(self, object_id: str) -> Optional[TSPacketIndex]:
+        index = self._indexes.get(object_id)
+        if index is not None:
+            self._indexes.move_to_end(object_id)
+            return index
+        if self.cache is None:
+            return None
+        data = await asyncio.get_running_loop().run_in_executor(None, self.cache.get, object_id)
+        if data is None:
+            return None
+        index = TSPacketIndex.from_bytes(data)
+        self._remember(object_id, index)
+        return index
+
+    async def put(self, object_id: str, index: TSPacketIndex) -> None:
+        self._remember(object_id, index)
+        if self.cache is not None:
+            await put_in_cache(self.cache, object_id, index.to_bytes())
+
+    def _remember(self, object_id: str, index: TSPacketIndex) -> None:
+        self._indexes[object_id] = index
+        self._indexes.move_to_end(object_id)
+        while len(self._indexes) > PACKET_INDEX_MEMORY_SIZE:
+            self._indexes.popitem(last=False)
+
+
+async def put_in_cache(cache: MediaObjectCache, object_id: str, data: bytes) -> None:
+    """Add data to the cache in the default executor. The cache is an optimisation, so a failure to write it, e.g.
+    because the disk is full, is logged rather than raised"""
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, cache.put, object_id, data)
+    except OSError as e:
+        logger.warning(f"Failed to cache {object_id}: {e}")
+
+
+def get_download_url(segment: dict) -> str:
+    """Return the first pre-signed download URL of the segment"""
+    try:
+        return segment["get_urls"][0]["url"]
+    except (KeyError, IndexError):
+        raise ValueError("Unable to find download URL for segment "
+                         f"{segment['object_id']} at {segment['timerange']}")
+
+
+async def download_segment(
+    session: aiohttp.ClientSession,
+    segment: dict,
+    budget: ByteBudget,
+    ticket: int,
+    cache: Optional[MediaObjectCache] = None
+) -> PrefetchedSegment:
+    """Download the segment's media object once the byte budget allows, using the cache if given"""
+    loop = asyncio.get_running_loop()
+    if cache is not None:
+        cached_data = await loop.run_in_executor(None, cache.get, segment["object_id"])
+        if cached_data is not None:
+            await budget.reserve(ticket, len(cached_data))
+            return PrefetchedSegment(segment, BytesIO(cached_data), len(cached_data))
+
+    async with session.get(get_download_url(segment)) as resp:
+        resp.raise_for_status()
+        if resp.content_length is None:
+            data = await resp.read()
+            size = len(data)
+            await budget.reserve(ticket, size)
+        else:
+            # Wait for space before reading the body, so that the budget also bounds the data in flight
+            size = resp.content_length
+            await budget.reserve(ticket, size)
+            try:
+                data = await resp.read()
+            except BaseException:
+                await budget.release(size)
+                raise
+
+    if cache is not None:
+        try:
+            await put_in_cache(cache, segment["object_id"], data)
+        except BaseException:
+            await budget.release(size)
+            raise
+    return PrefetchedSegment(segment, BytesIO(data), size)
+
+
+def get_trim_timerange(segment: dict, timerange: TimeRange) -> Optional[TimeRange]:
+    """Return the part of the segment that is within `timerange`, or None if the segment is wholly within it"""
+    segment_timerange = TimeRange.from_str(segment["timerange"])
+    if segment_timerange in timerange:
+        return None
+    return segment_timerange.intersect_with(timerange)
+
+
+def get_object_pts_range(segment: dict, trim_timerange: TimeRange) -> tuple[int, int]:
+    """Return the [start, end) PTS range in the segment's media object of a timerange on the Flow's timeline"""
+    assert trim_timerange.start is not None and trim_timerange.end is not None
+    ts_offset = Timestamp.from_str(segment.get("ts_offset") or "0:0")
+    start_pts = (trim_timerange.start - ts_offset).to_count(PES_CLOCK_RATE, rounding=Timestamp.ROUND_DOWN)
+    end_pts = (trim_timerange.end - ts_offset).to_count(PES_CLOCK_RATE, rounding=Timestamp.ROUND_UP)
+    if trim_timerange.includes_end():
+        end_pts += 1
+    return start_pts, end_pts
+
+
+def trim_prefetched_segment(
+    prefetched: PrefetchedSegment,
+    index: TSPacketIndex,
+    trim_timerange: TimeRange
+) -> PrefetchedSegment:
+    """Replace the complete media object with the packets needed to decode the frames in `trim_timerange`"""
+    byte_range = index.byte_range(*get_object_pts_range(prefetched.segment, trim_timerange))
+    if byte_range is not None:
+        data = prefetched.media_essence.getvalue()
+        prefetched.media_essence = BytesIO(index.psi + data[byte_range[0]:byte_range[1]])
+        prefetched.trim_timerange = trim_timerange
+    return prefetched
+
+
+async def download_segment_part(
+    session: aiohttp.ClientSession,
+    segment: dict,
+    trim_timerange: TimeRange,
+    budget: ByteBudget,
+    ticket: int,
+    indexes: PacketIndexStore,
+    cache: Optional[MediaObjectCache] = None
+) -> PrefetchedSegment:
+    """Download the part of the segment's media object needed to decode the frames in `trim_timerange`
+
+    If the object's packet index is known then only the byte range that is needed is requested, unless the object
+    is cached. Otherwise the complete object is downloaded and indexed, so that later requests for the object can use
+    a byte range.
+    """
+    loop = asyncio.get_running_loop()
+    object_id = segment["object_id"]
+    index = await indexes.get(object_id)
+    if index is None:
+        prefetched = await download_segment(session, segment, budget, ticket, cache)
+        try:
+            index = await loop.run_in_executor(None, build_ts_packet_index, prefetched.media_essence.getvalue())
+            if index is None:
+                logger.warning(f"Media object {object_id} is not MPEG-TS and is not trimmed")
+                return prefetched
+            await indexes.put(object_id, index)
+            return trim_prefetched_segment(prefetched, index, trim_timerange)
+        except BaseException:
+            await budget.release(prefetched.size)
+            raise
+
+    byte_range = index.byte_range(*get_object_pts_range(segment, trim_timerange))
+    if byte_range is None:
+        return await download_segment(session, segment, budget, ticket, cache)
+
+    if cache is not None:
+        cached_data = await loop.run_in_executor(None, cache.get, object_id)
+        if cached_data is not None:
+            await budget.reserve(ticket, len(cached_data))
+            prefetched = PrefetchedSegment(segment, BytesIO(cached_data), len(cached_data))
+            return trim_prefetched_segment(prefetched, index, trim_timerange)
+
+    size = byte_range[1] - byte_range[0]
+    await budget.reserve(ticket, size)
+    try:
+        async with session.get(
+            get_download_url(segment),
+            headers={"Range": f"bytes={byte_range[0]}-{byte_range[1] - 1}"}
+        ) as resp:
+            resp.raise_for_status()
+            data = await resp.read()
+    except BaseException:
+        await budget.release(size)
+        raise
+    if resp.status != 206:
+        # The server ignored the Range header and returned the complete object
+        data = data[byte_range[0]:byte_range[1]]
+    return PrefetchedSegment(segment, BytesIO(index.psi + data), size, trim_timerange)
+
+
+class SegmentPrefetcher:
+    """Downloads segment media objects up to `window` segments ahead of the consumer
+
+    Segments are returned in order when iterating over the prefetcher. The media objects that have been
+    downloaded but not yet released hold at most `byte_budget` bytes, or a single media object if it is larger.
+    The consumer calls `release` once it has finished with a segment, which allows further downloads to proceed.
+    Media objects are read from and added to `cache` if one is given.
+
+    If `trim_timerange` is given then segments that are only partly within it are trimmed, using the packet
+    indexes in `indexes` to download only the packets needed to decode the part of the segment that is within it.
+
+    Usage:
+
+        async with SegmentPrefetcher(session, segments, window, byte_budget) as prefetcher:
+            async for prefetched in prefetcher:
+                ...
+                await prefetcher.release(prefetched)
+    """
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        segments: AsyncIterable[dict],
+        window: int,
+        byte_budget: int,
+        cache: Optional[MediaObjectCache] = None,
+        trim_timerange: Optional[TimeRange] = None,
+        indexes: Optional[PacketIndexStore] = None
+    ) -> None:
+        self.session = session
+        self.segments = segments
+        self.cache = cache
+        self.trim_timerange = trim_timerange
+        self.indexes = indexes or PacketIndexStore()
+        self.budget = ByteBudget(byte_budget)
+        self._window = asyncio.Semaphore(window)
+        self._downloads: asyncio.Queue[Optional[asyncio.Future]] = asyncio.Queue()
+        self._scheduler: Optional[asyncio.Task] = None
+
+    async def __aenter__(self) -> "SegmentPrefetcher":
+        self._scheduler = asyncio.create_task(self._schedule_downloads())
+        return self
+
+    async def __aexit__(self, *args) -> None:
+        pending: list[asyncio.Future] = []
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+            pending.append(self._scheduler)
+        while not self._downloads.empty():
+            download = self._downloads.get_nowait()
+            if download is not None:
+                download.cancel()
+                pending.append(download)
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    def __aiter__(self) -> "SegmentPrefetcher":
+        return self
+
+    async def __anext__(self) -> PrefetchedSegment:
+        download = await self._downloads.get()
+        if download is None:
+            raise StopAsyncIteration
+        self._window.release()
+        return await download
+
+    async def release(self, prefetched: PrefetchedSegment) -> None:
+        await self.budget.release(prefetched.size)
+
+    async def _schedule_downloads(self) -> None:
+        try:
+            ticket = 0
+            async for segment in self.segments:
+                # Blocks once `window` downloads are ahead of the consumer
+                await self._window.acquire()
+                trim_timerange = None
+                if self.trim_timerange is not None:
+                    trim_timerange = get_trim_timerange(segment, self.trim_timerange)
+                if trim_timerange is not None:
+                    download = download_segment_part(
+                        self.session, segment, trim_timerange, self.budget, ticket, self.indexes, self.cache)
+                else:
+                    download = download_segment(self.session, segment, self.budget, ticket, self.cache)
+                self._downloads.put_nowait(asyncio.ensure_future(download))
+                ticket += 1
+        except Exception as e:
+            # Pass the failure to the consumer in order, e.g. if listing the segments failed
+            failed = asyncio.get_running_loop().create_future()
+            failed.set_exception(e)
+            self._downloads.put_nowait(failed)
+        self._downloads.put_nowait(None)
@@ -0,0 +1,85 @@
+# This file provides transcoding of MPEG-TS segment media objects to low resolution proxies, as a function that can
+# be run in a worker process.
+
+from typing import NamedTuple, Optional
+from io import BytesIO
+
+import av
+
+
+class ProxyParameters(NamedTuple):
+    height: int = 360
+    bit_rate: int = 800000
+    preset: str = "veryfast"
+
+
+def get_proxy_frame_size(width: int, height: int, proxy_height: int) -> tuple[int, int]:
+    """Return the proxy frame size, which keeps the aspect ratio with even dimensions and doesn't upscale"""
+    proxy_height = min(proxy_height, height)
+    proxy_width = round(width * proxy_height / height)
+    return proxy_width - proxy_width % 2, proxy_height - proxy_height % 2
+
+
+def transcode_segment(data: bytes, params: ProxyParameters) -> bytes:
+    """Transcode the first video stream of an MPEG-TS media object to a H.264 proxy in MPEG-TS
+
+    The frames keep their presentation timestamps, so the proxy has the same timerange as the original and a
+    segment can reference it with the same timerange and `ts_offset`. Other streams, e.g. audio, are dropped.
+    B-frames aren't used, so that the first frame starts the proxy. The encoder and decoder are single threaded,
+    as the segments are transcoded in parallel by separate processes.
+    """
+    output_data = BytesIO()
+    first_pts: Optional[int] = None
+    last_pts: Optional[int] = None
+    proxy_pts: set[int] = set()
+    with (
+        av.open(BytesIO(data), mode="r", format="mpegts") as input_container,
+        av.open(output_data, mode="w", format="mpegts") as output_container
+    ):
+        if not input_container.streams.video:
+            raise ValueError("Media object has no video stream")
+        input_stream = input_container.streams.video[0]
+        input_stream.codec_context.thread_count = 1
+        if input_stream.average_rate is None or input_stream.time_base is None:
+            raise ValueError("Media object has a video stream without a frame rate or time base")
+
+        width, height = get_proxy_frame_size(
+            input_stream.codec_context.width, input_stream.codec_context.height, params.height)
+        output_stream = output_container.add_stream("libx264", rate=input_stream.average_rate)
+        output_stream.width = width
+        output_stream.height = height
+        output_stream.pix_fmt = "yuv420p"
+        output_stream.bit_rate = params.bit_rate
+        output_stream.codec_context.time_base = input_stream.time_base
+        output_stream.codec_context.thread_count = 1
+        output_stream.options = {
+            "preset": params.preset,
+            "bf": "0",
+            "maxrate": str(params.bit_rate),
+            "bufsize": str(params.bit_rate * 2)
+        }
+
+        def mux(packets: list[av.Packet]) -> None:
+            for packet in packets:
+                if packet.pts is not None:
+                    proxy_pts.add(packet.pts)
+                output_container.mux(packet)
+
+        for frame in input_container.decode(input_stream):
+            if frame.pts is None:
+                raise ValueError("Media object has a video frame without a presentation timestamp")
+            first_pts = frame.pts if first_pts is None else min(first_pts, frame.pts)
+            last_pts = frame.pts if last_pts is None else max(last_pts, frame.pts)
+            proxy_frame = frame.reformat(width=width, height=height, format="yuv420p")
+            proxy_frame.pts = frame.pts
+            proxy_frame.time_base = input_stream.time_base
+            mux(output_stream.encode(proxy_frame))
+        mux(output_stream.encode(None))
+
+    if first_pts is None:
+        raise ValueError("Media object has no video frames")
+    if min(proxy_pts, default=None) != first_pts or max(proxy_pts, default=None) != last_pts:
+        raise ValueError(
+            f"Proxy timestamps {min(proxy_pts, default=None)}-{max(proxy_pts, default=None)} don't match the "
+            f"original {first_pts}-{last_pts}")
+    return output_data.getvalue()
@@ -0,0 +1,114 @@
+# This file provides batched registration of Flow segments, for tools that create many segments from existing
+# media objects.
+
+from typing import Any
+import asyncio
+import logging
+from uuid import UUID
+
+import mediajson
+
+from .client import TAMSClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_CONCURRENCY = 4
+
+
+class SegmentRegistrar:
+    """Registers segments with a Flow in batches, with a bounded number of requests in flight
+
+    Segments added to the registrar are accumulated and POSTed as a list once `batch_size` segments are pending.
+    At most `concurrency` requests are in flight, and `add` waits for a request to complete once that limit is
+    reached. The remaining segments are registered when the context is exited without an exception. A request that
+    fails, or that returns a list of failed segments, raises an exception from the next call to `add` or on exit.
+
+    Batches may complete in any order, so the segments are not guaranteed to appear in the Flow in the order they
+    were added until the registrar has finished.
+
+    Usage:
+
+        async with SegmentRegistrar(client, tams_url, flow_id) as registrar:
+            for segment in segments:
+                await registrar.add(segment)
+    """
+    def __init__(
+        self,
+        client: TAMSClient,
+        tams_url: str,
+        flow_id: UUID,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        concurrency: int = DEFAULT_CONCURRENCY
+    ) -> None:
+        self.client = client
+        self.url = f"{tams_url}/flows/{flow_id}/segments"
+        self.batch_size = batch_size
+        self.registered_count = 0
+        self._pending: list[dict[str, Any]] = []
+        self._requests: set[asyncio.Task] = set()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    async def __aenter__(self) -> "SegmentRegistrar":
+        return self
+
+    async def __aexit__(self, exc_type, *args) -> None:
+        if exc_type is None:
+            await self.flush()
+        else:
+            for task in self._requests:
+                task.cancel()
+            await asyncio.gather(*self._requests, return_exceptions=True)
+
+    async def add(self, segment: dict[str, Any]) -> None:
+        """Add a segment to be registered, sending a request if a batch is complete"""
+        self._raise_failures()
+        self._pending.append(segment)
+        if len(self._pending) >= self.batch_size:
+            await self._send_pending()
+
+    async def flush(self) -> None:
+        """Register all pending segments and wait for the requests in flight to complete"""
+        if self._pending:
+            await self._send_pending()
+        await asyncio.gather(*self._requests, return_exceptions=True)
+        self._raise_failures()
+
+    async def _send_pending(self) -> None:
+        batch = self._pending
+        self._pending = []
+
+        # Waits once `concurrency` requests are in flight
+        await self._semaphore.acquire()
+        try:
+            self._raise_failures()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self._requests.add(asyncio.create_task(self._register(batch)))
+
+    async def _register(self, batch: list[dict[str, Any]]) -> None:
+        try:
+            async with self.client.post(self.url, json=mediajson.encode_value(batch)) as resp:
+                resp.raise_for_status()
+
+                # The request succeeds with a list of failed segments if some could not be registered, e.g. because
+                # they overlap existing segments
+                if resp.status == 200 and resp.content_type == "application/json":
+                    failed_segments = (await resp.json()).get("failed_segments")
+                    if failed_segments:
+                        raise ValueError(f"Failed to register segments: {failed_segments}")
+        finally:
+            self._semaphore.release()
+
+        self.registered_count += len(batch)
+        logger.debug(f"Registered {len(batch)} segments at {self.url}")
+
+    def _raise_failures(self) -> None:
+        """Remove completed requests and raise the exception of the first failed request"""
+        done = [task for task in self._requests if task.done()]
+        self._requests.difference_update(done)
+        for task in done:
+            exception = None if task.cancelled() else task.exception()
+            if exception is not None:
+                raise exception
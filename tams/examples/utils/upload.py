@@ -0,0 +1,187 @@
+# This file provides resumable uploads of media objects in chunks, using Google Cloud Storage resumable upload
+# sessions.
+
+from typing import BinaryIO, Mapping
+import asyncio
+import base64
+import hashlib
+import logging
+import os
+import random
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+
+# Every chunk other than the last must be a multiple of this size
+CHUNK_SIZE_MULTIPLE = 256 * 1024
+
+DEFAULT_MAX_RETRIES = 8
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30.0
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Statuses returned when the upload session no longer exists and the upload has to start again
+SESSION_EXPIRED_STATUSES = {404, 410}
+
+# The upload session returns 308 (Resume Incomplete) with the range of bytes it has persisted so far
+RESUME_INCOMPLETE_STATUS = 308
+
+
+class RetryableUploadError(Exception):
+    pass
+
+
+class UploadSessionExpired(Exception):
+    pass
+
+
+def get_persisted_size(headers: Mapping[str, str]) -> int:
+    """Return the number of bytes persisted by the upload session from the Range header, e.g. "bytes=0-1023" """
+    range_header = headers.get("Range")
+    if not range_header:
+        return 0
+    return int(range_header.rsplit("-", 1)[1]) + 1
+
+
+def md5_base64(md5: "hashlib._Hash") -> str:
+    return base64.b64encode(md5.digest()).decode()
+
+
+def read_chunk(f: BinaryIO, offset: int, size: int) -> bytes:
+    f.seek(offset)
+    return f.read(size)
+
+
+class ResumableUpload:
+    """Uploads a file to a resumable upload session in chunks, resuming from the last persisted byte on failure
+
+    `put_url` is a media object storage URL that was allocated for a resumable upload. A POST to it starts an upload
+    session, and chunks of `chunk_size` bytes are then read from the file and PUT to the session, so that memory use
+    is limited to a single chunk whatever the size of the file. Each chunk has a Content-MD5 checksum and the last
+    chunk also carries the MD5 checksum of the whole object.
+
+    If a chunk fails with a connection error or a retryable status, the session is asked how many bytes it has
+    persisted and the upload continues from there after a backoff delay. The upload starts again with a new session
+    if the session has expired. The upload fails once `max_retries` attempts in a row have made no progress.
+    """
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        put_url: dict,
+        filename: str,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        max_retries: int = DEFAULT_MAX_RETRIES
+    ) -> None:
+        self.session = session
+        self.url = put_url["url"]
+        self.content_type = put_url["content-type"]
+        self.filename = filename
+        self.chunk_size = max(chunk_size // CHUNK_SIZE_MULTIPLE, 1) * CHUNK_SIZE_MULTIPLE
+        self.max_retries = max_retries
+        self.retry_count = 0
+
+    async def upload(self) -> None:
+        loop = asyncio.get_running_loop()
+        size = os.path.getsize(self.filename)
+        session_url = await self._start_session()
+
+        offset = 0
+        md5 = hashlib.md5()
+        chunk = b""
+        complete = False
+        need_query = False
+        failures = 0
+        with open(self.filename, "rb") as f:
+            while not complete:
+                try:
+                    if need_query:
+                        persisted, complete = await self._query_session(session_url, size)
+                        need_query = False
+                    else:
+                        chunk = await loop.run_in_executor(None, read_chunk, f, offset, self.chunk_size)
+                        persisted, complete = await self._put_chunk(session_url, offset, size, chunk, md5)
+                except (aiohttp.ClientError, asyncio.TimeoutError, RetryableUploadError, UploadSessionExpired) as e:
+                    failures += 1
+                    self.retry_count += 1
+                    if failures > self.max_retries:
+                        raise
+                    delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** failures))
+                    logger.warning(
+                        f"Upload of {self.filename} failed at offset {offset}: {e!r}. Retrying in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+                    if isinstance(e, UploadSessionExpired):
+                        session_url = await self._start_session()
+                        offset = 0
+                        md5 = hashlib.md5()
+                    else:
+                        need_query = True
+                    continue
+
+                if persisted < offset or persisted > offset + len(chunk):
+                    raise ValueError(
+                        f"Upload session for {self.filename} persisted {persisted} bytes, which is outside the "
+                        f"chunk sent at offset {offset}")
+                if persisted > offset:
+                    # The checksum of the whole object is built from the bytes that have been persisted
+                    md5.update(chunk[:persisted - offset])
+                    offset = persisted
+                    failures = 0
+
+        logger.debug(f"Uploaded {size} bytes from {self.filename} with {self.retry_count} retries")
+
+    async def _start_session(self) -> str:
+        async with self.session.post(
+            self.url,
+            headers={
+                "Content-Type": self.content_type,
+                "x-goog-resumable": "start"
+            }
+        ) as resp:
+            resp.raise_for_status()
+            return resp.headers["Location"]
+
+    def _check_status(self, resp: aiohttp.ClientResponse) -> None:
+        if resp.status in RETRYABLE_STATUSES:
+            raise RetryableUploadError(f"Upload session returned status {resp.status}")
+        if resp.status in SESSION_EXPIRED_STATUSES:
+            raise UploadSessionExpired(f"Upload session returned status {resp.status}")
+        if resp.status != RESUME_INCOMPLETE_STATUS:
+            resp.raise_for_status()
+
+    async def _query_session(self, session_url: str, size: int) -> tuple[int, bool]:
+        """Return the number of bytes persisted by the session and whether the upload is complete"""
+        async with self.session.put(session_url, headers={"Content-Range": f"bytes */{size}"}) as resp:
+            self._check_status(resp)
+            if resp.status == RESUME_INCOMPLETE_STATUS:
+                return get_persisted_size(resp.headers), False
+            return size, True
+
+    async def _put_chunk(
+        self,
+        session_url: str,
+        offset: int,
+        size: int,
+        chunk: bytes,
+        md5: "hashlib._Hash"
+    ) -> tuple[int, bool]:
+        """Upload a chunk and return the number of bytes persisted by the session and whether the upload is
+        complete"""
+        headers = {"Content-MD5": md5_base64(hashlib.md5(chunk))}
+        if chunk:
+            headers["Content-Range"] = f"bytes {offset}-{offset + len(chunk) - 1}/{size}"
+        else:
+            headers["Content-Range"] = f"bytes */{size}"
+        if offset + len(chunk) == size:
+            object_md5 = md5.copy()
+            object_md5.update(chunk)
+            headers["x-goog-hash"] = f"md5={md5_base64(object_md5)}"
+
+        async with self.session.put(session_url, data=chunk, headers=headers) as resp:
+            self._check_status(resp)
+            if resp.status == RESUME_INCOMPLETE_STATUS:
+                return get_persisted_size(resp.headers), False
+            return size, True
@@ -0,0 +1,187 @@
+# This file provides compact summaries of audio media objects, holding their peaks and loudness, from which a
+# waveform can be drawn without downloading and decoding the audio.
+
+from typing import Any, Optional
+from array import array
+from fractions import Fraction
+from io import BytesIO
+from urllib.parse import quote
+from uuid import UUID
+import asyncio
+import json
+
+from mediatimestamp import Timestamp, TimeRange
+import av
+
+from .client import TAMSClient
+from .media_cache import MediaObjectCache
+from .prefetch import get_download_url
+
+DEFAULT_PEAKS_PER_SECOND = 10
+
+# The FFmpeg ebur128 filter measures the momentary loudness (of the last 400 ms) every 100 ms
+LOUDNESS_INTERVAL = Fraction(1, 10)
+
+# Loudness is reported no lower than the absolute gate of EBU R128, which also covers silence
+LOUDNESS_FLOOR = -70.0
+
+# Peaks are held as 8 bit values
+PEAK_SHIFT = 8
+
+
+def get_peaks(samples: array, channels: int, samples_per_peak: int) -> list[list[int]]:
+    """Return the interleaved minimum and maximum of each `samples_per_peak` samples, for each channel"""
+    peaks = []
+    for channel in range(channels):
+        channel_samples = samples[channel::channels]
+        channel_peaks = []
+        for offset in range(0, len(channel_samples), samples_per_peak):
+            chunk = channel_samples[offset:offset + samples_per_peak]
+            channel_peaks += [min(chunk) >> PEAK_SHIFT, max(chunk) >> PEAK_SHIFT]
+        peaks.append(channel_peaks)
+    return peaks
+
+
+def summarise_audio(data: bytes, peaks_per_second: int = DEFAULT_PEAKS_PER_SECOND) -> dict:
+    """Decode the first audio stream of an MPEG-TS media object and summarise it
+
+    The summary holds the minimum and maximum sample value of each channel at `peaks_per_second`, as signed 8 bit
+    values, and the EBU R128 momentary loudness in LUFS every 100 ms. The `start` of the summary is the timestamp of
+    the first sample in the media object, so a segment references the summary with the same `ts_offset` as the audio.
+
+    The loudness of the first 400 ms is measured over a partial window, as each media object is decoded on its own.
+    """
+    samples = array("h")
+    momentary: list[float] = []
+    start: Optional[Timestamp] = None
+    with av.open(BytesIO(data), mode="r", format="mpegts") as container:
+        if not container.streams.audio:
+            raise ValueError("Media object has no audio stream")
+        stream = container.streams.audio[0]
+        sample_rate = stream.codec_context.sample_rate
+        channels = stream.codec_context.channels
+
+        graph = av.filter.Graph()
+        buffer = graph.add_abuffer(template=stream)
+        loudness = graph.add("ebur128", "metadata=1")
+        sink = graph.add("abuffersink")
+        buffer.link_to(loudness)
+        loudness.link_to(sink)
+        graph.configure()
+        resampler = av.AudioResampler(format="s16", layout=stream.codec_context.layout, rate=sample_rate)
+
+        def pull_loudness() -> None:
+            while True:
+                try:
+                    frame = graph.pull()
+                except (av.BlockingIOError, av.EOFError):
+                    return
+                # The remaining samples are passed on without a measurement when the filter is flushed
+                value = frame.metadata.get("lavfi.r128.M")
+                if value is not None:
+                    momentary.append(max(round(float(value), 1), LOUDNESS_FLOOR))
+
+        def add_samples(frames: list[av.AudioFrame]) -> None:
+            for frame in frames:
+                # The plane may be padded beyond the samples
+                samples.frombytes(bytes(frame.planes[0])[:frame.samples * channels * samples.itemsize])
+
+        for frame in container.decode(stream):
+            if start is None and frame.pts is not None and frame.time_base is not None:
+                start = Timestamp.from_count(frame.pts, 1 / frame.time_base)
+            add_samples(resampler.resample(frame))
+            graph.push(frame)
+            pull_loudness()
+        add_samples(resampler.resample(None))
+        graph.push(None)
+        pull_loudness()
+
+    if start is None:
+        raise ValueError("Media object has no audio frames with timestamps")
+    return {
+        "start": str(start),
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "sample_count": len(samples) // channels,
+        "peaks_per_second": peaks_per_second,
+        "peaks": get_peaks(samples, channels, sample_rate // peaks_per_second),
+        "momentary_loudness": momentary
+    }
+
+
+def render_columns(summaries: list[tuple[dict, dict]], timerange: TimeRange, columns: int) -> dict[str, Any]:
+    """Merge the summaries of segments, as (segment, summary) tuples, into `columns` equal parts of the timerange
+
+    Each column has the minimum and maximum peak across the channels, and the maximum momentary loudness. Only the
+    parts of a summary within its segment's timerange are used. Columns without audio are None.
+    """
+    if timerange.start is None or timerange.end is None:
+        raise ValueError("Timerange must be bounded")
+    start_ns = timerange.start.to_nanosec()
+    duration_ns = timerange.end.to_nanosec() - start_ns
+    peaks: list[Optional[list[int]]] = [None] * columns
+    loudness: list[Optional[float]] = [None] * columns
+
+    def get_column(segment_timerange: TimeRange, time_ns: int) -> Optional[int]:
+        if Timestamp.from_nanosec(time_ns) not in segment_timerange:
+            return None
+        column = (time_ns - start_ns) * columns // duration_ns
+        return column if 0 <= column < columns else None
+
+    for segment, summary in summaries:
+        segment_timerange = TimeRange.from_str(segment["timerange"])
+        ts_offset = Timestamp.from_str(segment.get("ts_offset") or "0:0")
+        summary_start_ns = (Timestamp.from_str(summary["start"]) + ts_offset).to_nanosec()
+        peak_ns = 1000000000 // summary["peaks_per_second"]
+        for channel_peaks in summary["peaks"]:
+            for index in range(0, len(channel_peaks), 2):
+                column = get_column(segment_timerange, summary_start_ns + index // 2 * peak_ns)
+                if column is None:
+                    continue
+                column_peaks = peaks[column]
+                if column_peaks is None:
+                    peaks[column] = channel_peaks[index:index + 2]
+                else:
+                    column_peaks[0] = min(column_peaks[0], channel_peaks[index])
+                    column_peaks[1] = max(column_peaks[1], channel_peaks[index + 1])
+
+        interval_ns = int(LOUDNESS_INTERVAL * 1000000000)
+        for index, value in enumerate(summary["momentary_loudness"]):
+            column = get_column(segment_timerange, summary_start_ns + index * interval_ns)
+            if column is not None:
+                column_loudness = loudness[column]
+                loudness[column] = value if column_loudness is None else max(column_loudness, value)
+
+    return {"timerange": str(timerange), "columns": columns, "peaks": peaks, "momentary_loudness": loudness}
+
+
+async def get_summaries(
+    client: TAMSClient,
+    tams_url: str,
+    waveform_flow_id: UUID,
+    timerange: TimeRange,
+    concurrency: int = 8,
+    cache: Optional[MediaObjectCache] = None
+) -> list[tuple[dict, dict]]:
+    """Download the summaries of the waveform Flow's segments in the timerange, as (segment, summary) tuples
+
+    The summaries are fetched through the `cache` if set.
+    """
+    segments_url = f"{tams_url}/flows/{waveform_flow_id}/segments?timerange={quote(str(timerange))}&presigned=true"
+    segments: list[dict] = []
+    async for page in client.get_paged_items(segments_url):
+        segments.extend(page)
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def get_summary(segment: dict) -> tuple[dict, dict]:
+        async with semaphore:
+            if cache is not None:
+                data = await cache.fetch(client.session, segment["object_id"], get_download_url(segment))
+            else:
+                async with client.session.get(get_download_url(segment)) as resp:
+                    resp.raise_for_status()
+                    data = await resp.read()
+        return segment, json.loads(data)
+
+    return await asyncio.gather(*(get_summary(segment) for segment in segments))
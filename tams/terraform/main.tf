@@ -133,6 +133,7 @@ resource "google_firestore_index" "segments_start_index" {
   }
 }
 
+# Also used by segment listings with a timerange to find the segment that overlaps its start
 resource "google_firestore_index" "segments_end_index" {
   depends_on = [google_firestore_database.tams_db]
   project    = var.project_id
@@ -35,9 +35,17 @@ class MockDocumentReference:
     def set(self, data, merge=False):
         col = self.db_state.setdefault(self.collection_name, {})
         if merge and self.id in col:
-            col[self.id].update(data)
+            doc_data = col[self.id]
+            for key, val in data.items():
+                if isinstance(val, Increment):
+                    doc_data[key] = doc_data.get(key, 0) + val.value
+                else:
+                    doc_data[key] = val
         else:
-            col[self.id] = dict(data)
+            col[self.id] = {
+                key: val.value if isinstance(val, Increment) else val
+                for key, val in data.items()
+            }
 
     def update(self, data):
         col = self.db_state.setdefault(self.collection_name, {})
@@ -67,24 +75,52 @@ class MockDocumentReference:
             del col[self.id]
 
 class MockQuery:
-    def __init__(self, collection_name, db_state, filters=None, limit_val=None):
+    def __init__(self, collection_name, db_state, filters=None, limit_val=None, start_after_id=None,
+                 field_paths=None, order=None):
         self.collection_name = collection_name
         self.db_state = db_state
         self.filters = filters or []
         self.limit_val = limit_val
+        self.start_after_id = start_after_id
+        self.field_paths = field_paths
+        self.order = order
+
+    def _copy(self, **kwargs):
+        args = {
+            "filters": self.filters,
+            "limit_val": self.limit_val,
+            "start_after_id": self.start_after_id,
+            "field_paths": self.field_paths,
+            "order": self.order,
+        }
+        args.update(kwargs)
+        return MockQuery(self.collection_name, self.db_state, **args)
 
     def where(self, field, operator, value):
         new_filters = list(self.filters)
         new_filters.append((field, operator, value))
-        return MockQuery(self.collection_name, self.db_state, new_filters, self.limit_val)
+        return self._copy(filters=new_filters)
 
     def limit(self, limit):
-        return MockQuery(self.collection_name, self.db_state, self.filters, limit)
+        return self._copy(limit_val=limit)
+
+    def start_after(self, snapshot):
+        return self._copy(start_after_id=snapshot.id)
+
+    def select(self, field_paths):
+        return self._copy(field_paths=list(field_paths))
+
+    def order_by(self, field, direction=None):
+        return self._copy(order=(field, direction == MockQueryDirections.DESCENDING))
 
     def get(self):
         col = self.db_state.setdefault(self.collection_name, {})
         results = []
-        for doc_id, data in col.items():
+        # Firestore orders results by document ID when no other ordering is given
+        for doc_id in sorted(col):
+            if self.start_after_id is not None and doc_id <= self.start_after_id:
+                continue
+            data = col[doc_id]
             match = True
             for field, op, value in self.filters:
                 val = data.get(field)
@@ -109,8 +145,19 @@ class MockQuery:
                         match = False
                         break
             if match:
-                ref = MockDocumentReference(self.collection_name, doc_id, self.db_state)
-                results.append(MockDocumentSnapshot(doc_id, dict(data), True, ref))
+                results.append((doc_id, data))
+        if self.order is not None:
+            # Documents without the ordering field are excluded, as in Firestore
+            field, descending = self.order
+            results = [(doc_id, data) for doc_id, data in results if data.get(field) is not None]
+            results.sort(key=lambda item: item[1][field], reverse=descending)
+        snapshots = []
+        for doc_id, data in results:
+            ref = MockDocumentReference(self.collection_name, doc_id, self.db_state)
+            if self.field_paths is not None:
+                data = {key: data[key] for key in self.field_paths if key in data}
+            snapshots.append(MockDocumentSnapshot(doc_id, dict(data), True, ref))
+        results = snapshots
         if self.limit_val is not None:
             results = results[:self.limit_val]
         return results
@@ -140,12 +187,27 @@ class MockCollectionReference:
     def where(self, field, operator, value):
         return MockQuery(self.name, self.db_state).where(field, operator, value)
 
+    def select(self, field_paths):
+        return MockQuery(self.name, self.db_state).select(field_paths)
+
     def get(self):
         return MockQuery(self.name, self.db_state).get()
 
     def stream(self):
         return self.get()
 
+class MockWriteBatch:
+    def __init__(self):
+        self.writes = []
+
+    def set(self, doc_ref, data, merge=False):
+        self.writes.append((doc_ref, data, merge))
+
+    def commit(self):
+        for doc_ref, data, merge in self.writes:
+            doc_ref.set(data, merge=merge)
+        self.writes = []
+
 class MockFirestoreClient:
     def __init__(self, database="(default)", *args, **kwargs):
         self.database = database
@@ -154,11 +216,24 @@ class MockFirestoreClient:
     def collection(self, name):
         return MockCollectionReference(name, self.db_state)
 
+    def batch(self):
+        return MockWriteBatch()
+
 DELETE_FIELD = object()
 
+class MockQueryDirections:
+    ASCENDING = "ASCENDING"
+    DESCENDING = "DESCENDING"
+
+class Increment:
+    def __init__(self, value):
+        self.value = value
+
 class MockFirestoreModule:
     Client = MockFirestoreClient
     DELETE_FIELD = DELETE_FIELD
+    Increment = Increment
+    Query = MockQueryDirections
 
 # Inject into sys.modules and google package namespaces
 import google
@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, AdmissionControlMiddleware, AdmissionRejected
+
+
+def test_flow_limit_queues_until_release():
+    async def scenario():
+        controller = AdmissionController(global_limit=4, flow_limit=1, queue_size=4, queue_timeout=1)
+        await controller.acquire("flow-1")
+
+        waiting = asyncio.ensure_future(controller.acquire("flow-1"))
+        await asyncio.sleep(0)
+        assert controller.stats()["queue_depth"] == 1
+
+        # Other flows are not held up by the queued request
+        await controller.acquire("flow-2")
+
+        controller.release("flow-1")
+        await asyncio.wait_for(waiting, 1)
+        stats = controller.stats()
+        assert stats["in_flight"] == 2
+        assert stats["queue_depth"] == 0
+        assert stats["admitted"] == 3
+
+    asyncio.run(scenario())
+
+
+def test_rejects_when_queue_full_or_timed_out():
+    async def scenario():
+        controller = AdmissionController(global_limit=1, flow_limit=1, queue_size=1, queue_timeout=0.05)
+        await controller.acquire("flow-1")
+
+        waiting = asyncio.ensure_future(controller.acquire("flow-2"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(AdmissionRejected):
+            await controller.acquire("flow-3")
+
+        with pytest.raises(AdmissionRejected):
+            await waiting
+
+        stats = controller.stats()
+        assert stats["rejected"] == 2
+        assert stats["queue_depth"] == 0
+        assert stats["rejection_rate_per_second"] > 0
+
+    asyncio.run(scenario())
+
+
+def test_middleware_returns_429_and_passes_reads():
+    calls = []
+
+    async def downstream(scope, receive, send):
+        calls.append(scope["path"])
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def scenario():
+        controller = AdmissionController(global_limit=1, flow_limit=1, queue_size=0, queue_timeout=1)
+        middleware = AdmissionControlMiddleware(downstream, controller, retry_after=3)
+        await controller.acquire("flow-1")
+
+        write_scope = {"type": "http", "method": "POST", "path": "/flows/flow-1/segments", "headers": []}
+        await middleware(write_scope, receive, send)
+        assert sent[0]["status"] == 429
+        assert (b"retry-after", b"3") in sent[0]["headers"]
+
+        read_scope = {"type": "http", "method": "GET", "path": "/flows/flow-1/segments", "headers": []}
+        await middleware(read_scope, receive, send)
+        assert calls == ["/flows/flow-1/segments"]
+
+        controller.release("flow-1")
+        await middleware(write_scope, receive, send)
+        assert calls == ["/flows/flow-1/segments", "/flows/flow-1/segments"]
+        assert controller.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_metrics_include_admission(client):
+    response = client.get("/service/metrics")
+    assert response.status_code == 200
+    assert response.json()["admission"]["in_flight"] == 0
@@ -0,0 +1,151 @@
+import gzip
+import json
+import time
+
+import pytest
+
+from app.bulk import export_ndjson_gz, import_ndjson
+
+
+@pytest.fixture
+def admin_enabled(monkeypatch):
+    import app.main
+    monkeypatch.setattr(app.main, "ADMIN_ENDPOINTS_ENABLED", True)
+
+
+def seed_store(mock_db, segment_count=5):
+    mock_db.collection("sources").document("source-1").set({"id": "source-1", "format": "urn:x-nmos:format:video"})
+    mock_db.collection("flows").document("flow-1").set({
+        "id": "flow-1",
+        "source_id": "source-1",
+        "format": "urn:x-nmos:format:video"
+    })
+    for i in range(segment_count):
+        mock_db.collection("segments").document(f"seg-{i:06d}").set({
+            "object_id": f"obj-{i}",
+            "flow_id": "flow-1",
+            "timerange": f"[{i}:0_{i + 1}:0)",
+            "timerange_start": i * 1000000000,
+            "timerange_end": (i + 1) * 1000000000 - 1
+        })
+
+
+def make_lines(segment_count):
+    lines = [
+        json.dumps({"collection": "sources", "id": "source-1", "data": {"id": "source-1", "format": "f"}}).encode(),
+        json.dumps({"collection": "flows", "id": "flow-1", "data": {"id": "flow-1", "source_id": "source-1"}}).encode(),
+    ]
+    for i in range(segment_count):
+        lines.append(json.dumps({
+            "collection": "segments",
+            "id": f"seg-{i:06d}",
+            "data": {"object_id": f"obj-{i}", "flow_id": "flow-1", "timerange": f"[{i}:0_{i + 1}:0)"}
+        }).encode())
+    return lines
+
+
+def test_export_import_roundtrip(client, mock_db, admin_enabled):
+    seed_store(mock_db, segment_count=25)
+
+    response = client.get("/admin/export?page_size=10")
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/gzip"
+    exported = response.content
+    records = [json.loads(line) for line in gzip.decompress(exported).splitlines()]
+    assert [r["collection"] for r in records[:2]] == ["sources", "flows"]
+    assert len(records) == 27
+
+    original_state = json.loads(json.dumps(mock_db.db_state))
+    mock_db.db_state.clear()
+
+    response = client.post("/admin/import", content=exported)
+    assert response.status_code == 200
+    assert response.json()["imported"] == {"sources": 1, "flows": 1, "segments": 25}
+    for collection in ["sources", "flows", "segments"]:
+        assert mock_db.db_state[collection] == original_state[collection]
+
+
+def test_export_is_streamed_in_chunks(mock_db, monkeypatch):
+    import app.bulk
+    monkeypatch.setattr(app.bulk, "EXPORT_CHUNK_SIZE", 1024)
+    seed_store(mock_db, segment_count=200)
+
+    chunks = list(export_ndjson_gz(mock_db, page_size=50))
+    assert len(chunks) > 1
+    assert len(gzip.decompress(b"".join(chunks)).splitlines()) == 202
+
+
+def test_import_resumes_from_checkpoint(mock_db):
+    lines = make_lines(segment_count=10)
+    checkpoints = []
+
+    imported = import_ndjson(mock_db, lines, checkpoint={"sources": 1, "flows": 1, "segments": 6},
+                             on_checkpoint=checkpoints.append, batch_size=2, workers=2)
+    assert imported == {"sources": 0, "flows": 0, "segments": 4}
+    assert sorted(mock_db.db_state["segments"]) == ["seg-000006", "seg-000007", "seg-000008", "seg-000009"]
+    assert checkpoints[-1] == {"sources": 1, "flows": 1, "segments": 10}
+
+
+def test_import_endpoint_resumes_with_import_id(client, mock_db, admin_enabled):
+    body = b"\n".join(make_lines(segment_count=3))
+    mock_db.collection("bulk_import_checkpoints").document("import-1").set({"sources": 1, "flows": 1, "segments": 2})
+
+    response = client.post("/admin/import?import_id=import-1", content=body)
+    assert response.status_code == 200
+    assert response.json()["imported"] == {"sources": 0, "flows": 0, "segments": 1}
+    assert mock_db.collection("bulk_import_checkpoints").document("import-1").get().to_dict() == {
+        "sources": 1, "flows": 1, "segments": 3
+    }
+
+
+def test_import_rejects_unknown_collections(client, mock_db, admin_enabled):
+    body = json.dumps({"collection": "webhooks", "id": "w", "data": {}}).encode()
+    response = client.post("/admin/import", content=body)
+    assert response.status_code == 400
+    assert "Unsupported collection" in response.json()["detail"]
+
+
+def test_import_rebuilds_flow_stats(client, mock_db, admin_enabled):
+    seed_store(mock_db, segment_count=4)
+    mock_db.collection("segments").document("seg-000000").update({"object_size": 1000})
+    exported = client.get("/admin/export").content
+    mock_db.db_state.clear()
+    # Stale counters, e.g. from segments that were deleted before the import
+    mock_db.collection("flow_stats_shards").document("flow-1:3").set({"flow_id": "flow-1", "segment_count": 7})
+
+    response = client.post("/admin/import", content=exported)
+    assert response.status_code == 200
+
+    response = client.get("/flows/flow-1/stats")
+    assert response.json() == {"segment_count": 4, "total_duration": "4:0", "total_bytes": 1000}
+
+    # Replaying the import doesn't count the segments twice
+    assert client.post("/admin/import", content=exported).status_code == 200
+    assert client.get("/flows/flow-1/stats").json()["segment_count"] == 4
+
+
+def test_admin_endpoints_are_disabled_by_default(client, mock_db):
+    assert client.get("/admin/export").status_code == 403
+    assert client.post("/admin/import", content=b"\n".join(make_lines(segment_count=1))).status_code == 403
+    assert "segments" not in mock_db.db_state
+
+
+def test_admin_endpoints_require_api_key_when_set(client, mock_db, admin_enabled, monkeypatch):
+    import app.main
+    monkeypatch.setattr(app.main, "ADMIN_API_KEY", "admin-secret")
+
+    assert client.get("/admin/export").status_code == 401
+    assert client.get("/admin/export", headers={"X-Admin-Api-Key": "wrong"}).status_code == 401
+    assert client.get("/admin/export", headers={"X-Admin-Api-Key": "admin-secret"}).status_code == 200
+
+
+def test_import_throughput(mock_db):
+    lines = make_lines(segment_count=50000)
+
+    start = time.perf_counter()
+    imported = import_ndjson(mock_db, lines)
+    elapsed = time.perf_counter() - start
+
+    assert imported["segments"] == 50000
+    assert len(mock_db.db_state["segments"]) == 50000
+    print(f"Imported {imported['segments'] / elapsed:.0f} segments/sec")
@@ -0,0 +1,67 @@
+import gzip
+
+import pytest
+
+import app.compression
+from app.compression import choose_encoding
+
+
+@pytest.mark.parametrize("accept_encoding,expected", [
+    ("", None),
+    ("identity", None),
+    ("gzip", "gzip"),
+    ("gzip, deflate, br", "br"),
+    ("br;q=0.5, gzip", "gzip"),
+    ("br;q=0, gzip;q=0", None),
+    ("*", "br"),
+])
+def test_choose_encoding(accept_encoding, expected):
+    if expected == "br":
+        pytest.importorskip("brotli")
+    assert choose_encoding(accept_encoding) == expected
+
+
+def test_choose_encoding_without_brotli(monkeypatch):
+    monkeypatch.setattr(app.compression, "brotli", None)
+    assert choose_encoding("gzip, deflate, br") == "gzip"
+    assert choose_encoding("br") is None
+
+
+def seed_segments(mock_db, count):
+    for i in range(count):
+        mock_db.collection("segments").document(f"s{i:04d}").set({
+            "object_id": f"obj-{i}",
+            "flow_id": "flow-1",
+            "timerange": f"[{i}:0_{i + 1}:0)",
+            "timerange_start": i * 1000000000,
+            "timerange_end": (i + 1) * 1000000000 - 1
+        })
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_large_listing_is_compressed(client, mock_db, encoding):
+    if encoding == "br":
+        pytest.importorskip("brotli")
+    seed_segments(mock_db, 50)
+
+    response = client.get("/flows/flow-1/segments?presigned=true", headers={"Accept-Encoding": encoding})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == encoding
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert len(response.json()) == 50
+    assert int(response.headers["content-length"]) < len(response.content)
+
+
+def test_small_response_is_not_compressed(client, mock_db):
+    response = client.get("/flows/flow-1/segments", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+
+def test_export_is_not_compressed_twice(client, mock_db, monkeypatch):
+    import app.main
+    monkeypatch.setattr(app.main, "ADMIN_ENDPOINTS_ENABLED", True)
+    seed_segments(mock_db, 50)
+    response = client.get("/admin/export", headers={"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert gzip.decompress(response.content).count(b"\n") == 50
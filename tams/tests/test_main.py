@@ -277,6 +277,29 @@ def test_put_flow_create_and_update(client, mock_db):
     assert flow_doc["metadata_updated"] is not None
 
 
+def test_put_flow_collection_links_sources(client, mock_db):
+    for flow_id in ["flow-720p", "flow-1080p"]:
+        response = client.put(f"/flows/{flow_id}", json={
+            "id": flow_id,
+            "source_id": "source-video",
+            "format": "urn:x-nmos:format:video"
+        })
+        assert response.status_code == 201
+
+    response = client.put("/flows/flow-collection", json={
+        "id": "flow-collection",
+        "source_id": "source-collection",
+        "format": "urn:x-nmos:format:multi",
+        "flow_collection": [{"id": "flow-720p", "role": "720p"}, {"id": "flow-1080p", "role": "1080p"}]
+    })
+    assert response.status_code == 201
+
+    collection_source = client.get("/sources/source-collection").json()
+    assert collection_source["format"] == "urn:x-nmos:format:multi"
+    assert collection_source["source_collection"] == [{"id": "source-video", "role": "video"}]
+    assert client.get("/sources/source-video").json()["collected_by"] == ["source-collection"]
+
+
 def test_delete_flow(client, mock_db):
     mock_db.collection("flows").document("flow-1").set({
         "id": "flow-1",
@@ -441,6 +464,69 @@ def test_get_flow_segments_filter_and_invalid_timerange(client, mock_db):
     assert "Invalid timerange parameter" in response.json()["detail"]
 
 
+def test_get_flow_segments_paging(client, mock_db):
+    # Document IDs are in the reverse of timeline order, so paging can't rely on document order
+    for i in range(250):
+        mock_db.collection("segments").document(f"s{999 - i:03d}").set({
+            "object_id": f"obj-{i}",
+            "flow_id": "flow-1",
+            "timerange": f"[{i}:0_{i + 1}:0)",
+            "timerange_start": i * 1000000000,
+            "timerange_end": (i + 1) * 1000000000 - 1
+        })
+
+    object_ids = []
+    url = "/flows/flow-1/segments?timerange=[10:500000000_200:0)&limit=50"
+    pages = 0
+    while url is not None:
+        response = client.get(url)
+        assert response.status_code == 200
+        assert response.headers["x-paging-limit"] == "50"
+        object_ids.extend(segment["object_id"] for segment in response.json())
+        pages += 1
+        url = response.links["next"]["url"] if "next" in response.links else None
+
+    assert pages == 4
+    assert object_ids == [f"obj-{i}" for i in range(10, 200)]
+
+    # Listing without a timerange also pages, including with field projection
+    response = client.get("/flows/flow-1/segments?fields=object_id")
+    assert [segment["object_id"] for segment in response.json()] == [f"obj-{i}" for i in range(100)]
+    assert response.headers["x-paging-nextkey"] == str(99 * 1000000000)
+    response = client.get(response.links["next"]["url"])
+    assert response.json()[0] == {"object_id": "obj-100"}
+
+    response = client.get("/flows/flow-1/segments?page=invalid")
+    assert response.status_code == 400
+
+
+def test_get_and_delete_flow_segments_unbounded_timerange(client, mock_db):
+    for i in range(10):
+        mock_db.collection("segments").document(f"s{i}").set({
+            "object_id": f"obj-{i}",
+            "flow_id": "flow-1",
+            "timerange": f"[{i}:0_{i + 1}:0)",
+            "timerange_start": i * 1000000000,
+            "timerange_end": (i + 1) * 1000000000 - 1
+        })
+
+    def get_object_ids(timerange):
+        response = client.get(f"/flows/flow-1/segments?timerange={timerange}")
+        assert response.status_code == 200
+        return [segment["object_id"] for segment in response.json()]
+
+    assert get_object_ids("_") == [f"obj-{i}" for i in range(10)]
+    assert get_object_ids("[7:500000000_") == ["obj-7", "obj-8", "obj-9"]
+    assert get_object_ids("_2:0)") == ["obj-0", "obj-1"]
+
+    response = client.delete("/flows/flow-1/segments?timerange=[8:0_")
+    assert response.status_code == 204
+    assert get_object_ids("_") == [f"obj-{i}" for i in range(8)]
+
+    response = client.get("/flows/flow-1/segments?timerange=()")
+    assert response.status_code == 400
+
+
 def test_get_flow_segments_presigned_with_service_account(client, mock_db):
     mock_db.collection("segments").document("s1").set({
         "object_id": "obj-1",
@@ -752,3 +838,187 @@ def test_webhooks_key_encryption_in_firestore(client, mock_db):
     from app.main import decrypt_val
     decrypted = decrypt_val(firestore_data["api_key_value"])
     assert decrypted == "secret-plaintext-key-value-12345"
+
+
+def test_allocate_flow_storage_from_pool(client, mock_db, monkeypatch):
+    import app.main
+    from app.storage_pool import StorageAllocationPool
+
+    mock_db.collection("flows").document("flow-alloc").set({
+        "id": "flow-alloc",
+        "source_id": "source-1",
+        "format": "urn:x-tams:format.video"
+    })
+
+    pool = StorageAllocationPool(app.main.sign_media_object_allocations, depth=3, ttl_seconds=600, idle_seconds=600)
+    pool._ensure_refill_thread = lambda: None
+    monkeypatch.setattr(app.main, "storage_pool", pool)
+
+    response = client.post("/flows/flow-alloc/storage", json={"limit": 1})
+    assert response.status_code == 201
+    pool.refill()
+
+    response = client.post("/flows/flow-alloc/storage", json={"limit": 2})
+    assert response.status_code == 201
+    data = response.json()
+    assert len(data["media_objects"]) == 2
+    assert "method=PUT" in data["media_objects"][0]["put_url"]["url"]
+
+    response = client.get("/service/metrics")
+    assert response.status_code == 200
+    stats = response.json()["storage_pool"]
+    assert stats["served_from_pool"] == 2
+    assert stats["flows"] == {"flow-alloc": 1}
+
+    # Resumable allocations are signed on demand rather than taken from the pool of PUT URLs
+    response = client.post("/flows/flow-alloc/storage", json={"limit": 2, "resumable": True})
+    assert response.status_code == 201
+    data = response.json()
+    assert len(data["media_objects"]) == 2
+    assert all("method=RESUMABLE" in item["put_url"]["url"] for item in data["media_objects"])
+    assert client.get("/service/metrics").json()["storage_pool"]["served_from_pool"] == 2
+
+
+# ----------------- TESTS FOR FLOW STATS ENDPOINT -----------------
+
+def test_flow_stats_follow_segment_create_and_delete(client, mock_db):
+    mock_db.collection("flows").document("flow-stats").set({
+        "id": "flow-stats",
+        "source_id": "source-1",
+        "format": "urn:x-tams:format.video"
+    })
+
+    response = client.get("/flows/flow-stats/stats")
+    assert response.status_code == 200
+    assert response.json() == {"segment_count": 0, "total_duration": "0:0", "total_bytes": 0}
+
+    response = client.post("/flows/flow-stats/segments", json=[
+        {"object_id": "obj-1", "timerange": "[0:0_10:0)", "object_size": 1000},
+        {"object_id": "obj-2", "timerange": "[10:0_15:500000000)", "object_size": 500},
+        {"object_id": "obj-3", "timerange": "[5:0_6:0)", "object_size": 200},  # overlaps, not counted
+    ])
+    assert response.status_code == 200
+
+    response = client.get("/flows/flow-stats/stats")
+    assert response.json() == {"segment_count": 2, "total_duration": "15:500000000", "total_bytes": 1500}
+
+    response = client.delete("/flows/flow-stats/segments?timerange=[0:0_10:0)")
+    assert response.status_code == 204
+
+    response = client.get("/flows/flow-stats/stats")
+    assert response.json() == {"segment_count": 1, "total_duration": "5:500000000", "total_bytes": 500}
+
+
+def test_flow_stats_are_sharded(client, mock_db, monkeypatch):
+    import app.main
+    monkeypatch.setattr(app.main, "FLOW_STATS_SHARDS", 4)
+
+    mock_db.collection("flows").document("flow-stats").set({
+        "id": "flow-stats",
+        "source_id": "source-1",
+        "format": "urn:x-tams:format.video"
+    })
+    for i in range(40):
+        response = client.post("/flows/flow-stats/segments", json={"object_id": f"obj-{i}", "timerange": f"[{i}:0_{i + 1}:0)"})
+        assert response.status_code == 201
+
+    shards = mock_db.collection("flow_stats_shards").get()
+    assert 1 < len(shards) <= 4
+    assert client.get("/flows/flow-stats/stats").json()["segment_count"] == 40
+
+
+def test_flow_stats_are_deleted_with_flow(client, mock_db):
+    mock_db.collection("flows").document("flow-stats").set({
+        "id": "flow-stats",
+        "source_id": "source-1",
+        "format": "urn:x-tams:format.video"
+    })
+    response = client.post("/flows/flow-stats/segments", json={"object_id": "obj-1", "timerange": "[0:0_1:0)"})
+    assert response.status_code == 201
+    assert mock_db.collection("flow_stats_shards").get()
+
+    response = client.delete("/flows/flow-stats")
+    assert response.status_code == 204
+    assert mock_db.collection("flow_stats_shards").get() == []
+
+
+def test_flow_stats_nonexistent_flow(client):
+    response = client.get("/flows/flow-nonexistent/stats")
+    assert response.status_code == 404
+
+
+# ----------------- TESTS FOR FIELD PROJECTION -----------------
+
+def test_get_flow_segments_field_projection(client, mock_db):
+    mock_db.collection("segments").document("s1").set({
+        "object_id": "obj-1",
+        "flow_id": "flow-1",
+        "timerange": "[100:0_200:0)",
+        "ts_offset": "0:0",
+        "timerange_start": 100000000000,
+        "timerange_end": 199999999999
+    })
+
+    response = client.get("/flows/flow-1/segments?fields=object_id")
+    assert response.status_code == 200
+    assert response.json() == [{"object_id": "obj-1"}]
+
+    response = client.get("/flows/flow-1/segments?fields=timerange&timerange=[150:0_160:0)")
+    assert response.json() == [{"timerange": "[100:0_200:0)"}]
+
+    # get_urls are only signed when requested in the projection
+    response = client.get("/flows/flow-1/segments?fields=object_id&presigned=true")
+    assert response.json() == [{"object_id": "obj-1"}]
+    response = client.get("/flows/flow-1/segments?fields=object_id,get_urls&presigned=true")
+    assert "mock_signed=true" in response.json()[0]["get_urls"][0]["url"]
+
+    response = client.get("/flows/flow-1/segments?fields=object_id,flow_id")
+    assert response.status_code == 400
+    assert "flow_id" in response.json()["detail"]
+
+
+def test_get_flows_and_sources_field_projection(client, mock_db):
+    mock_db.collection("flows").document("flow-1").set({
+        "id": "flow-1",
+        "source_id": "source-1",
+        "format": "urn:x-tams:format.video",
+        "label": "Flow One",
+        "tags": {"auth_classes": ["news_read"]}
+    })
+    mock_db.collection("sources").document("source-1").set({
+        "id": "source-1",
+        "format": "urn:x-tams:format.video",
+        "label": "Source One"
+    })
+
+    response = client.get("/flows?fields=id,tags")
+    assert response.status_code == 200
+    assert response.json() == [{"id": "flow-1", "tags": {"auth_classes": ["news_read"]}}]
+
+    response = client.get("/sources?fields=id,tags")
+    assert response.json() == [{"id": "source-1"}]
+
+    response = client.get("/sources?fields=")
+    assert response.status_code == 400
+
+
+def test_segments_updated_follows_segment_create_and_delete(client, mock_db):
+    mock_db.collection("flows").document("flow-updated").set({
+        "id": "flow-updated",
+        "source_id": "source-1",
+        "format": "urn:x-tams:format.video"
+    })
+    assert "segments_updated" not in client.get("/flows/flow-updated").json()
+
+    response = client.post("/flows/flow-updated/segments", json={"object_id": "obj-1", "timerange": "[0:0_10:0)"})
+    assert response.status_code == 201
+    created = client.get("/flows/flow-updated").json()["segments_updated"]
+
+    # Segments that fail to register don't change the flow's segments
+    response = client.post("/flows/flow-updated/segments", json={"object_id": "obj-2", "timerange": "[5:0_6:0)"})
+    assert response.status_code == 200
+    assert client.get("/flows/flow-updated").json()["segments_updated"] == created
+
+    response = client.delete("/flows/flow-updated/segments")
+    assert response.status_code == 204
+    assert client.get("/flows/flow-updated").json()["segments_updated"] >= created
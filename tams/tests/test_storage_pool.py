@@ -0,0 +1,82 @@
+import time
+
+from app.storage_pool import StorageAllocationPool, _FlowPool
+
+
+def make_allocator():
+    calls = []
+
+    def allocate(flow_id, count):
+        calls.append((flow_id, count))
+        return [{"object_id": f"{flow_id}-{len(calls)}-{i}", "put_url": {"url": "u", "content-type": "video/mp2t"}}
+                for i in range(count)]
+    return allocate, calls
+
+
+def test_take_signs_inline_when_pool_empty():
+    allocate, calls = make_allocator()
+    pool = StorageAllocationPool(allocate, depth=4, ttl_seconds=600, idle_seconds=600)
+    pool._ensure_refill_thread = lambda: None
+
+    media_objects = pool.take("flow-1", 2)
+    assert len(media_objects) == 2
+    assert calls == [("flow-1", 2)]
+    assert pool.stats()["signed_inline"] == 2
+
+
+def test_refill_tops_up_and_serves_from_pool():
+    allocate, calls = make_allocator()
+    pool = StorageAllocationPool(allocate, depth=4, ttl_seconds=600, idle_seconds=600, refill_batch=3)
+    pool._ensure_refill_thread = lambda: None
+
+    pool.take("flow-1", 1)
+    pool.refill()
+    assert calls[1:] == [("flow-1", 3), ("flow-1", 1)]
+    assert pool.stats()["flows"] == {"flow-1": 4}
+
+    media_objects = pool.take("flow-1", 3)
+    assert len(media_objects) == 3
+    assert len(calls) == 3
+    stats = pool.stats()
+    assert stats["served_from_pool"] == 3
+    assert stats["flows"] == {"flow-1": 1}
+    assert stats["refilled"] == 4
+    assert stats["refill_rate_per_second"] > 0
+
+
+def test_expired_allocations_are_discarded():
+    allocate, calls = make_allocator()
+    pool = StorageAllocationPool(allocate, depth=2, ttl_seconds=0.01, idle_seconds=600)
+    pool._ensure_refill_thread = lambda: None
+
+    pool.take("flow-1", 1)
+    pool.refill()
+    pooled_ids = {entry[1]["object_id"] for entry in pool._pools["flow-1"].entries}
+    time.sleep(0.02)
+
+    media_objects = pool.take("flow-1", 2)
+    assert not pooled_ids & {m["object_id"] for m in media_objects}
+    assert pool.stats()["expired_discards"] == 2
+    assert pool.stats()["signed_inline"] == 3
+
+
+def test_idle_flows_are_not_refilled():
+    allocate, calls = make_allocator()
+    pool = StorageAllocationPool(allocate, depth=2, ttl_seconds=600, idle_seconds=0)
+    pool._ensure_refill_thread = lambda: None
+
+    pool.take("flow-1", 1)
+    time.sleep(0.01)
+    pool.refill()
+    assert pool.stats()["flows"] == {}
+    assert len(calls) == 1
+
+
+def test_refill_errors_are_counted():
+    def allocate(flow_id, count):
+        raise RuntimeError("signing failed")
+
+    pool = StorageAllocationPool(allocate, depth=2, ttl_seconds=600, idle_seconds=600)
+    pool._pools["flow-1"] = _FlowPool()
+    pool.refill()
+    assert pool.stats()["refill_errors"] == 1